@@ -31,5 +31,6 @@ Functions for peak fitting
 from hexrd.hedm.fitting import grains
 
 fitGrain = grains.fitGrain
+fitGrains = grains.fitGrains
 objFuncFitGrain = grains.objFuncFitGrain
 gFlag_ref = grains.gFlag_ref
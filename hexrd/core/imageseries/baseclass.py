@@ -48,6 +48,13 @@ class ImageSeries(ImageSeriesABC):
     def get_region(self, frame_idx: int, region: RegionType) -> np.ndarray:
         return self._adapter.get_region(frame_idx, region)
 
+    def get_frames(self, key) -> np.ndarray:
+        """3-d array of the frames selected by a slice, range or index array
+
+        Adapters that support it read all of the frames in one operation.
+        """
+        return self._adapter.get_frames(key)
+
     def set_option(self, key: str, value: Any):
         if not hasattr(self._adapter, 'set_option'):
             msg = f'"{type(self._adapter)}" has not implemented "set_option"'
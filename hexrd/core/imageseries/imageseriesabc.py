@@ -2,9 +2,21 @@
 
 import collections.abc
 
+from .imageseriesiter import DEFAULT_PREFETCH_DEPTH, PrefetchIterator
+
 # Type for extracting regions
 RegionType = tuple[tuple[int, int], tuple[int, int]]
 
 
 class ImageSeriesABC(collections.abc.Sequence):
-    pass
+
+    def prefetch(self, depth=None, max_workers=None, frames=None):
+        """Iterate over frames, reading ahead in background threads
+
+        See `imageseriesiter.PrefetchIterator`.
+        """
+        if depth is None:
+            depth = DEFAULT_PREFETCH_DEPTH
+        return PrefetchIterator(
+            self, depth=depth, max_workers=max_workers, frames=frames
+        )
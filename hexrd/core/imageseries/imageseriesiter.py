@@ -4,19 +4,112 @@ For use by adapter classes.
 """
 
 import collections.abc
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_PREFETCH_DEPTH = 4
 
 
 class ImageSeriesIterator(collections.abc.Iterator):
 
     def __init__(self, iterable):
         self._iterable = iterable
-        self._remaining = list(range(len(iterable)))
+        self._next = 0
+        self._len = len(iterable)
 
     def __iter__(self):
         return self
 
     def __next__(self):
-        try:
-            return self._iterable[self._remaining.pop(0)]
-        except IndexError:
+        if self._next >= self._len:
+            raise StopIteration
+        self._next += 1
+        return self._iterable[self._next - 1]
+
+
+class PrefetchIterator(collections.abc.Iterator):
+    """Iterator that reads frames ahead in background threads
+
+    Frames are requested from a thread pool up to `depth` frames ahead of
+    the consumer, so that I/O and decompression overlap with whatever the
+    consumer does with each frame. Frames are returned in order.
+
+    Parameters
+    ----------
+    iterable: sequence
+       an imageseries, or anything else indexed by frame number
+    depth: int, optional
+       the number of frames to read ahead
+    max_workers: int, optional
+       the number of reading threads; defaults to `depth`
+    frames: sequence of int, optional
+       the frames to iterate over; defaults to all frames
+
+    The thread pool is shut down when the iterator is exhausted or closed;
+    the iterator can also be used as a context manager.
+    """
+
+    def __init__(
+        self, iterable, depth=DEFAULT_PREFETCH_DEPTH, max_workers=None, frames=None
+    ):
+        # set before validating, so that close() works on a failed init
+        self._pending = deque()
+        self._executor = None
+        self._closed = False
+
+        if depth < 1:
+            raise ValueError(f"prefetch depth must be positive: {depth}")
+
+        self._iterable = iterable
+        self._depth = depth
+        self._max_workers = max_workers if max_workers else depth
+        self._frames = iter(range(len(iterable)) if frames is None else frames)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._closed:
             raise StopIteration
+
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self._max_workers)
+        self._fill()
+
+        if not self._pending:
+            self.close()
+            raise StopIteration
+
+        future = self._pending.popleft()
+        self._fill()
+        try:
+            return future.result()
+        except BaseException:
+            self.close()
+            raise
+
+    def _fill(self):
+        while len(self._pending) < self._depth:
+            i = next(self._frames, None)
+            if i is None:
+                break
+            self._pending.append(self._executor.submit(self._iterable.__getitem__, i))
+
+    def close(self):
+        """cancel any frames not yet read and shut down the thread pool"""
+        self._closed = True
+        for future in self._pending:
+            future.cancel()
+        self._pending.clear()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __del__(self):
+        self.close()
@@ -21,10 +21,36 @@ class ImageSeriesAdapter(ImageSeriesABC, metaclass=_RegisterAdapterClass):
         r = region
         return self[frame_idx][r[0][0] : r[0][1], r[1][0] : r[1][1]]
 
+    def get_frames(self, key) -> np.ndarray:
+        """3-d array of the frames selected by a slice, range or index array
+
+        Adapters that can read several frames at once override this.
+        """
+        indices = frame_indices(key, len(self))
+        if len(indices) == 0:
+            return np.empty((0, *self.shape), dtype=self.dtype)
+        return np.stack([self[int(i)] for i in indices])
+
     def __getitem__(self, _):
         pass
 
 
+def is_batch_key(key) -> bool:
+    """whether `key` selects several frames (slice, range or index array)"""
+    return isinstance(key, (slice, range, list, np.ndarray))
+
+
+def frame_indices(key, nframes: int) -> np.ndarray:
+    """non-negative frame indices selected by a slice, range or index array"""
+    if isinstance(key, slice):
+        return np.arange(*key.indices(nframes))
+
+    indices = np.asarray(key, dtype=int).ravel()
+    if np.any((indices < -nframes) | (indices >= nframes)):
+        raise IndexError(f"frame indices out of range for {nframes} frames")
+    return np.where(indices < 0, indices + nframes, indices)
+
+
 # import all adapter modules
 
 from . import (
@@ -1,6 +1,6 @@
 """Adapter class for numpy array (3D)"""
 
-from . import ImageSeriesAdapter
+from . import ImageSeriesAdapter, frame_indices
 from ..imageseriesiter import ImageSeriesIterator
 
 import numpy as np
@@ -53,6 +53,9 @@ class ArrayImageSeriesAdapter(ImageSeriesAdapter):
     def __getitem__(self, key):
         return self._data[key].copy()
 
+    def get_frames(self, key):
+        return self._data[frame_indices(key, self._nframes)]
+
     def __iter__(self):
         return ImageSeriesIterator(self)
 
@@ -1,5 +1,7 @@
 """HDF5 adapter class"""
 
+from concurrent.futures import ThreadPoolExecutor
+import multiprocessing
 import warnings
 
 from dectris.compression import decompress
@@ -8,7 +10,7 @@ import numpy as np
 
 from hexrd.core.utils.hdf5 import unwrap_h5_to_dict
 
-from . import ImageSeriesAdapter
+from . import ImageSeriesAdapter, frame_indices, is_batch_key
 from ..imageseriesiter import ImageSeriesIterator
 
 
@@ -44,13 +46,19 @@ class EigerStreamV1ImageSeriesAdapter(ImageSeriesAdapter):
             warnings.warn(msg)
 
     def __getitem__(self, key):
-        if isinstance(key, int):
-            idx = key
+        if is_batch_key(key):
+            return self.get_frames(key)
+
+        if isinstance(key, (int, np.integer)):
+            idx = int(key)
             rest = None
         else:
             idx = key[0]
             rest = key[1:]
 
+        if is_batch_key(idx):
+            return self.get_frames(idx)[(slice(None), *rest)]
+
         entry = self._data_group[str(idx)]
         d = {}
         unwrap_h5_to_dict(entry, d)
@@ -60,6 +68,19 @@ class EigerStreamV1ImageSeriesAdapter(ImageSeriesAdapter):
         else:
             return data[rest]
 
+    def get_frames(self, key) -> np.ndarray:
+        """3-d array of the frames selected by a slice, range or index array
+
+        The compressed frames are read first, then decompressed in parallel.
+        """
+        entries = []
+        for idx in frame_indices(key, len(self)):
+            d = {}
+            unwrap_h5_to_dict(self._data_group[str(idx)], d)
+            entries.append(d)
+
+        return _decompress_frames(entries, self.shape, self.dtype)
+
     def __iter__(self):
         return ImageSeriesIterator(self)
 
@@ -135,3 +156,12 @@ def _decompress_frame(d: dict) -> np.ndarray:
 
     decompressed_bytes = decompress(data, compression_type, elem_size=elem_size)
     return np.frombuffer(decompressed_bytes, dtype=dtype).reshape(shape)
+
+
+def _decompress_frames(entries: list[dict], shape, dtype) -> np.ndarray:
+    if not entries:
+        return np.empty((0, *shape), dtype=dtype)
+
+    max_workers = min(len(entries), multiprocessing.cpu_count())
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return np.stack(list(executor.map(_decompress_frame, entries)))
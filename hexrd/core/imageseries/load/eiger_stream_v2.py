@@ -1,6 +1,8 @@
 """HDF5 adapter class
 """
 
+from concurrent.futures import ThreadPoolExecutor
+import multiprocessing
 from typing import Any
 import warnings
 
@@ -10,7 +12,7 @@ import numpy as np
 
 from hexrd.utils.hdf5 import unwrap_h5_to_dict
 
-from . import ImageSeriesAdapter
+from . import ImageSeriesAdapter, frame_indices, is_batch_key
 from ..imageseriesiter import ImageSeriesIterator
 
 
@@ -114,13 +116,19 @@ class EigerStreamV2ImageSeriesAdapter(ImageSeriesAdapter):
             warnings.warn(msg)
 
     def __getitem__(self, key):
-        if isinstance(key, int):
-            idx = key
+        if is_batch_key(key):
+            return self.get_frames(key)
+
+        if isinstance(key, (int, np.integer)):
+            idx = int(key)
             rest = None
         else:
             idx = key[0]
             rest = key[1:]
 
+        if is_batch_key(idx):
+            return self.get_frames(idx)[(slice(None), *rest)]
+
         if self.threshold_setting == 'man_diff':
             threshold_1_data = self._load_frame(idx, 'threshold_1')
             threshold_2_data = self._load_frame(idx, 'threshold_2')
@@ -205,6 +213,28 @@ class EigerStreamV2ImageSeriesAdapter(ImageSeriesAdapter):
         unwrap_h5_to_dict(entry, d)
         return _decompress_frame(d)
 
+    def get_frames(self, key) -> np.ndarray:
+        """3-d array of the frames selected by a slice, range or index array
+
+        The compressed frames are read first, then decompressed in parallel.
+        """
+        indices = frame_indices(key, len(self))
+        if self.threshold_setting == 'man_diff':
+            threshold_1_data = self._load_frames(indices, 'threshold_1')
+            threshold_2_data = self._load_frames(indices, 'threshold_2')
+            return threshold_1_data - self.multiplier * threshold_2_data
+
+        return self._load_frames(indices, self.threshold_setting)
+
+    def _load_frames(self, indices, group_name: str) -> np.ndarray:
+        entries = []
+        for idx in indices:
+            d = {}
+            unwrap_h5_to_dict(self._data_group[f'{idx}/{group_name}'], d)
+            entries.append(d)
+
+        return _decompress_frames(entries, self.shape, self.dtype)
+
     def set_option(self, key: str, value: Any):
         possible_options = [
             'threshold_setting',
@@ -238,3 +268,12 @@ def _decompress_frame(d: dict) -> np.ndarray:
 
     decompressed_bytes = decompress(data, compression_type, elem_size=elem_size)
     return np.frombuffer(decompressed_bytes, dtype=dtype).reshape(shape)
+
+
+def _decompress_frames(entries: list[dict], shape, dtype) -> np.ndarray:
+    if not entries:
+        return np.empty((0, *shape), dtype=dtype)
+
+    max_workers = min(len(entries), multiprocessing.cpu_count())
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return np.stack(list(executor.map(_decompress_frame, entries)))
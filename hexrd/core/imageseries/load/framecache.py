@@ -1,9 +1,11 @@
 """Adapter class for frame caches
 """
 
+from collections import OrderedDict
 import functools
 import os
 from threading import Lock
+import zlib
 
 import h5py
 import numpy as np
@@ -19,6 +21,9 @@ from hexrd.core.utils.compatibility import h5py_read_string
 import multiprocessing
 from concurrent.futures import ThreadPoolExecutor
 
+DEFAULT_LAZY_CACHE_SIZE = 32  # number of decoded frames kept in lazy mode
+SUPPORTED_FCH5_VERSIONS = (1, 2)
+
 
 class FrameCacheImageSeriesAdapter(ImageSeriesAdapter):
     """collection of images in HDF5 format"""
@@ -30,6 +35,11 @@ class FrameCacheImageSeriesAdapter(ImageSeriesAdapter):
 
         *fname* - filename of the yml file
         *kwargs* - keyword arguments (none required)
+            *max_workers* - number of threads used for the full load
+            *lazy* - (fch5 only) if True, frames are decoded on demand
+                     instead of all being loaded on first access
+            *cache_size* - (fch5 lazy only) maximum number of decoded
+                           frames to keep in memory (LRU)
         """
         self._fname = fname
         self._framelist = []
@@ -40,6 +50,8 @@ class FrameCacheImageSeriesAdapter(ImageSeriesAdapter):
 
         ncpus = multiprocessing.cpu_count()
         self._max_workers = kwargs.get('max_workers', ncpus)
+        self._lazy = kwargs.get('lazy', False)
+        self._cache_size = kwargs.get('cache_size', DEFAULT_LAZY_CACHE_SIZE)
 
         if self._style in ('yml', 'yaml', 'test'):
             self._from_yml = True
@@ -80,10 +92,11 @@ class FrameCacheImageSeriesAdapter(ImageSeriesAdapter):
                     "Unsupported file. " "HEXRD_FRAMECACHE_VERSION " "is missing!"
                 )
             version = file.attrs.get('HEXRD_FRAMECACHE_VERSION', 0)
-            if version != 1:
+            if version not in SUPPORTED_FCH5_VERSIONS:
                 raise NotImplementedError(
                     "Framecache version is not " f"supported: {version}"
                 )
+            self._fch5_version = int(version)
 
             self._shape = file["shape"][()]
             self._nframes = file["nframes"][()]
@@ -135,9 +148,26 @@ class FrameCacheImageSeriesAdapter(ImageSeriesAdapter):
             self._load_framelist_npz()
 
     def _load_framelist_fch5(self):
+        if self._lazy:
+            # Only the frame index is read; frames are decoded on demand
+            self._framelist = LazyFrameCacheFch5(
+                filepath=str(self._fname),
+                num_frames=int(self._nframes),
+                shape=tuple(self._shape),
+                dtype=self._dtype,
+                cache_size=int(self._cache_size),
+                version=self._fch5_version,
+            )
+            return
+
+        if self._fch5_version == 2:
+            loader = _load_framecache_fch5_v2
+        else:
+            loader = _load_framecache_fch5
+
         # Perform a memoized load, so that if multiple imageseries are
         # utilizing the same file, they can all share the same csr matrices
-        self._framelist = _load_framecache_fch5(
+        self._framelist = loader(
             filepath=str(self._fname),
             num_frames=int(self._nframes),
             shape=tuple(self._shape),
@@ -167,6 +197,9 @@ class FrameCacheImageSeriesAdapter(ImageSeriesAdapter):
 
     def get_region(self, frame_idx: int, region: RegionType) -> np.ndarray:
         self._load_framelist_if_needed()
+        if isinstance(self._framelist, LazyFrameCacheFch5):
+            return self._framelist.get_region(frame_idx, region)
+
         csr_frame = self._framelist[frame_idx]
         r = region
         return csr_frame[r[0][0] : r[0][1], r[1][0] : r[1][1]].toarray()
@@ -329,3 +362,239 @@ def _load_framecache_fch5(
             list(executor.map(read_list_arrays_method_thread, range(num_frames)))
 
     return framelist
+
+
+# This is memoized so that if multiple imageseries are sharing the
+# same file (such as 32 subpanel Eiger), all of the imageseries can
+# share the same sparse matrices.
+@functools.lru_cache(maxsize=2)
+def _load_framecache_fch5_v2(
+    filepath: str,
+    num_frames: int,
+    shape: tuple[int, int],
+    dtype: np.dtype,
+    max_workers: int,
+) -> list[csr_array]:
+
+    with h5py.File(filepath, "r") as file:
+        offsets = file["frame_offsets"][()]
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            rows, cols, data = _decode_fch5_v2_range(
+                file, 0, int(offsets[-1]), dtype, executor=executor
+            )
+
+            def build_frame(i):
+                start, stop = offsets[i], offsets[i + 1]
+                frame = csr_array(
+                    (data[start:stop], (rows[start:stop], cols[start:stop])),
+                    shape=shape,
+                    dtype=dtype,
+                )
+
+                # Make the data unwriteable, so we can be sure it won't be
+                # modified
+                frame.data.flags.writeable = False
+                return frame
+
+            return list(executor.map(build_frame, range(num_frames)))
+
+
+def _decode_fch5_v2_range(file, start, stop, dtype, executor=None):
+    """Decode the (rows, cols, data) of elements [start, stop) of a v2 fch5
+
+    The version 2 frame-cache stores the row, column and data arrays of all
+    frames concatenated, split into compressed chunks of `chunk_size`
+    elements (the `row_chunks`, `col_chunks` and `data_chunks` datasets).
+    Only the chunks overlapping the requested range are read.  If an
+    executor is given, the chunks are decompressed in parallel.
+    """
+    arr_dtypes = {'row': np.uint16, 'col': np.uint16, 'data': np.dtype(dtype)}
+    if stop <= start:
+        return tuple(np.empty(0, dtype=dt) for dt in arr_dtypes.values())
+
+    chunk_size = int(file.attrs['chunk_size'])
+    k0 = start // chunk_size
+    k1 = -(-stop // chunk_size)
+
+    jobs = []
+    for name, dt in arr_dtypes.items():
+        for blob in file[f"{name}_chunks"][k0:k1]:
+            jobs.append((blob, dt))
+
+    def decode(job):
+        blob, dt = job
+        return np.frombuffer(zlib.decompress(blob), dtype=dt)
+
+    mapper = map if executor is None else executor.map
+    decoded = list(mapper(decode, jobs))
+
+    nchunks = k1 - k0
+    offset = start - k0 * chunk_size
+    results = []
+    for j in range(len(arr_dtypes)):
+        arr = np.concatenate(decoded[j * nchunks : (j + 1) * nchunks])
+        results.append(arr[offset : offset + stop - start])
+
+    return tuple(results)
+
+
+class LazyFrameCacheFch5:
+    """Sequence of csr frames decoded on demand from an fch5 file
+
+    Only the `frame_ids` index is read up front (on first access).  Each
+    frame is decoded from its slice of the `data`/`indices` datasets when
+    requested, and the most recently used frames are held in a bounded
+    LRU cache.
+
+    Parameters
+    ----------
+    filepath : str
+        path to the fch5 file
+    num_frames : int
+        number of frames in the file
+    shape : tuple
+        the (rows, cols) shape of a frame
+    dtype : np.dtype
+        the data type of the frames
+    cache_size : int
+        the maximum number of decoded frames to keep; 0 disables caching
+    version : int, optional
+        the HEXRD_FRAMECACHE_VERSION of the file; the default is 1
+    """
+
+    def __init__(
+        self, filepath, num_frames, shape, dtype, cache_size, version=1
+    ):
+        self._filepath = filepath
+        self._num_frames = num_frames
+        self._shape = shape
+        self._dtype = dtype
+        self._cache_size = cache_size
+        self._version = version
+
+        self._file = None
+        self._frame_ids = None
+        self._cache = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self):
+        return self._num_frames
+
+    def __getitem__(self, i):
+        i = self._check_index(i)
+        with self._lock:
+            frame = self._cache.get(i)
+            if frame is not None:
+                self._cache.move_to_end(i)
+                return frame
+
+            start, stop = self._frame_range(i)
+            rows, cols, data = self._read_range(start, stop)
+
+        frame = csr_array(
+            (data, (rows, cols)),
+            shape=self._shape,
+            dtype=self._dtype,
+        )
+        # Make the data unwriteable, so we can be sure it won't be modified
+        frame.data.flags.writeable = False
+
+        with self._lock:
+            if self._cache_size > 0:
+                self._cache[i] = frame
+                while len(self._cache) > self._cache_size:
+                    self._cache.popitem(last=False)
+
+        return frame
+
+    def get_region(self, i: int, region: RegionType) -> np.ndarray:
+        """Return a dense region of frame `i`, reading only needed rows"""
+        i = self._check_index(i)
+        (r0, r1), (c0, c1) = region
+        with self._lock:
+            frame = self._cache.get(i)
+            if frame is not None:
+                self._cache.move_to_end(i)
+            else:
+                start, stop = self._frame_range(i)
+                rows, cols, data = self._read_rows(start, stop, r0, r1)
+
+        if frame is not None:
+            return frame[r0:r1, c0:c1].toarray()
+
+        out = np.zeros((r1 - r0, c1 - c0), dtype=self._dtype)
+        keep = (cols >= c0) & (cols < c1)
+        out[rows[keep] - r0, cols[keep] - c0] = data[keep]
+        return out
+
+    def clear_cache(self):
+        with self._lock:
+            self._cache.clear()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    @property
+    def _h5file(self):
+        # Must be called while holding the lock
+        if self._file is None:
+            self._file = h5py.File(self._filepath, "r")
+        return self._file
+
+    def _frame_range(self, i):
+        # Must be called while holding the lock
+        if self._version == 2:
+            if self._frame_ids is None:
+                self._frame_ids = self._h5file["frame_offsets"][()]
+            return int(self._frame_ids[i]), int(self._frame_ids[i + 1])
+
+        if self._frame_ids is None:
+            self._frame_ids = self._h5file["frame_ids"][()]
+        return int(self._frame_ids[2 * i]), int(self._frame_ids[2 * i + 1])
+
+    def _read_range(self, start, stop):
+        # Must be called while holding the lock
+        if self._version == 2:
+            return _decode_fch5_v2_range(self._h5file, start, stop, self._dtype)
+
+        indices = self._h5file["indices"][start:stop]
+        data = self._h5file["data"][start:stop, 0]
+        return indices[:, 0], indices[:, 1], data
+
+    def _read_rows(self, start, stop, r0, r1):
+        # Must be called while holding the lock
+        if self._version == 2:
+            # whole chunks are decoded anyway; select the rows afterwards
+            rows, cols, data = self._read_range(start, stop)
+            lo, hi = np.searchsorted(rows, [r0, r1])
+            return rows[lo:hi], cols[lo:hi], data[lo:hi]
+
+        # pixels are stored in row-major order within a frame
+        rows = self._h5file["indices"][start:stop, 0]
+        lo, hi = np.searchsorted(rows, [r0, r1])
+        return self._read_range(start + lo, start + hi)
+
+    def _check_index(self, i):
+        i = int(i)
+        if i < 0:
+            i += self._num_frames
+        if not 0 <= i < self._num_frames:
+            raise IndexError(
+                f"frame {i} out of range for {self._num_frames} frames"
+            )
+        return i
+
+    def __getstate__(self):
+        # The file handle, lock and decoded frames are not pickled
+        state = self.__dict__.copy()
+        state['_file'] = None
+        state['_cache'] = OrderedDict()
+        state.pop('_lock')
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = Lock()
@@ -1,11 +1,13 @@
 """HDF5 adapter class"""
 
+from typing import Any
+
 import h5py
 import warnings
 
 import numpy as np
 
-from . import ImageSeriesAdapter, RegionType
+from . import ImageSeriesAdapter, RegionType, frame_indices, is_batch_key
 from ..imageseriesiter import ImageSeriesIterator
 
 
@@ -25,25 +27,60 @@ class HDF5ImageSeriesAdapter(ImageSeriesAdapter):
     close_when_finished: bool, optional
         Whether to close the h5py file handle when this imageseries is
         deleted. The default is `True`.
+    chunk_cache_size: int, optional
+        Size in bytes of the HDF5 raw data chunk cache.  If given, the file
+        is opened (or re-opened, if an h5py file was passed) with this
+        chunk cache.  It can also be changed through
+        `set_option('chunk_cache_size', nbytes)`.
     """
 
     format = 'hdf5'
 
     def __init__(self, fname, **kwargs):
+        self._chunk_cache_size = kwargs.get('chunk_cache_size')
         if isinstance(fname, h5py.File):
             self.__h5name = fname.filename
             self.__h5file = fname
         else:
             self.__h5name = fname
-            self.__h5file = h5py.File(self.__h5name, 'r')
+            self.__h5file = self._open_file()
 
         self._close_when_finished = kwargs.get('close_when_finished', True)
         self.__path = kwargs['path']
         self.__dataname = kwargs.pop('dataname', 'images')
         self.__images = '/'.join([self.__path, self.__dataname])
-        self._load_data()
+        if isinstance(fname, h5py.File) and self._chunk_cache_size is not None:
+            # re-open the file with the requested chunk cache
+            self.chunk_cache_size = self._chunk_cache_size
+        else:
+            self._load_data()
         self._meta = self._getmeta()
 
+    @property
+    def chunk_cache_size(self) -> int | None:
+        """Size in bytes of the HDF5 raw data chunk cache
+
+        None means the HDF5 default.  Setting it re-opens the file.
+        """
+        return self._chunk_cache_size
+
+    @chunk_cache_size.setter
+    def chunk_cache_size(self, v: int | None):
+        self._chunk_cache_size = None if v is None else int(v)
+        if self.__h5file is not None and self._close_when_finished:
+            self.__h5file.close()
+
+        # we own the re-opened file
+        self._close_when_finished = True
+        self.__h5file = self._open_file()
+        self._load_data()
+
+    def _open_file(self):
+        kwargs = {}
+        if self._chunk_cache_size is not None:
+            kwargs['rdcc_nbytes'] = self._chunk_cache_size
+        return h5py.File(self.__h5name, 'r', **kwargs)
+
     def close(self):
         self.__image_dataset = None
         self.__data_group = None
@@ -64,9 +101,17 @@ class HDF5ImageSeriesAdapter(ImageSeriesAdapter):
             warnings.warn("HDF5ImageSeries could not close h5 file")
 
     def __getitem__(self, key):
+        if is_batch_key(key):
+            return self.get_frames(key)
+
+        if isinstance(key, np.integer):
+            key = int(key)
+
         if not isinstance(key, int):
             # FIXME: we do not yet support fancy indexing here.
             # Fully expand the array then apply the fancy indexing.
+            if is_batch_key(key[0]):
+                return self.get_frames(key[0])[(slice(None), *key[1:])]
             return self[key[0]][tuple(key[1:])]
 
         if self._ndim == 2:
@@ -83,6 +128,31 @@ class HDF5ImageSeriesAdapter(ImageSeriesAdapter):
         r = region
         return self.__image_dataset[frame_idx][r[0][0] : r[0][1], r[1][0] : r[1][1]]
 
+    def get_frames(self, key) -> np.ndarray:
+        """3-d array of the frames selected by a slice, range or index array
+
+        The frames are read with a single hyperslab selection: either the
+        contiguous block spanning the frames, or, if the frames are sparse
+        within that block, a point selection of the unique frames.
+        """
+        indices = frame_indices(key, len(self))
+        if len(indices) == 0:
+            return np.empty((0, *self.shape), dtype=self.dtype)
+
+        if self._ndim == 2:
+            return np.stack([np.asarray(self.__image_dataset)] * len(indices))
+
+        i0, i1 = indices.min(), indices.max() + 1
+        if np.array_equal(indices, np.arange(i0, i1)):
+            return self.__image_dataset[i0:i1]
+
+        if i1 - i0 <= 2 * len(indices):
+            return self.__image_dataset[i0:i1][indices - i0]
+
+        # h5py point selections must be increasing and unique
+        unique, inverse = np.unique(indices, return_inverse=True)
+        return self.__image_dataset[unique][inverse]
+
     def __iter__(self):
         return ImageSeriesIterator(self)
 
@@ -116,7 +186,7 @@ class HDF5ImageSeriesAdapter(ImageSeriesAdapter):
 
     def __setstate__(self, state):
         self.__dict__.update(state)
-        self.__h5file = h5py.File(self.__h5name, 'r')
+        self.__h5file = self._open_file()
         self._load_data()
 
     def _load_data(self):
@@ -153,3 +223,21 @@ class HDF5ImageSeriesAdapter(ImageSeriesAdapter):
             return self.__image_dataset.shape
         else:
             return self.__image_dataset.shape[1:]
+
+    def set_option(self, key: str, value: Any):
+        possible_options = [
+            'chunk_cache_size',
+        ]
+
+        if key not in possible_options:
+            poss_str = ', '.join(possible_options)
+            msg = f'"{key}" not in possible options: {poss_str}'
+            raise NotImplementedError(msg)
+
+        setattr(self, key, value)
+
+    def option_values(self) -> dict:
+        options = [
+            'chunk_cache_size',
+        ]
+        return {k: getattr(self, k) for k in options}
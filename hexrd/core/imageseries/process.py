@@ -1,12 +1,17 @@
 """Class for processing individual frames"""
 
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from typing import Any
 import copy
+import multiprocessing
+from threading import Lock
 
 import numpy as np
 import scipy
 
 from .baseclass import ImageSeries
+from .imageseriesabc import RegionType
 
 
 class ProcessedImageSeries(ImageSeries):
@@ -21,6 +26,13 @@ class ProcessedImageSeries(ImageSeries):
        with key specifying the operation to perform using specified data
     frame_list: list of ints or None, default = None
        specify subset of frames by list; if None, then all frames are used
+    cache_size: int, default = 0
+       number of processed frames to keep in an LRU cache; 0 disables it.
+       Cached frames are returned as copies. The cache is cleared when an
+       entry of the oplist is replaced, or via `clear_cache()`.
+    max_workers: int or None, default = None
+       number of threads used to process a batch of frames (a slice, range
+       or array of frame indices); if None, the number of CPUs
     """
 
     FLIP = 'flip'
@@ -37,7 +49,13 @@ class ProcessedImageSeries(ImageSeries):
         self._hasframelist = self._frames is not None
         if self._hasframelist:
             self._update_omega()
+        self._cache_size = kwargs.pop('cache_size', 0)
+        self._max_workers = kwargs.pop('max_workers', None)
+        self._cache = OrderedDict()
+        self._cache_token = None
+        self._cache_lock = Lock()
         self._opdict = {}
+        self._fused = {}
 
         self.addop(self.DARK, self._subtract_dark)
         self.addop(self.FLIP, self._flip)
@@ -45,9 +63,19 @@ class ProcessedImageSeries(ImageSeries):
         self.addop(self.ADD, self._add)
         self.addop(self.GAUSS_LAPLACE, self._gauss_laplace)
 
+        # In-place versions of the default operations, used once the
+        # pipeline owns the frame array. Overridden by `addop`.
+        self._fused = {
+            self.DARK: self._subtract_dark_inplace,
+            self.ADD: self._add_inplace,
+        }
+
     def __getitem__(self, key):
-        if isinstance(key, int):
-            idx = key
+        if isinstance(key, (slice, range, list, np.ndarray)):
+            return self.get_frames(key)
+
+        if isinstance(key, (int, np.integer)):
+            idx = int(key)
             rest = []
         else:
             # Handle fancy indexing
@@ -56,6 +84,10 @@ class ProcessedImageSeries(ImageSeries):
 
         idx = self._get_index(idx)
 
+        if self._cache_size > 0:
+            img = self._cached_frame(idx)
+            return img[tuple(rest)] if rest else img
+
         if rest:
             arg = tuple([idx, *rest])
         else:
@@ -63,6 +95,56 @@ class ProcessedImageSeries(ImageSeries):
 
         return self._process_frame(arg)
 
+    def get_frames(self, key) -> np.ndarray:
+        """process a batch of frames in parallel; returns a 3-d array"""
+        if isinstance(key, slice):
+            indices = range(len(self))[key]
+        else:
+            indices = np.arange(len(self))[np.asarray(key)]
+
+        if len(indices) == 0:
+            return np.empty((0, *self.shape), dtype=self.dtype)
+
+        max_workers = self._max_workers or multiprocessing.cpu_count()
+        max_workers = min(max_workers, len(indices))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            frames = list(executor.map(self.__getitem__, map(int, indices)))
+
+        return np.stack(frames)
+
+    def _cached_frame(self, idx):
+        # note: idx refers to original imageseries
+        token = tuple((k, id(d)) for k, d in self.oplist)
+        with self._cache_lock:
+            if token != self._cache_token:
+                # the oplist changed; processed frames are stale
+                self._cache.clear()
+                self._cache_token = token
+
+            img = self._cache.get(idx)
+            if img is not None:
+                self._cache.move_to_end(idx)
+                return img.copy()
+
+        img = self._process_frame(idx)
+
+        with self._cache_lock:
+            if token == self._cache_token:
+                self._cache[idx] = img.copy()
+                while len(self._cache) > self._cache_size:
+                    self._cache.popitem(last=False)
+
+        return img
+
+    def clear_cache(self):
+        """clear the cache of processed frames"""
+        with self._cache_lock:
+            self._cache.clear()
+
+    def get_region(self, frame_idx: int, region: RegionType) -> np.ndarray:
+        r = region
+        return self[frame_idx][r[0][0] : r[0][1], r[1][0] : r[1][1]]
+
     def _get_index(self, key):
         return self._frames[key] if self._hasframelist else key
 
@@ -100,9 +182,23 @@ class ProcessedImageSeries(ImageSeries):
         else:
             img = self._imser[key]
 
+        # After the first operation that allocates a new array, the
+        # pipeline owns the frame, and the arithmetic operations work on
+        # it in place instead of allocating a new array for each step.
+        # The frame from the source imageseries is never modified.
+        owned = False
         for k, d in oplist:
+            fused = self._fused.get(k)
+            if fused is not None:
+                img, owned = fused(img, d, owned)
+                continue
+
             func = self._opdict[k]
-            img = func(img, d)
+            out = func(img, d)
+            # flips and rectangles are views of the same data
+            if not np.may_share_memory(out, img):
+                owned = True
+            img = out
 
         return img
 
@@ -123,6 +219,27 @@ class ProcessedImageSeries(ImageSeries):
         ret[ret < 0] = 0
         return ret
 
+    def _subtract_dark_inplace(self, img, dark, owned):
+        # in-place version of _subtract_dark
+        if owned and np.result_type(img, dark) == img.dtype:
+            np.subtract(img, dark, out=img)
+        else:
+            img = img - dark
+        img[img < 0] = 0
+        return img, True
+
+    def _add_inplace(self, img, addend, owned):
+        # in-place version of _add
+        if not np.issubdtype(img.dtype, np.floating):
+            img = img.astype(np.float32)
+            owned = True
+
+        if owned and np.result_type(img, addend) == img.dtype:
+            np.add(img, addend, out=img)
+        else:
+            img = img + addend
+        return img, True
+
     def _rectangle_optimized(self, img_key, r):
         return self._imser.get_region(img_key, r)
 
@@ -187,6 +304,7 @@ class ProcessedImageSeries(ImageSeries):
         *func* - function to call for this op: f(data)
         """
         self._opdict[key] = func
+        self._fused.pop(key, None)
 
     @property
     def oplist(self):
@@ -195,6 +313,21 @@ class ProcessedImageSeries(ImageSeries):
 
     def set_option(self, key: str, value: Any):
         self._imser.set_option(key, value)
+        # options may change the raw frames
+        self.clear_cache()
 
     def option_values(self) -> dict:
         return self._imser.option_values()
+
+    def __getstate__(self):
+        # Remove any non-pickleable attributes, and the cached frames
+        state = self.__dict__.copy()
+        state.pop('_cache_lock')
+        state['_cache'] = OrderedDict()
+        state['_cache_token'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        # initialize lock after un-pickling
+        self._cache_lock = Lock()
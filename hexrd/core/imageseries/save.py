@@ -1,6 +1,7 @@
 """Write imageseries to various formats"""
 
 import abc
+from collections import deque
 from concurrent.futures import ThreadPoolExecutor
 import logging
 import multiprocessing
@@ -8,6 +9,7 @@ import os
 import threading
 import warnings
 import sys
+import zlib
 
 import numpy as np
 import h5py
@@ -15,11 +17,15 @@ import hdf5plugin
 import yaml
 
 from hexrd.core.matrixutil import extract_ijv
+from hexrd.core.imageseries.imageseriesiter import PrefetchIterator
 from hexrd.core.utils.hdf5 import unwrap_dict_to_h5
 
 logger = logging.getLogger(__name__)
 
 MAX_NZ_FRACTION = 0.1  # 10% sparsity trigger for frame-cache write
+FCH5_WRITE_CHUNK = 2**16  # elements per HDF5 chunk in fch5 (v1) files
+FCH5_V2_CHUNK_SIZE = 2**18  # elements per compressed chunk in fch5 v2
+FCH5_V2_ZLIB_LEVEL = 1
 
 
 # =============================================================================
@@ -164,8 +170,8 @@ class WriteH5(Writer):
             'images', (self._nframes, s0, s1), self._dtype, **self.h5opts
         )
 
-        for i in range(self._nframes):
-            ds[i, :, :] = self._ims[i]
+        for i, img in enumerate(PrefetchIterator(self._ims)):
+            ds[i, :, :] = img
 
         # add metadata
         for k, v in list(self._meta.items()):
@@ -227,6 +233,12 @@ class WriteFrameCache(Writer):
     max_workers: int, optional
        The max number of worker threads for multithreading. Defaults to
        the number of CPUs.
+    version: int, optional
+       (fch5 only) the HEXRD_FRAMECACHE_VERSION to write. Version 2 stores
+       a per-frame offset table and fixed-size compressed chunks that can
+       be decoded in parallel. Defaults to 1.
+    chunk_size: int, optional
+       (fch5 version 2 only) number of elements per compressed chunk
     """
 
     fmt = 'frame-cache'
@@ -246,6 +258,15 @@ class WriteFrameCache(Writer):
             )
         self.style = style
 
+        self.version = kwargs.get('version', 1)
+        if self.version not in (1, 2):
+            raise NotImplementedError(
+                f"Framecache version is not supported: {self.version}"
+            )
+        if self.version == 2 and style != 'fch5':
+            raise TypeError("Framecache version 2 requires the 'fch5' style")
+        self.chunk_size = kwargs.get('chunk_size', FCH5_V2_CHUNK_SIZE)
+
         self.hdf5_compression = hdf5plugin.Blosc(cname="zstd", clevel=5)
 
     def _set_cache(self):
@@ -310,7 +331,10 @@ class WriteFrameCache(Writer):
         if self.style == 'npz':
             self._write_frames_npz()
         elif self.style == 'fch5':
-            self._write_frames_fch5()
+            if self.version == 2:
+                self._write_frames_fch5_v2()
+            else:
+                self._write_frames_fch5()
 
     def _check_sparsity(self, frame_id, count, buff_size):
         # check the sparsity
@@ -388,23 +412,17 @@ class WriteFrameCache(Writer):
 
           data_i = data[frame_ids[2*i]:frame_ids[2*i+1]] and
           indices_i = indices[frame_ids[2*i]:frame_ids[2*i+1]]
+
+        Frames are thresholded by worker threads and appended to chunked,
+        resizable datasets by a single writer, in frame order. At most a
+        few frames per worker are held in memory at any time.
         """
-        max_frame_size = self._ims.shape[0] * self._ims.shape[1]
         nframes = len(self._ims)
         shape = self._ims.shape
         data_dtype = self._ims.dtype
 
         frame_indices = np.empty((2 * nframes,), dtype=np.uint64)
-        data_dataset = None
-        indices_dataset = None
-        file_position = 0
-        total_size = 0
 
-        common_lock = threading.Lock()
-        thread_local = threading.local()
-
-        # creating an array in memory will fail if data is too big or threshold
-        # too low, so we write to the file while iterating the frames
         with h5py.File(self.cache, "w") as h5f:
             h5f.attrs['HEXRD_FRAMECACHE_VERSION'] = 1
             h5f["shape"] = shape
@@ -413,63 +431,57 @@ class WriteFrameCache(Writer):
             metadata = h5f.create_group("metadata")
             unwrap_dict_to_h5(metadata, self._meta.copy())
 
-            def initialize_buffers():
-                thread_local.data = np.empty((max_frame_size, 1), dtype=self._ims.dtype)
-                thread_local.indices = np.empty((max_frame_size, 2), dtype=np.uint16)
-
-            def single_array_write_thread(i):
-                nonlocal file_position, total_size
-                im = self._ims[i]
-                row_slice = thread_local.indices[:, 0]
-                col_slice = thread_local.indices[:, 1]
-                data_slice = thread_local.data[:, 0]
-                count = extract_ijv(im, self._thresh, row_slice, col_slice, data_slice)
-
-                self._check_sparsity(i, count, max_frame_size)
-
-                # get the range this thread is doing to write into the file
-                start_file = 0
-                end_file = 0
-                with common_lock:
-                    start_file = file_position
-                    file_position += count
-                    end_file = file_position
-                    total_size += end_file - start_file
-                # write within the appropriate ranges
-                data_dataset[start_file:end_file, :] = thread_local.data[:count, :]
-                indices_dataset[start_file:end_file, :] = thread_local.indices[
-                    :count, :
-                ]
-                frame_indices[2 * i] = start_file
-                frame_indices[2 * i + 1] = end_file
-
-            kwargs = {
-                "max_workers": self.max_workers,
-                "initializer": initialize_buffers,
-            }
-
             data_dataset = h5f.create_dataset(
                 "data",
-                shape=(nframes * max_frame_size, 1),
+                shape=(0, 1),
+                maxshape=(None, 1),
+                chunks=(FCH5_WRITE_CHUNK, 1),
                 dtype=data_dtype,
                 compression=self.hdf5_compression,
             )
             indices_dataset = h5f.create_dataset(
                 "indices",
-                shape=(nframes * max_frame_size, 2),
+                shape=(0, 2),
+                maxshape=(None, 2),
+                chunks=(FCH5_WRITE_CHUNK, 2),
                 dtype=np.uint16,
                 compression=self.hdf5_compression,
             )
-            with ThreadPoolExecutor(**kwargs) as executor:
-                # Evaluate the results via `list()`, so that if an exception is
-                # raised in a thread, it will be re-raised and visible to
-                # the user.
-                list(executor.map(single_array_write_thread, range(nframes)))
 
-                # update the sizes of the dataset to match the amount of data
-                # that have been actually written
-                data_dataset.resize(total_size, axis=0)
-                indices_dataset.resize(total_size, axis=0)
+            pending = []
+            npending = 0
+            file_position = 0
+
+            def flush():
+                nonlocal npending, file_position
+                if npending == 0:
+                    return
+
+                rows, cols, vals = (np.concatenate(x) for x in zip(*pending))
+                start = file_position
+                file_position += npending
+                data_dataset.resize(file_position, axis=0)
+                indices_dataset.resize(file_position, axis=0)
+                data_dataset[start:file_position, 0] = vals
+                indices_dataset[start:file_position, :] = np.column_stack((rows, cols))
+                pending.clear()
+                npending = 0
+
+            with ThreadPoolExecutor(max_workers=self._num_workers) as executor:
+                frames = self._extract_frames(executor)
+                for i, frame in enumerate(frames):
+                    count = len(frame[2])
+                    start = file_position + npending
+                    frame_indices[2 * i] = start
+                    frame_indices[2 * i + 1] = start + count
+
+                    pending.append(frame)
+                    npending += count
+                    # append to the file in blocks of whole chunks
+                    if npending >= FCH5_WRITE_CHUNK:
+                        flush()
+
+                flush()
 
             h5f.create_dataset(
                 "frame_ids",
@@ -477,6 +489,57 @@ class WriteFrameCache(Writer):
                 compression=self.hdf5_compression,
             )
 
+    def _write_frames_fch5_v2(self):
+        """Write framecache into a version 2 fch5 file
+
+        See `write_fch5_v2` for the layout.  Frames are thresholded in
+        parallel and handed to the writer in frame order.
+        """
+        with ThreadPoolExecutor(max_workers=self._num_workers) as executor:
+            write_fch5_v2(
+                self.cache,
+                self._extract_frames(executor),
+                shape=self._ims.shape,
+                nframes=len(self._ims),
+                dtype=self._ims.dtype,
+                meta=self._meta,
+                chunk_size=self.chunk_size,
+                executor=executor,
+            )
+
+    @property
+    def _num_workers(self):
+        return max(min(self.max_workers, len(self._ims)), 1)
+
+    def _extract_frames(self, executor):
+        """Yield the thresholded (rows, cols, data) of each frame in order
+
+        Frames are extracted by the executor's threads, with at most two
+        frames per worker waiting to be consumed, so memory stays bounded
+        regardless of the number of frames.
+        """
+        buff_size = self._ims.shape[0] * self._ims.shape[1]
+        thread_local = threading.local()
+
+        def extract_frame(i):
+            if not hasattr(thread_local, 'vals'):
+                thread_local.rows = np.empty(buff_size, dtype=np.uint16)
+                thread_local.cols = np.empty(buff_size, dtype=np.uint16)
+                thread_local.vals = np.empty(buff_size, dtype=self._ims.dtype)
+
+            rows = thread_local.rows
+            cols = thread_local.cols
+            vals = thread_local.vals
+            count = extract_ijv(self._ims[i], self._thresh, rows, cols, vals)
+
+            self._check_sparsity(i, count, buff_size)
+
+            return rows[:count].copy(), cols[:count].copy(), vals[:count].copy()
+
+        return _ordered_map(
+            executor, extract_frame, range(len(self._ims)), 2 * self._num_workers
+        )
+
     def write(self, output_yaml=False):
         """writes frame cache for imageseries
 
@@ -488,3 +551,178 @@ class WriteFrameCache(Writer):
                 "YAML output for frame-cache is deprecated", DeprecationWarning
             )
             self._write_yml()
+
+
+def write_fch5_v2(
+    fname,
+    frames,
+    shape,
+    nframes,
+    dtype,
+    meta,
+    chunk_size=FCH5_V2_CHUNK_SIZE,
+    executor=None,
+):
+    """Write sparse frames into a version 2 fch5 frame-cache file
+
+    The file holds the following datasets:
+    - 'frame_offsets': (nframes + 1,) element offsets of each frame, i.e.
+      frame `i` occupies elements `frame_offsets[i]:frame_offsets[i+1]`
+      of the concatenated row, column and data arrays
+    - 'row_chunks', 'col_chunks', 'data_chunks': the concatenated arrays,
+      split into chunks of `chunk_size` elements (the file attribute
+      'chunk_size'), each chunk stored as a zlib-compressed byte string
+
+    Parameters
+    ----------
+    fname: str
+       the name of the file to write
+    frames: iterable
+       (rows, cols, data) arrays for each frame, in frame order
+    shape: tuple
+       the shape of a frame
+    nframes: int
+       the number of frames
+    dtype: np.dtype
+       the data type of the frames
+    meta: dict
+       the imageseries metadata
+    chunk_size: int, optional
+       the number of elements per compressed chunk
+    executor: concurrent.futures.Executor, optional
+       if given, chunks are compressed in parallel
+    """
+    names = ('row', 'col', 'data')
+    arr_dtypes = (np.uint16, np.uint16, np.dtype(dtype))
+    offsets = np.zeros(nframes + 1, dtype=np.uint64)
+    pending = [[] for _ in names]
+    npending = 0
+    # compress several chunks at once so that they can be done in parallel
+    flush_size = 16 * chunk_size
+
+    def compress(arr):
+        return np.frombuffer(zlib.compress(arr, FCH5_V2_ZLIB_LEVEL), np.uint8)
+
+    mapper = map if executor is None else executor.map
+
+    with h5py.File(fname, "w") as h5f:
+        h5f.attrs['HEXRD_FRAMECACHE_VERSION'] = 2
+        h5f.attrs['chunk_size'] = chunk_size
+        h5f["shape"] = shape
+        h5f["nframes"] = nframes
+        h5f["dtype"] = str(np.dtype(dtype)).encode("utf-8")
+        metadata = h5f.create_group("metadata")
+        unwrap_dict_to_h5(metadata, meta.copy())
+
+        datasets = [
+            h5f.create_dataset(
+                f"{name}_chunks",
+                shape=(0,),
+                maxshape=(None,),
+                dtype=h5py.vlen_dtype(np.uint8),
+            )
+            for name in names
+        ]
+
+        def flush(final=False):
+            nonlocal npending
+            nchunks = npending // chunk_size
+            if final and npending % chunk_size:
+                nchunks += 1
+            nkeep = max(npending - nchunks * chunk_size, 0)
+            if nchunks <= 0:
+                return
+
+            for j, ds in enumerate(datasets):
+                arr = np.concatenate(pending[j]).astype(arr_dtypes[j])
+                blocks = [
+                    arr[k * chunk_size : (k + 1) * chunk_size] for k in range(nchunks)
+                ]
+                pending[j] = [arr[len(arr) - nkeep :]]
+
+                n = len(ds)
+                ds.resize((n + nchunks,))
+                ds[n:] = list(mapper(compress, blocks))
+
+            npending = nkeep
+
+        for i, frame in enumerate(frames):
+            for j, arr in enumerate(frame):
+                pending[j].append(arr)
+            offsets[i + 1] = offsets[i] + len(frame[2])
+            npending += len(frame[2])
+            if npending >= flush_size:
+                flush()
+
+        flush(final=True)
+        h5f.create_dataset("frame_offsets", data=offsets)
+
+
+def convert_frame_cache(
+    infile, outfile, style=None, chunk_size=FCH5_V2_CHUNK_SIZE, max_workers=None
+):
+    """Convert an npz or fch5 frame-cache into a version 2 fch5 file
+
+    Parameters
+    ----------
+    infile: str
+       the frame-cache file to convert
+    outfile: str
+       the name of the version 2 fch5 file to write
+    style: str, optional
+       the style of `infile` ('npz' or 'fch5'); by default it is
+       determined from the file extension
+    chunk_size: int, optional
+       the number of elements per compressed chunk
+    max_workers: int, optional
+       the max number of worker threads. Defaults to the number of CPUs.
+    """
+    from .load.framecache import FrameCacheImageSeriesAdapter
+
+    if style is None:
+        ext = os.path.splitext(str(infile))[1].lower()
+        style = 'npz' if ext == '.npz' else 'fch5'
+
+    if max_workers is None:
+        max_workers = multiprocessing.cpu_count()
+
+    # fch5 input is read lazily to keep memory bounded
+    kwargs = {'lazy': True, 'cache_size': 0} if style == 'fch5' else {}
+    adapter = FrameCacheImageSeriesAdapter(
+        infile, style=style, max_workers=max_workers, **kwargs
+    )
+    nframes = len(adapter)
+
+    def read_frame(i):
+        frame = adapter[i]
+        rows, cols = np.nonzero(frame)
+        return rows, cols, frame[rows, cols]
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        frames = _ordered_map(executor, read_frame, range(nframes), max_workers)
+        write_fch5_v2(
+            outfile,
+            frames,
+            shape=adapter.shape,
+            nframes=nframes,
+            dtype=adapter.dtype,
+            meta=adapter.metadata,
+            chunk_size=chunk_size,
+            executor=executor,
+        )
+
+
+def _ordered_map(executor, fn, iterable, depth):
+    """Like `executor.map`, but with at most `depth` results pending
+
+    Results are yielded in order. This bounds memory when the consumer is
+    slower than the workers.
+    """
+    futures = deque()
+    for item in iterable:
+        futures.append(executor.submit(fn, item))
+        if len(futures) >= depth:
+            yield futures.popleft().result()
+
+    while futures:
+        yield futures.popleft().result()
@@ -18,16 +18,31 @@ For example:
         # update progress bar
         pass
 
+Several statistics can be computed from a single read of the frames with
+`multi`, which returns a dict keyed by statistic:
+
+.. code-block:: python
+
+    imgs = stats.multi(ims, ['median', 'max', 'average'])
+    dark = imgs['median']
+
 NOTES
 -----
 * Perhaps we should rename min -> minimum and max -> maximum to avoid
   conflicting with the python built-ins
 """
 
+from concurrent.futures import ThreadPoolExecutor
+import multiprocessing
+import numbers
+
 import numpy as np
 
 from psutil import virtual_memory
 
+from .imageseriesabc import ImageSeriesABC
+from .imageseriesiter import PrefetchIterator
+
 # Default Buffer Size: half of available memory
 vmem = virtual_memory()
 STATS_BUFFER = int(0.5 * vmem.available)
@@ -38,8 +53,8 @@ def max(ims, nframes=0):
     """maximum over frames"""
     nf = _nframes(ims, nframes)
     img = ims[0]
-    for i in range(1, nf):
-        img = np.maximum(img, ims[i])
+    for frame in _frames(ims, 1, nf):
+        img = np.maximum(img, frame)
     return img
 
 
@@ -55,8 +70,8 @@ def max_iter(ims, nchunk, nframes=0):
             s0, stop = 1, stops[1]
         yield img
 
-    for i in range(1, nf):
-        img = np.maximum(img, ims[i])
+    for i, frame in enumerate(_frames(ims, 1, nf), start=1):
+        img = np.maximum(img, frame)
         if i >= stop:
             yield img
             if (i + 1) < nf:
@@ -68,8 +83,8 @@ def min(ims, nframes=0):
     """minimum over frames"""
     nf = _nframes(ims, nframes)
     img = ims[0]
-    for i in range(1, nf):
-        img = np.minimum(img, ims[i])
+    for frame in _frames(ims, 1, nf):
+        img = np.minimum(img, frame)
     return img
 
 
@@ -84,8 +99,8 @@ def min_iter(ims, nchunk, nframes=0):
             s0, stop = 1, stops[1]
         yield img
 
-    for i in range(1, nf):
-        img = np.minimum(img, ims[i])
+    for i, frame in enumerate(_frames(ims, 1, nf), start=1):
+        img = np.minimum(img, frame)
         if i >= stop:
             yield img
             if (i + 1) < nf:
@@ -97,8 +112,8 @@ def average(ims, nframes=0):
     """average over frames"""
     nf = _nframes(ims, nframes)
     img = ims[0].astype(np.float32)
-    for i in range(1, nf):
-        img += ims[i]
+    for frame in _frames(ims, 1, nf):
+        img += frame
     return img / nf
 
 
@@ -116,8 +131,8 @@ def average_iter(ims, nchunk, nframes=0):
             s0, stop = 1, stops[1]
         yield img
 
-    for i in range(1, nf):
-        img += ims[i]
+    for i, frame in enumerate(_frames(ims, 1, nf), start=1):
+        img += frame
         if i >= stop:
             if (i + 1) < nf:
                 s0 += 1
@@ -132,18 +147,27 @@ def percentile(ims, pctl, nframes=0):
     pctl - the percentile
     nframes - the number of frames to use (default/0 = all)
     """
-    nf = _nframes(ims, nframes)
-    return np.percentile(_toarray(ims, nf), pctl, axis=0).astype(np.float32)
+    return multi(ims, [pctl], nframes=nframes)[pctl]
 
 
 def percentile_iter(ims, pctl, nchunks, nframes=0, use_buffer=True):
-    """iterator for percentile function"""
+    """iterator for percentile function
+
+    With `use_buffer`, as many full frames as fit in STATS_BUFFER are kept
+    so they are read once.  Without it, only one band of rows of all frames
+    is held in memory at a time, so memory use scales as 1/nchunks.
+    """
+    if not use_buffer:
+        for imgs in multi_iter(ims, [pctl], nchunks, nframes=nframes):
+            yield imgs[pctl]
+        return
+
     nf = _nframes(ims, nframes)
     nr, nc = ims.shape
     stops = _chunk_stops(nr, nchunks)
     r0 = 0
     img = np.zeros(ims.shape)
-    buffer = _alloc_buffer(ims, nf) if use_buffer else None
+    buffer = _alloc_buffer(ims, nf)
     for s in stops:
         r1 = s + 1
         img[r0:r1] = np.percentile(
@@ -161,6 +185,79 @@ def median_iter(ims, nchunks, nframes=0, use_buffer=True):
     return percentile_iter(ims, 50, nchunks, nframes=nframes, use_buffer=use_buffer)
 
 
+def multi(ims, statistics, nframes=0, nchunks=1, max_workers=None):
+    """several statistics over frames from a single read of the data
+
+    ims - the imageseries
+    statistics - iterable of statistics to compute; each is one of 'max',
+                 'min', 'average' (or 'mean'), 'median', or a number,
+                 which is taken as a percentile
+    nframes - the number of frames to use (default/0 = all)
+    nchunks - the number of row bands to split the frames into; only one
+              band of all frames is held in memory at a time
+    max_workers - the number of threads reading frames (default: ncpus)
+
+    Returns a dict of images keyed by the requested statistics.  The
+    percentiles (and median) are float32, as is the average; max and min
+    have the imageseries dtype.
+    """
+    for imgs in multi_iter(
+        ims, statistics, nchunks, nframes=nframes, max_workers=max_workers
+    ):
+        pass
+    return imgs
+
+
+def multi_iter(ims, statistics, nchunks, nframes=0, max_workers=None):
+    """iterator for multi function; yields after each band of rows"""
+    nf = _nframes(ims, nframes)
+    statistics = list(statistics)
+    pctls = {}
+    for key in statistics:
+        if isinstance(key, numbers.Number) and not isinstance(key, bool):
+            pctls[key] = key
+        elif key == 'median':
+            pctls[key] = 50
+        elif key not in ('max', 'min', 'average', 'mean'):
+            raise ValueError(f'unknown statistic: "{key}"')
+
+    if nf == 0:
+        raise ValueError("the imageseries has no frames")
+
+    if max_workers is None:
+        max_workers = multiprocessing.cpu_count()
+    max_workers = int(np.clip(max_workers, 1, nf))
+
+    nr, nc = ims.shape
+    stops = _chunk_stops(nr, nchunks)
+    imgs = {}
+    for key in statistics:
+        dtype = ims.dtype if key in ('max', 'min') else np.float32
+        imgs[key] = np.zeros(ims.shape, dtype=dtype)
+
+    r0 = 0
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for s in stops:
+            r1 = s + 1
+            if pctls:
+                # order statistics need all frames of the band at once;
+                # the other statistics come from the same array
+                a = np.empty((nf, r1 - r0, nc), dtype=ims.dtype)
+
+                def read_frame(i):
+                    a[i] = _frame_rows(ims, i, r0, r1)
+
+                list(executor.map(read_frame, range(nf)))
+                band = _stack_stats(a, statistics, pctls)
+            else:
+                band = _reduce_band(ims, nf, r0, r1, executor, max_workers)
+
+            for key in statistics:
+                imgs[key][r0:r1] = band['average' if key == 'mean' else key]
+            r0 = r1
+            yield imgs
+
+
 # ==================== Utilities
 #
 def _nframes(ims, nframes):
@@ -186,6 +283,66 @@ def _chunk_stops(n, nchunks):
     return np.cumsum(pieces)
 
 
+def _frames(ims, start, stop):
+    """frames start:stop, read ahead in background threads"""
+    return PrefetchIterator(ims, frames=range(start, stop))
+
+
+def _frame_rows(ims, i, r0, r1):
+    """rows r0:r1 of frame i, reading only those rows if possible"""
+    if isinstance(ims, ImageSeriesABC) and hasattr(ims, 'get_region'):
+        nc = ims.shape[1]
+        return ims.get_region(i, ((r0, r1), (0, nc)))
+    return ims[i][r0:r1]
+
+
+def _stack_stats(a, statistics, pctls):
+    """requested statistics over the first axis of the frame stack `a`"""
+    band = {}
+    if 'max' in statistics:
+        band['max'] = a.max(axis=0)
+    if 'min' in statistics:
+        band['min'] = a.min(axis=0)
+    if 'average' in statistics or 'mean' in statistics:
+        band['average'] = a.mean(axis=0, dtype=np.float64)
+
+    # all percentiles come from a single partition of the stack
+    keys = list(pctls)
+    values = np.percentile(a, [pctls[k] for k in keys], axis=0)
+    band.update(zip(keys, values))
+    return band
+
+
+def _reduce_band(ims, nframes, r0, r1, executor, nworkers):
+    """max, min and average of rows r0:r1 without holding all frames
+
+    The frames are split into one contiguous group per worker; each worker
+    reduces its group and the partial results are combined.
+    """
+    groups = np.array_split(np.arange(nframes), nworkers)
+
+    def reduce_group(frames):
+        img = _frame_rows(ims, frames[0], r0, r1)
+        vmax = img.copy()
+        vmin = img.copy()
+        vsum = img.astype(np.float64)
+        for i in frames[1:]:
+            img = _frame_rows(ims, i, r0, r1)
+            np.maximum(vmax, img, out=vmax)
+            np.minimum(vmin, img, out=vmin)
+            vsum += img
+        return vmax, vmin, vsum
+
+    partials = list(executor.map(reduce_group, [g for g in groups if len(g)]))
+    vmax, vmin, vsum = partials[0]
+    for pmax, pmin, psum in partials[1:]:
+        np.maximum(vmax, pmax, out=vmax)
+        np.minimum(vmin, pmin, out=vmin)
+        vsum += psum
+
+    return {'max': vmax, 'min': vmin, 'average': vsum / nframes}
+
+
 def _toarray(ims, nframes, rows=None, buffer=None):
     """generate array for either whole imageseries or subset of rows
 
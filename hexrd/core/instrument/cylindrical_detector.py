@@ -7,9 +7,12 @@ from hexrd.core import constants as ct
 # TODO: Resolve extra-core dependency
 from hexrd.hedm import xrdutil
 from hexrd.hed.xrdutil.utils import _warp_to_cylinder
-from hexrd.core.utils.decorators import memoize
 
-from .detector import Detector
+from .detector import (
+    Detector,
+    _geometry_versions,
+    memoize_pixel_quantity,
+)
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.WARNING)
@@ -220,7 +223,7 @@ class CylindricalDetector(Detector):
         # kwargs used for pixel angles, pixel_tth_gradient,
         # and pixel_eta_gradient
         return {
-            'pixel_coords': self.pixel_coords,
+            'pixel_coords': self._pixel_coords_views,
             'distortion': self.distortion,
             'caxis': self.caxis,
             'paxis': self.paxis,
@@ -229,6 +232,8 @@ class CylindricalDetector(Detector):
             'evec': self.evec,
             'rows': self.rows,
             'cols': self.cols,
+            'geometry_version': self.geometry_version,
+            'panel_id': id(self),
         }
 
     def pixel_tth_gradient(self, origin=ct.zeros_3, bvec: np.ndarray | None = None):
@@ -274,6 +279,7 @@ class CylindricalDetector(Detector):
     def radius(self, r):
         # units of mm
         self._radius = r
+        self._geometry_version = next(_geometry_versions)
 
     @property
     def physical_size(self):
@@ -322,16 +328,9 @@ class CylindricalDetector(Detector):
 
     @staticmethod
     def update_memoization_sizes(all_panels):
+        # the caches of the pixel quantities are bounded by size instead
         Detector.update_memoization_sizes(all_panels)
 
-        num_matches = sum(isinstance(x, CylindricalDetector) for x in all_panels)
-        funcs = [
-            _pixel_angles,
-            _pixel_tth_gradient,
-            _pixel_eta_gradient,
-        ]
-        Detector.increase_memoization_sizes(funcs, num_matches)
-
     @property
     def extra_config_kwargs(self):
         return {
@@ -339,7 +338,7 @@ class CylindricalDetector(Detector):
         }
 
 
-@memoize
+@memoize_pixel_quantity
 def _pixel_angles(
     origin,
     pixel_coords,
@@ -352,7 +351,11 @@ def _pixel_angles(
     evec,
     rows,
     cols,
+    geometry_version=None,
+    panel_id=None,
 ):
+    # geometry_version and panel_id only key the cache (see
+    # Detector.geometry_version)
     assert len(origin) == 3, "origin must have 3 elements"
 
     pix_i, pix_j = pixel_coords
@@ -370,14 +373,14 @@ def _pixel_angles(
     return tth, eta
 
 
-@memoize
+@memoize_pixel_quantity
 def _pixel_tth_gradient(origin, **pixel_angle_kwargs):
     assert len(origin) == 3, "origin must have 3 elements"
     ptth, _ = _pixel_angles(origin=origin, **pixel_angle_kwargs)
     return np.linalg.norm(np.stack(np.gradient(ptth)), axis=0)
 
 
-@memoize
+@memoize_pixel_quantity
 def _pixel_eta_gradient(origin, **pixel_angle_kwargs):
     assert len(origin) == 3, "origin must have 3 elemnts"
     _, peta = _pixel_angles(origin=origin, **pixel_angle_kwargs)
@@ -1,5 +1,6 @@
 from abc import abstractmethod
 import copy
+import itertools
 import logging
 import os
 from typing import Optional
@@ -34,7 +35,8 @@ from hexrd.core.transforms.xfcapi import (
     angles_to_dvec,
 )
 
-from hexrd.core.utils.decorators import memoize
+from hexrd.core.distortion.distortionabc import DistortionABC
+from hexrd.core.utils.decorators import _make_hashable, memoize
 from hexrd.core.utils.panel_buffer import panel_buffer_from_str
 from hexrd.core.gridutil import cellIndices
 from hexrd.core.instrument import detector_coatings
@@ -50,6 +52,13 @@ max_workers_DFLT = max(1, os.cpu_count() - 1)
 
 beam_energy_DFLT = 65.351
 
+# Each change to the geometry of any detector gets the next version
+_geometry_versions = itertools.count()
+
+# Bound on the size of the cache of each pixel quantity (e.g. the pixel
+# angles), for all detectors
+pixel_cache_maxbytes_DFLT = 2**31
+
 # Memoize these, so each detector can avoid re-computing if nothing
 # has changed.
 _lorentz_factor = memoize(crystallography.lorentz_factor)
@@ -294,6 +303,8 @@ class Detector:
 
         self._distortion = distortion
 
+        self._geometry_version = next(_geometry_versions)
+
         self.max_workers = max_workers
 
         self.group = group
@@ -334,6 +345,7 @@ class Detector:
     def rows(self, x):
         assert isinstance(x, int)
         self._rows = x
+        self._geometry_version = next(_geometry_versions)
 
     @property
     def cols(self):
@@ -343,6 +355,7 @@ class Detector:
     def cols(self, x):
         assert isinstance(x, int)
         self._cols = x
+        self._geometry_version = next(_geometry_versions)
 
     @property
     def pixel_size_row(self):
@@ -351,6 +364,7 @@ class Detector:
     @pixel_size_row.setter
     def pixel_size_row(self, x):
         self._pixel_size_row = float(x)
+        self._geometry_version = next(_geometry_versions)
 
     @property
     def pixel_size_col(self):
@@ -359,6 +373,7 @@ class Detector:
     @pixel_size_col.setter
     def pixel_size_col(self, x):
         self._pixel_size_col = float(x)
+        self._geometry_version = next(_geometry_versions)
 
     @property
     def pixel_area(self):
@@ -472,6 +487,7 @@ class Detector:
         if len(x) != 3:
             raise ValueError('tvec must be a 3-element array-like')
         self._tvec = x
+        self._geometry_version = next(_geometry_versions)
 
     @property
     def tilt(self):
@@ -482,6 +498,7 @@ class Detector:
         if len(x) != 3:
             raise ValueError('tilt must be a 3-element array-like')
         self._tilt = np.array(x).squeeze()
+        self._geometry_version = next(_geometry_versions)
 
     @property
     def bvec(self):
@@ -493,6 +510,7 @@ class Detector:
         if len(x) != 3 or sum(x * x) < 1 - ct.sqrt_epsf:
             raise ValueError('bvec must be a 3-element array-like with unit magnitude')
         self._bvec = x
+        self._geometry_version = next(_geometry_versions)
 
     @property
     def xrs_dist(self):
@@ -515,6 +533,7 @@ class Detector:
         if len(x) != 3 or sum(x * x) < 1 - ct.sqrt_epsf:
             raise ValueError('evec must be a 3-element array-like with unit magnitude')
         self._evec = x
+        self._geometry_version = next(_geometry_versions)
 
     @property
     def distortion(self):
@@ -532,6 +551,19 @@ class Detector:
                 raise TypeError('Input distortion is not in registry')
 
         self._distortion = x
+        self._geometry_version = next(_geometry_versions)
+
+    @property
+    def geometry_version(self):
+        """Version of the geometry of the panel
+
+        This changes whenever the shape, pixel sizes, tvec, tilt, bvec,
+        evec or distortion of the panel are set, and is never the same for
+        two different geometries, so it can key the caches of quantities
+        computed from them.  Note that it does not change when their
+        arrays are modified in place.
+        """
+        return self._geometry_version
 
     @property
     def rmat(self):
@@ -549,6 +581,15 @@ class Detector:
         )
         return pix_i, pix_j
 
+    @property
+    def _pixel_coords_views(self):
+        # pixel_coords as read-only views of the pixel vectors, which cost
+        # nothing to make when the pixel quantities are cached
+        pix_i, pix_j = np.meshgrid(
+            self.row_pixel_vec, self.col_pixel_vec, indexing='ij', copy=False
+        )
+        return pix_i, pix_j
+
     @property
     def pixel_solid_angles(self) -> np.ndarray:
         y, x = self.pixel_coords
@@ -1801,7 +1842,8 @@ class Detector:
     def increase_memoization_sizes(funcs, min_size):
         for f in funcs:
             cache_info = f.cache_info()
-            if cache_info['maxsize'] < min_size:
+            maxsize = cache_info['maxsize']
+            if maxsize is not None and maxsize < min_size:
                 f.set_cache_maxsize(min_size)
 
     def calc_physics_package_transmission(
@@ -2161,6 +2203,52 @@ def _interpolate_bilinear(
     return result
 
 
+def _pixel_cache_key(*args, geometry_version=None, pixel_coords=None, **kwargs):
+    """memoize key of the pixel quantities of a panel, e.g. its pixel angles
+
+    Without a geometry version, all of the arguments are hashed.  With it,
+    the pixel coordinates (by far the biggest argument) are covered by the
+    version.  The other arguments are small, and stay in the key since
+    their arrays may be modified in place.
+    """
+    if geometry_version is None:
+        return None
+
+    def convert(x):
+        if isinstance(x, DistortionABC):
+            return (type(x).__name__, getattr(x, 'params', None))
+        return x
+
+    items = [convert(x) for x in args]
+    items.extend((k, convert(v)) for k, v in sorted(kwargs.items()))
+    return (geometry_version, _make_hashable(items))
+
+
+def _pixel_cache_group(
+    *args, panel_id=None, origin=None, bvec=None, pixel_coords=None, **kwargs
+):
+    """memoize group of the pixel quantities of a panel
+
+    The version of the group is the geometry of the panel (the origin and
+    beam vector may vary), so that the entries of its previous geometries
+    are dropped when a new one is cached.  Refining a geometry then does not
+    fill the cache with entries that can never be hit again.
+    """
+    if panel_id is None:
+        return None
+    return (panel_id, _pixel_cache_key(*args, **kwargs))
+
+
+# decorator of the module functions computing the pixel quantities of a
+# panel, which take the _pixel_angle_kwargs of the panel
+memoize_pixel_quantity = memoize(
+    maxsize=None,
+    maxbytes=pixel_cache_maxbytes_DFLT,
+    key=_pixel_cache_key,
+    group=_pixel_cache_group,
+)
+
+
 @numba.njit(nogil=True, cache=True)
 def _interpolate_bilinear_in_place(
     img: np.ndarray,
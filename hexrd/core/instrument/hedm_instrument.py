@@ -45,16 +45,18 @@ import yaml
 
 import h5py
 
+import numba
 import numpy as np
 
 from io import IOBase
 
 from scipy import ndimage
+from scipy import sparse
 from scipy.linalg import logm
-from skimage.measure import regionprops
 
 from hexrd.core import constants
 from hexrd.core.imageseries import ImageSeries
+from hexrd.core.imageseries.imageseriesiter import PrefetchIterator
 from hexrd.core.imageseries.process import ProcessedImageSeries
 from hexrd.core.imageseries.omega import OmegaImageSeries
 from hexrd.core.fitting.utils import fit_ring
@@ -76,6 +78,7 @@ from hexrd.core import constants as ct
 from hexrd.core.rotations import mapAngle
 from hexrd.core import distortion as distortion_pkg
 from hexrd.core.utils.concurrent import distribute_tasks
+from hexrd.core.utils.decorators import memoize
 from hexrd.core.utils.hdf5 import unwrap_dict_to_h5, unwrap_h5_to_dict
 from hexrd.core.utils.panel_buffer import panel_buffer_from_str
 from hexrd.core.utils.yaml import NumpyToNativeDumper
@@ -1033,6 +1036,7 @@ class HEDMInstrument(object):
         threshold=None,
         tth_tol=None,
         eta_tol=0.25,
+        merge_panels=False,
     ):
         """
         Extract eta-omega maps from an imageseries.
@@ -1040,6 +1044,11 @@ class HEDMInstrument(object):
         Quick and dirty way to histogram angular patch data for make
         pole figures suitable for fiber generation
 
+        Returns a dict of (n_rings, n_frames, n_etas) maps for each panel,
+        and the eta bin edges.  If `merge_panels` is True, the panels are
+        summed into a single array of maps instead, which is NaN where no
+        panel has data; all imageseries must then have the same frames.
+
         TODO: streamline projection code
         TODO: normalization
         !!!: images must be non-negative!
@@ -1084,17 +1093,11 @@ class HEDMInstrument(object):
                     raise RuntimeError(f"hklID '{input_hklID}' is invalid")
             tth_ranges = tth_ranges[idx]
 
-        delta_eta = eta_edges[1] - eta_edges[0]
         ncols_eta = len(eta_edges) - 1
 
-        ring_maps_panel = dict.fromkeys(self.detectors)
-        for det_key in self.detectors:
-            logger.info(f"working on detector '{det_key}'...")
-
-            # grab panel
-            panel = self.detectors[det_key]
-            # native_area = panel.pixel_area  # pixel ref area
-
+        # gather the imageseries and projection operators of all panels
+        panel_inputs = {}
+        for det_key, panel in self.detectors.items():
             # pixel angular coords for the detector panel
             ptth, peta = panel.pixel_angles()
 
@@ -1102,54 +1105,80 @@ class HEDMInstrument(object):
             ims = _parse_imgser_dict(imgser_dict, det_key, roi=panel.roi)
 
             # grab omegas from imageseries and squawk if missing
-            try:
-                omegas = ims.metadata['omega']
-            except KeyError:
+            if 'omega' not in ims.metadata:
                 raise RuntimeError(f"imageseries for '{det_key}' has no omega info")
 
-            # initialize maps and assing by row (omega/frame)
-            nrows_ome = len(omegas)
-
-            # init map with NaNs
-            shape = (len(tth_ranges), nrows_ome, ncols_eta)
-            ring_maps = np.full(shape, np.nan)
-
-            # Generate ring parameters once, and re-use them for each image
-            ring_params = []
-            for tthr in tth_ranges:
-                kwargs = {
-                    'tthr': tthr,
-                    'ptth': ptth,
-                    'peta': peta,
-                    'eta_edges': eta_edges,
-                    'delta_eta': delta_eta,
-                }
-                ring_params.append(_generate_ring_params(**kwargs))
-
-            # Divide up the images among processes
-            tasks = distribute_tasks(len(ims), self.max_workers)
-            func = partial(
-                _run_histograms,
-                ims=ims,
-                tth_ranges=tth_ranges,
-                ring_maps=ring_maps,
-                ring_params=ring_params,
-                threshold=threshold,
+            # The (ring, eta bin) projection operator is cached, so it is
+            # only rebuilt when the panel geometry or the rings change
+            projection = _polar_map_operator(
+                ptth, peta, np.asarray(tth_ranges), eta_edges
             )
+            panel_inputs[det_key] = (ims, projection)
 
-            max_workers = self.max_workers
-            if max_workers == 1 or len(tasks) == 1:
-                # Just execute it serially.
-                for task in tasks:
-                    func(task)
-            else:
-                with ThreadPoolExecutor(max_workers=max_workers) as executor:
-                    # Evaluate the results via `list()`, so that if an
-                    # exception is raised in a thread, it will be re-raised
-                    # and visible to the user.
-                    list(executor.map(func, tasks))
+        # all of the frame work for all panels goes on one pool
+        max_workers = self.max_workers
+        if merge_panels:
+            nframes = {len(ims) for ims, _ in panel_inputs.values()}
+            if len(nframes) != 1:
+                raise RuntimeError(
+                    "imageseries must have the same number of frames "
+                    "to merge panels"
+                )
+            shape = (len(tth_ranges), nframes.pop(), ncols_eta)
+
+            # panel contributions are summed straight into these; the tasks
+            # are split by frame so no two tasks touch the same rows
+            ring_sums = np.zeros(shape)
+            ring_counts = np.zeros(shape, dtype=np.uint16)
+            tasks = [
+                partial(
+                    _run_panel_histograms,
+                    rows,
+                    panel_inputs=list(panel_inputs.values()),
+                    ring_sums=ring_sums,
+                    ring_counts=ring_counts,
+                    threshold=threshold,
+                )
+                for rows in distribute_tasks(shape[1], max_workers)
+            ]
+        else:
+            ring_maps_panel = {}
+            tasks = []
+            for det_key, (ims, projection) in panel_inputs.items():
+                # init map with NaNs; assigned by row (omega/frame)
+                shape = (len(tth_ranges), len(ims), ncols_eta)
+                ring_maps_panel[det_key] = np.full(shape, np.nan)
+                tasks.extend(
+                    partial(
+                        _run_histograms,
+                        rows,
+                        ims=ims,
+                        projection=projection,
+                        ring_maps=ring_maps_panel[det_key],
+                        threshold=threshold,
+                    )
+                    for rows in distribute_tasks(len(ims), max_workers)
+                )
+
+        logger.info(
+            "extracting polar maps from %d panel(s) in %d task(s)",
+            len(panel_inputs),
+            len(tasks),
+        )
+        if max_workers == 1 or len(tasks) == 1:
+            # Just execute it serially.
+            for task in tasks:
+                task()
+        else:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                # Evaluate the results, so that if an exception is raised
+                # in a thread, it will be re-raised and visible to the user.
+                for future in [executor.submit(task) for task in tasks]:
+                    future.result()
 
-            ring_maps_panel[det_key] = ring_maps
+        if merge_panels:
+            ring_sums[ring_counts == 0] = np.nan
+            return ring_sums, eta_edges
 
         return ring_maps_panel, eta_edges
 
@@ -1694,16 +1723,142 @@ class HEDMInstrument(object):
         write_hdf5 = filename is not None and output_format == 'hdf5'
         write_text = filename is not None and output_format == 'text'
 
-        rMat_c = make_rmat_of_expmap(grain_params[:3])
-        tVec_c = grain_params[3:6]
+        ((patch_has_signal, spots),) = self._pull_spots_batch(
+            plane_data,
+            [grain_params],
+            imgser_dict,
+            tth_tol=tth_tol,
+            eta_tol=eta_tol,
+            ome_tol=ome_tol,
+            npdiv=npdiv,
+            threshold=threshold,
+            eta_ranges=eta_ranges,
+            ome_period=ome_period,
+            interp=interp,
+            keep_patch_data=return_spot_list or write_hdf5,
+        )
+
+        if write_hdf5:
+            writer = GrainDataWriter_h5(
+                os.path.join(dirname, filename),
+                self.write_config(),
+                grain_params,
+            )
+
+        output = defaultdict(list)
+        for detector_id in self.detectors:
+            if write_text:
+                output_dir = os.path.join(dirname, detector_id)
+                os.makedirs(output_dir, exist_ok=True)
+                writer = PatchDataWriter(os.path.join(output_dir, filename))
+
+            for spot in spots[detector_id]:
+                if write_text:
+                    writer.dump_patch(
+                        spot.peak_id,
+                        spot.hkl_id,
+                        spot.hkl,
+                        spot.sum_intensity,
+                        spot.max_intensity,
+                        spot.ang_center,
+                        spot.meas_angs,
+                        spot.xy_center,
+                        spot.meas_xy,
+                    )
+                elif write_hdf5:
+                    writer.dump_patch(*spot.output(True))
+                output[detector_id].append(spot.output(return_spot_list))
+
+            if write_text:
+                writer.close()
+        if write_hdf5:
+            writer.close()
+        return patch_has_signal, output
 
+    def pull_spots_multi(
+        self,
+        plane_data: PlaneData,
+        grain_params_list: list | np.ndarray,
+        imgser_dict: dict,
+        tth_tol: Optional[float] = 0.25,
+        eta_tol: Optional[float] = 1.0,
+        ome_tol: Optional[float] = 1.0,
+        npdiv: Optional[int] = 2,
+        threshold: Optional[int] = 10,
+        eta_ranges: Optional[tuple[tuple]] = [(-np.pi, np.pi)],
+        ome_period: Optional[tuple] = None,
+        return_spot_list: Optional[bool] = False,
+        interp: Literal['nearest', 'bilinear'] = 'nearest',
+    ) -> list[tuple[list, dict]]:
+        """Extract reflection info for several grains from a rotation series.
+
+        The result is the same as calling `pull_spots` for each grain in
+        turn, but the reflections of all of the grains are predicted first
+        and the patches are grouped by frame, so that each frame of the
+        image series is read only once.  No output files are written.
+
+        Parameters
+        ----------
+        grain_params_list : list or np.ndarray
+            The grain parameters of each grain; each needs at least the 6
+            orientation and position parameters.
+
+        The remaining parameters are as in `pull_spots`.
+
+        Returns
+        -------
+        results : list[tuple]
+            The `(patch_has_signal, output)` of `pull_spots` for each grain.
+        """
+        results = self._pull_spots_batch(
+            plane_data,
+            grain_params_list,
+            imgser_dict,
+            tth_tol=tth_tol,
+            eta_tol=eta_tol,
+            ome_tol=ome_tol,
+            npdiv=npdiv,
+            threshold=threshold,
+            eta_ranges=eta_ranges,
+            ome_period=ome_period,
+            interp=interp.lower(),
+            keep_patch_data=return_spot_list,
+        )
+        output = []
+        for patch_has_signal, spots in results:
+            grain_output = defaultdict(list)
+            for detector_id, panel_spots in spots.items():
+                for spot in panel_spots:
+                    grain_output[detector_id].append(spot.output(return_spot_list))
+            output.append((patch_has_signal, grain_output))
+        return output
+
+    def _pull_spots_batch(
+        self,
+        plane_data,
+        grain_params_list,
+        imgser_dict,
+        tth_tol,
+        eta_tol,
+        ome_tol,
+        npdiv,
+        threshold,
+        eta_ranges,
+        ome_period,
+        interp,
+        keep_patch_data,
+    ):
+        """Extract the spots of a list of grains <private>.
+
+        Returns `(patch_has_signal, spots)` for each grain, where `spots`
+        maps the detector keys to lists of `_SpotPatch` in patch order.
+        """
         oims0 = next(iter(imgser_dict.values()))
         omega_ranges = [
             np.radians([i['ostart'], i['ostop']]) for i in oims0.omegawedges.wedges
         ]
         if ome_period is None:
-            ims = next(iter(imgser_dict.values()))
-            ome_period = np.radians(ims.omega[0, 0] + np.array([0.0, 360.0]))
+            ome_period = np.radians(oims0.omega[0, 0] + np.array([0.0, 360.0]))
 
         # delta omega in DEGREES grabbed from first imageseries in the dict
         delta_omega = oims0.omega[0, 1] - oims0.omega[0, 0]
@@ -1721,238 +1876,192 @@ class HEDMInstrument(object):
 
         sim_results = self.simulate_rotation_series(
             plane_data,
-            [grain_params],
+            grain_params_list,
             eta_ranges=eta_ranges,
             ome_ranges=omega_ranges,
             ome_period=ome_period,
         )
 
-        if write_hdf5:
-            writer = GrainDataWriter_h5(
-                os.path.join(dirname, filename),
-                self.write_config(),
-                grain_params,
-            )
-
-        # =====================================================================
-        # LOOP OVER PANELS
-        # =====================================================================
-        next_invalid_peak_id = -100
-        patch_has_signal = []
-        output = defaultdict(list)
+        grain_spots = [
+            dict.fromkeys(self.detectors) for _ in range(len(grain_params_list))
+        ]
         for detector_id, panel in self.detectors.items():
-            hkl_ids, hkls_p, ang_centers, xy_centers, ang_pixel_size = [
-                item[0] for item in sim_results[detector_id]
-            ]
-
-            _, mask = self._get_panel_mask(
-                tth_tol, eta_tol, ang_centers, panel, rMat_c, tVec_c
-            )
-
-            hkls_p = hkls_p[mask]
-            ang_centers = ang_centers[mask]
-            hkl_ids = hkl_ids[mask]
-            xy_centers = xy_centers[mask]
-
-            patches = self._get_panel_patches(
-                panel,
-                ang_centers,
-                ang_pixel_size[mask],
-                tth_tol,
-                eta_tol,
-                rMat_c,
-                tVec_c,
-                npdiv,
-            )
             omega_image_series = _parse_imgser_dict(
                 imgser_dict, detector_id, roi=panel.roi
             )
 
-            if write_text:
-                output_dir = os.path.join(dirname, detector_id)
-                os.makedirs(output_dir, exist_ok=True)
-                writer = PatchDataWriter(os.path.join(output_dir, filename))
-
-            for patch_id, (vtx_angs, _, _, areas, xy_eval, ijs) in enumerate(patches):
-                prows, pcols = areas.shape
-                hkl_id, hkl = hkl_ids[patch_id], hkls_p[patch_id, :]
-
-                tth_edges = vtx_angs[0][0, :]
-                eta_edges = vtx_angs[1][:, 0]
-                delta_ttheta = tth_edges[1] - tth_edges[0]
-                delta_eta = eta_edges[1] - eta_edges[0]
+            # the patches of every grain that need each frame
+            frame_patches = defaultdict(list)
+            for i_grain, grain_params in enumerate(grain_params_list):
+                rMat_c = make_rmat_of_expmap(grain_params[:3])
+                tVec_c = grain_params[3:6]
 
-                omega_eval = np.degrees(ang_centers[patch_id, 2]) + ome_grid
-
-                frame_indices = [
-                    omega_image_series.omega_to_frame(omega)[0] for omega in omega_eval
+                hkl_ids, hkls_p, ang_centers, xy_centers, ang_pixel_size = [
+                    item[i_grain] for item in sim_results[detector_id]
                 ]
-                if -1 in frame_indices:
-                    logger.warning(f"window for {hkl} falls outside omega range")
-                    continue
 
-                omega_edges = omega_image_series.omega[frame_indices[0]][0]
-                patch_data_raw = np.stack(
-                    [omega_image_series[i, ijs[0], ijs[1]] for i in frame_indices],
-                    axis=0,
+                _, mask = self._get_panel_mask(
+                    tth_tol, eta_tol, ang_centers, panel, rMat_c, tVec_c
                 )
-                contains_signal = np.any(patch_data_raw > threshold)
-                patch_has_signal.append(contains_signal)
-
-                # initialize spot data parameters
-                peak_id = next_invalid_peak_id
-                sum_intensities = np.nan
-                max_intensities = np.nan
-                meas_angs = np.full(3, np.nan)
-                meas_xy = np.full(2, np.nan)
-
-                patch_data = patch_data_raw
-
-                # need to reshape eval pts for interpolation
-                xy_eval = np.vstack([xy_eval[0].flatten(), xy_eval[1].flatten()]).T
-
-                if contains_signal:
-                    # overwrite patch data if using bilinear option
-                    if interp == 'bilinear':
-                        patch_data = np.stack(
-                            [
-                                panel.interpolate_bilinear(
-                                    xy_eval,
-                                    omega_image_series[i_frame],
-                                    pad_with_nans=False,
-                                ).reshape(prows, pcols)
-                                for i_frame in frame_indices
-                            ],
-                            axis=0,
-                        )
 
-                    # now we have interpolated patch data...
-                    labels, num_peaks = ndimage.label(
-                        patch_data > threshold, label_struct
-                    )
-
-                    if num_peaks == 0:
-                        continue
+                hkls_p = hkls_p[mask]
+                ang_centers = ang_centers[mask]
+                hkl_ids = hkl_ids[mask]
+                xy_centers = xy_centers[mask]
+
+                patches = self._get_panel_patches(
+                    panel,
+                    ang_centers,
+                    ang_pixel_size[mask],
+                    tth_tol,
+                    eta_tol,
+                    rMat_c,
+                    tVec_c,
+                    npdiv,
+                )
 
-                    peak_id = patch_id
-                    coms = np.vstack(
-                        [x.weighted_centroid for x in regionprops(labels, patch_data)]
-                    )
-                    closest_peak_idx = np.argmin(
-                        np.sum(
-                            (coms - np.array(patch_data.shape) / 2) ** 2,
-                            axis=1,
+                spots = []
+                for patch_id, patch in enumerate(patches):
+                    omega_eval = np.degrees(ang_centers[patch_id, 2]) + ome_grid
+                    frame_indices = [
+                        int(omega_image_series.omega_to_frame(omega)[0])
+                        for omega in omega_eval
+                    ]
+                    if -1 in frame_indices:
+                        logger.warning(
+                            f"window for {hkls_p[patch_id, :]} "
+                            "falls outside omega range"
                         )
-                    )
-
-                    mask = labels == (closest_peak_idx + 1)
-
-                    sum_intensities = patch_data[mask].sum()
-                    max_intensities = patch_data_raw[mask].max()
-
-                    meas_angs = np.hstack(
-                        [
-                            tth_edges[0]
-                            + (0.5 + coms[closest_peak_idx][2]) * delta_ttheta,
-                            eta_edges[0]
-                            + (0.5 + coms[closest_peak_idx][1]) * delta_eta,
-                            mapAngle(
-                                np.radians(
-                                    (
-                                        omega_edges
-                                        + (0.5 + coms[closest_peak_idx][0])
-                                        * delta_omega
-                                    )
-                                ),
-                                ome_period,
-                            ),
-                        ]
-                    )
-
-                    meas_xy = self._get_meas_xy(
-                        panel,
-                        meas_angs,
-                        rMat_c,
-                        tVec_c,
-                    )
-
-                if peak_id < 0:
-                    # The peak is invalid. Decrement next invalid peak ID.
-                    next_invalid_peak_id -= 1
+                        continue
 
-                if write_text:
-                    writer.dump_patch(
-                        peak_id,
-                        hkl_id,
-                        hkl,
-                        sum_intensities,
-                        max_intensities,
-                        ang_centers[patch_id],
-                        meas_angs,
-                        xy_centers[patch_id],
-                        meas_xy,
-                    )
-                elif write_hdf5:
-                    writer.dump_patch(
+                    spot = _SpotPatch(
                         detector_id,
                         patch_id,
-                        peak_id,
-                        hkl_id,
-                        hkl,
-                        tth_edges,
-                        eta_edges,
-                        np.radians(omega_eval),
-                        xy_eval.T.reshape(2, prows, pcols),
-                        ijs,
+                        hkl_ids[patch_id],
+                        hkls_p[patch_id, :],
+                        patch,
+                        omega_eval,
                         frame_indices,
-                        patch_data,
+                        omega_image_series.omega[frame_indices[0]][0],
                         ang_centers[patch_id],
                         xy_centers[patch_id],
-                        meas_angs,
-                        meas_xy,
+                        (rMat_c, tVec_c),
                     )
+                    spots.append(spot)
+                    for k, i_frame in enumerate(frame_indices):
+                        frame_patches[i_frame].append((spot, k))
+                grain_spots[i_grain][detector_id] = spots
 
-                if return_spot_list:
-                    # Full output
-                    output[detector_id].append(
-                        [
-                            detector_id,
-                            patch_id,
-                            peak_id,
-                            hkl_id,
-                            hkl,
-                            tth_edges,
-                            eta_edges,
-                            np.radians(omega_eval),
-                            xy_eval.T.reshape(2, prows, pcols),
-                            ijs,
-                            frame_indices,
-                            patch_data,
-                            ang_centers[patch_id],
-                            xy_centers[patch_id],
-                            meas_angs,
-                            meas_xy,
-                        ]
-                    )
-                else:
-                    # Trimmed output
-                    output[detector_id].append(
-                        [
-                            peak_id,
-                            hkl_id,
-                            hkl,
-                            sum_intensities,
-                            max_intensities,
-                            ang_centers[patch_id],
-                            meas_angs,
-                            meas_xy,
-                        ]
+            self._fill_spot_patches(
+                panel,
+                omega_image_series,
+                frame_patches,
+                threshold,
+                interp,
+                label_struct,
+                delta_omega,
+                ome_period,
+                keep_patch_data,
+            )
+
+        # number the patches without signal in the order pull_spots did
+        results = []
+        for spots in grain_spots:
+            next_invalid_peak_id = -100
+            patch_has_signal = []
+            for detector_id, panel_spots in spots.items():
+                valid_spots = []
+                for spot in panel_spots:
+                    patch_has_signal.append(spot.has_signal)
+                    if spot.has_signal and spot.peak_id is None:
+                        # signal, but no peak after interpolation
+                        continue
+                    if spot.peak_id is None:
+                        spot.peak_id = next_invalid_peak_id
+                        next_invalid_peak_id -= 1
+                    valid_spots.append(spot)
+                spots[detector_id] = valid_spots
+            results.append((patch_has_signal, spots))
+        return results
+
+    def _fill_spot_patches(
+        self,
+        panel,
+        omega_image_series,
+        frame_patches,
+        threshold,
+        interp,
+        label_struct,
+        delta_omega,
+        ome_period,
+        keep_patch_data,
+    ):
+        """Read each frame once and scatter it into the patches <private>.
+
+        Patches are measured as soon as all of their frames are filled.
+        """
+        frames = sorted(frame_patches)
+        if interp == 'bilinear':
+            # the interpolation needs the whole frame
+            keys = frames
+        else:
+            # one fancy-index read for all of the patches on each frame
+            keys = (
+                (i_frame, *_spot_pixels(frame_patches[i_frame])) for i_frame in frames
+            )
+        with PrefetchIterator(
+            omega_image_series, depth=2, max_workers=1, frames=keys
+        ) as reader:
+            for i_frame, values in zip(frames, reader):
+                entries = frame_patches.pop(i_frame)
+                interpolated = None
+                if interp == 'bilinear':
+                    interpolated = panel.interpolate_bilinear(
+                        np.vstack([spot.xy_eval for spot, _ in entries]),
+                        values,
+                        pad_with_nans=False,
                     )
-            if write_text:
-                writer.close()
-        if write_hdf5:
-            writer.close()
-        return patch_has_signal, output
+                    values = values[_spot_pixels(entries)]
+
+                complete = _scatter_frame(entries, values, interpolated)
+                for spot in complete:
+                    spot.has_signal = np.any(spot.raw > threshold)
+                    if interp != 'bilinear' or not spot.has_signal:
+                        spot.data = spot.raw
+                measured = [spot for spot in complete if spot.has_signal]
+                peaks = _find_patch_peaks(
+                    [spot.data for spot in measured],
+                    [spot.raw for spot in measured],
+                    threshold,
+                    label_struct,
+                )
+                for spot, peak in zip(measured, peaks):
+                    if peak is not None:
+                        self._measure_spot(panel, spot, *peak, delta_omega, ome_period)
+                if not keep_patch_data:
+                    for spot in complete:
+                        spot.data = spot.raw = None
+
+    def _measure_spot(
+        self, panel, spot, com, sum_intensity, max_intensity, delta_omega, ome_period
+    ):
+        """Fill in the measured angles of a patch from its peak <private>"""
+        delta_ttheta = spot.tth_edges[1] - spot.tth_edges[0]
+        delta_eta = spot.eta_edges[1] - spot.eta_edges[0]
+        spot.peak_id = spot.patch_id
+        spot.sum_intensity = sum_intensity
+        spot.max_intensity = max_intensity
+        spot.meas_angs = np.hstack(
+            [
+                spot.tth_edges[0] + (0.5 + com[2]) * delta_ttheta,
+                spot.eta_edges[0] + (0.5 + com[1]) * delta_eta,
+                mapAngle(
+                    np.radians(spot.omega_edge + (0.5 + com[0]) * delta_omega),
+                    ome_period,
+                ),
+            ]
+        )
+        spot.meas_xy = self._get_meas_xy(panel, spot.meas_angs, *spot.grain_frame)
 
     def _pull_spots_check_only(
         self,
@@ -2588,39 +2697,28 @@ class GenerateEtaOmeMaps(object):
             )
 
         # ???: need to pass a threshold?
-        eta_mapping, etas = instrument.extract_polar_maps(
+        # the panels are summed into one set of ring maps as they are
+        # extracted; bins with no data on any panel are NaN
+        ring_maps, etas = instrument.extract_polar_maps(
             plane_data,
             image_series_dict,
             active_hkls=active_hkls,
             threshold=threshold,
             tth_tol=None,
             eta_tol=eta_step,
+            merge_panels=True,
         )
 
-        # for convenience grab map shape from first
-        map_shape = next(iter(eta_mapping.values())).shape[1:]
-
-        # pack all detectors with masking
         # FIXME: add omega masking
         data_store = []
         for i_ring in range(n_rings):
-            # first handle etas
-            full_map = np.zeros(map_shape, dtype=float)
-            nan_mask_full = np.zeros((len(eta_mapping), map_shape[0], map_shape[1]))
-            i_p = 0
-            for det_key, eta_map in eta_mapping.items():
-                nan_mask = ~np.isnan(eta_map[i_ring])
-                nan_mask_full[i_p] = nan_mask
-                full_map[nan_mask] += eta_map[i_ring][nan_mask]
-                i_p += 1
-            re_nan_these = np.sum(nan_mask_full, axis=0) == 0
-            full_map[re_nan_these] = np.nan
+            full_map = ring_maps[i_ring]
 
             # now omegas
             if frame_mask is not None:
                 # !!! must expand row dimension to include
                 #     skipped omegas
-                tmp = np.ones((len(frame_mask), map_shape[1])) * np.nan
+                tmp = np.ones((len(frame_mask), full_map.shape[1])) * np.nan
                 tmp[frame_mask, :] = full_map
                 full_map = tmp
             data_store.append(full_map)
@@ -2681,22 +2779,61 @@ class GenerateEtaOmeMaps(object):
         xrdutil.EtaOmeMaps.save_eta_ome_maps(self, filename)
 
 
-def _generate_ring_params(tthr, ptth, peta, eta_edges, delta_eta):
-    # mark pixels in the spec'd tth range
-    pixels_in_tthr = np.logical_and(ptth >= tthr[0], ptth <= tthr[1])
-
-    # catch case where ring isn't on detector
-    if not np.any(pixels_in_tthr):
-        return None
-
-    pixel_ids = np.where(pixels_in_tthr)
-
-    # grab relevant eta coords using histogram
-    pixel_etas = peta[pixel_ids]
-    reta_hist = histogram(pixel_etas, eta_edges)
-    bins_on_detector = np.where(reta_hist)[0]
+def _eta_bin_indices(eta, eta_edges):
+    """Indices of the (uniform) eta bins, -1 outside of the bins.
 
-    return pixel_etas, eta_edges, pixel_ids, bins_on_detector
+    This follows the binning rule of `histogram`.
+    """
+    nbins = len(eta_edges) - 1
+    if fast_histogram:
+        # fast_histogram excludes the upper edge
+        valid = np.logical_and(eta >= eta_edges[0], eta < eta_edges[-1])
+        norm = nbins / (eta_edges[-1] - eta_edges[0])
+        idx = ((eta - eta_edges[0]) * norm).astype(int)
+        valid &= idx < nbins
+    else:
+        valid = np.logical_and(eta >= eta_edges[0], eta <= eta_edges[-1])
+        idx = np.searchsorted(eta_edges, eta, side='right') - 1
+        idx[eta == eta_edges[-1]] = nbins - 1
+    idx[~valid] = -1
+    return idx
+
+
+@memoize(maxsize=16)
+def _polar_map_operator(ptth, peta, tth_ranges, eta_edges):
+    """Sparse operator projecting panel pixels onto (ring, eta bin).
+
+    Returns the flat indices of the pixels that fall in any ring, the
+    (n_rings * n_etas, n_ring_pixels) CSR matrix whose product with those
+    pixel values is their sum in each ring and eta bin, and the
+    (n_rings, n_etas) mask of the bins that have pixels on the panel.
+    This is memoized on the pixel angles (i.e. the panel geometry), the
+    ring 2theta ranges and the eta bin edges.
+    """
+    n_etas = len(eta_edges) - 1
+    ptth = ptth.ravel()
+    peta = peta.ravel()
+
+    rows = []
+    cols = []
+    for i_r, tthr in enumerate(tth_ranges):
+        # mark pixels in the spec'd tth range
+        pixel_ids = np.where(np.logical_and(ptth >= tthr[0], ptth <= tthr[1]))[0]
+        eta_idx = _eta_bin_indices(peta[pixel_ids], eta_edges)
+        valid = eta_idx >= 0
+        rows.append(i_r * n_etas + eta_idx[valid])
+        cols.append(pixel_ids[valid])
+    rows = np.hstack(rows)
+
+    # only keep the columns of the pixels that are in a ring
+    pixel_ids, cols = np.unique(np.hstack(cols), return_inverse=True)
+
+    operator = sparse.csr_matrix(
+        (np.ones(len(rows)), (rows, cols)),
+        shape=(len(tth_ranges) * n_etas, len(pixel_ids)),
+    )
+    on_detector = (np.diff(operator.indptr) > 0).reshape(len(tth_ranges), n_etas)
+    return pixel_ids, operator, on_detector
 
 
 def run_fast_histogram(x, bins, weights=None):
@@ -2709,30 +2846,350 @@ def run_numpy_histogram(x, bins, weights=None):
 
 histogram = run_fast_histogram if fast_histogram else run_numpy_histogram
 
+# number of frames projected at a time by _run_histograms
+polar_map_block_size = 8
 
-def _run_histograms(rows, ims, tth_ranges, ring_maps, ring_params, threshold):
-    for i_row in range(*rows):
-        image = ims[i_row]
+
+class _FrameBlocks:
+    """Index an imageseries by blocks (ranges) of frames"""
+
+    def __init__(self, ims):
+        self._ims = ims
+
+    def __getitem__(self, frames):
+        if hasattr(self._ims, 'get_frames'):
+            return self._ims.get_frames(frames)
+        return np.stack([self._ims[i] for i in frames])
+
+
+def _run_histograms(rows, ims, projection, ring_maps, threshold, ring_counts=None):
+    """Project the frames in `rows` onto the ring maps.
+
+    If `ring_counts` is None, the rows of `ring_maps` are overwritten, with
+    NaNs in the bins that are not on the detector.  Otherwise the finite
+    bin sums are added to `ring_maps` and counted in `ring_counts`.
+    """
+    pixel_ids, operator, on_detector = projection
+    blocks = [
+        range(i, min(i + polar_map_block_size, rows[1]))
+        for i in range(rows[0], rows[1], polar_map_block_size)
+    ]
+    # read the next block while the current one is projected
+    reader = PrefetchIterator(
+        _FrameBlocks(ims), depth=2, max_workers=1, frames=blocks
+    )
+    n_rings, n_etas = on_detector.shape
+    result = np.empty((n_rings * n_etas, polar_map_block_size))
+    for frames, images in zip(blocks, reader):
+        nframes = len(frames)
+        # only the pixels in the rings are needed
+        values = np.asarray(images).reshape(nframes, -1)[:, pixel_ids]
 
         # handle threshold if specified
         if threshold is not None:
             # !!! NaNs get preserved
-            image = np.array(image)
-            image[image < threshold] = 0.0
-
-        for i_r, tthr in enumerate(tth_ranges):
-            this_map = ring_maps[i_r]
-            params = ring_params[i_r]
-            if not params:
-                # We are supposed to skip this ring...
-                continue
+            values = np.where(values < threshold, 0.0, values)
 
-            # Unpack the params
-            pixel_etas, eta_edges, pixel_ids, bins_on_detector = params
-            result = histogram(pixel_etas, eta_edges, weights=image[pixel_ids])
+        # sums over the pixels in each bin
+        for j in range(nframes):
+            result[:, j] = operator @ values[j]
+        sums = result[:, :nframes].reshape(n_rings, n_etas, nframes).transpose(0, 2, 1)
 
+        rows_out = slice(frames.start, frames.stop)
+        if ring_counts is None:
             # Note that this preserves nan values for bins not on the detector.
-            this_map[i_row, bins_on_detector] = result[bins_on_detector]
+            ring_maps[:, rows_out] = np.where(
+                on_detector[:, np.newaxis, :], sums, np.nan
+            )
+        else:
+            valid = np.logical_and(on_detector[:, np.newaxis, :], ~np.isnan(sums))
+            ring_maps[:, rows_out] += np.where(valid, sums, 0.0)
+            ring_counts[:, rows_out] += valid
+
+
+def _run_panel_histograms(rows, panel_inputs, ring_sums, ring_counts, threshold):
+    """Accumulate the frames in `rows` of every panel into the ring sums"""
+    for ims, projection in panel_inputs:
+        _run_histograms(
+            rows, ims, projection, ring_sums, threshold, ring_counts=ring_counts
+        )
+
+
+class _SpotPatch:
+    """A reflection patch of one grain, filled in frame by frame"""
+
+    def __init__(
+        self,
+        detector_id,
+        patch_id,
+        hkl_id,
+        hkl,
+        patch,
+        omega_eval,
+        frame_indices,
+        omega_edge,
+        ang_center,
+        xy_center,
+        grain_frame,
+    ):
+        vtx_angs, _, _, areas, xy_eval, ijs = patch
+        self.detector_id = detector_id
+        self.patch_id = patch_id
+        self.hkl_id = hkl_id
+        self.hkl = hkl
+        self.tth_edges = vtx_angs[0][0, :]
+        self.eta_edges = vtx_angs[1][:, 0]
+        self.areas_shape = areas.shape
+        # need to reshape eval pts for interpolation
+        self.xy_eval = np.vstack([xy_eval[0].flatten(), xy_eval[1].flatten()]).T
+        self.ijs = ijs
+        self.omega_eval = omega_eval
+        self.frame_indices = frame_indices
+        self.omega_edge = omega_edge
+        self.ang_center = ang_center
+        self.xy_center = xy_center
+        self.grain_frame = grain_frame
+
+        self.frames_left = len(frame_indices)
+        self.raw = None
+        self.data = None
+        self.has_signal = False
+
+        # spot data parameters, until a peak is found
+        self.peak_id = None
+        self.sum_intensity = np.nan
+        self.max_intensity = np.nan
+        self.meas_angs = np.full(3, np.nan)
+        self.meas_xy = np.full(2, np.nan)
+
+    def output(self, full=False):
+        """The `pull_spots` output list for this patch"""
+        if full:
+            return [
+                self.detector_id,
+                self.patch_id,
+                self.peak_id,
+                self.hkl_id,
+                self.hkl,
+                self.tth_edges,
+                self.eta_edges,
+                np.radians(self.omega_eval),
+                self.xy_eval.T.reshape(2, *self.areas_shape),
+                self.ijs,
+                self.frame_indices,
+                self.data,
+                self.ang_center,
+                self.xy_center,
+                self.meas_angs,
+                self.meas_xy,
+            ]
+        return [
+            self.peak_id,
+            self.hkl_id,
+            self.hkl,
+            self.sum_intensity,
+            self.max_intensity,
+            self.ang_center,
+            self.meas_angs,
+            self.meas_xy,
+        ]
+
+
+def _spot_pixels(entries):
+    """The pixel indices of the `(spot, k)` entries, concatenated"""
+    rows = np.concatenate([spot.ijs[0].ravel() for spot, _ in entries])
+    cols = np.concatenate([spot.ijs[1].ravel() for spot, _ in entries])
+    return rows, cols
+
+
+def _scatter_frame(entries, values, interpolated=None):
+    """Copy the pixels of one frame into the `(spot, k)` entries.
+
+    `values` (and `interpolated`, if not None) hold the concatenated pixels
+    of the entries.  Returns the spots that are now complete.
+    """
+    complete = []
+    offset = 0
+    for spot, k in entries:
+        size = spot.ijs[0].size
+        if spot.raw is None:
+            nframes = len(spot.frame_indices)
+            spot.raw = np.empty((nframes, *spot.ijs[0].shape), dtype=values.dtype)
+            if interpolated is not None:
+                spot.data = np.empty((nframes, *spot.areas_shape))
+        spot.raw[k] = values[offset : offset + size].reshape(spot.ijs[0].shape)
+        if interpolated is not None:
+            spot.data[k] = interpolated[offset : offset + size].reshape(
+                spot.areas_shape
+            )
+        offset += size
+
+        spot.frames_left -= 1
+        if spot.frames_left == 0:
+            complete.append(spot)
+    return complete
+
+
+def _find_patch_peaks(patches, raw_patches, threshold, label_struct):
+    """Find the peak closest to the center of each patch.
+
+    The patches are labeled with the connectivity of `label_struct` (2-d
+    structures connect pixels within frames only) and measured in one
+    compiled call.  Returns, for each patch, None if no peak is found,
+    else the weighted centroid (in frame, row, column index units) of the
+    peak, its summed intensity and its maximum raw intensity.
+    """
+    if not patches:
+        return []
+
+    shapes = np.array([patch.shape for patch in patches], dtype=np.int64)
+    offsets = np.zeros(len(patches) + 1, dtype=np.int64)
+    np.cumsum(shapes.prod(axis=1), out=offsets[1:])
+    data = np.concatenate([patch.ravel() for patch in patches])
+    raw = np.concatenate([patch.ravel() for patch in raw_patches])
+
+    # compare as numpy does
+    if data.dtype.kind == 'f':
+        threshold = data.dtype.type(threshold)
+    else:
+        threshold = float(threshold)
+
+    if label_struct.ndim == 2:
+        label_struct = np.stack(
+            [np.zeros_like(label_struct), label_struct, np.zeros_like(label_struct)]
+        )
+    neighbors = np.argwhere(label_struct) - 1
+    neighbors = neighbors[np.any(neighbors != 0, axis=1)]
+
+    coms = np.empty((len(patches), 3))
+    in_peak = np.zeros(len(data), dtype=bool)
+    max_indices = np.empty(len(patches), dtype=np.int64)
+    _label_patches(
+        data, raw, shapes, offsets, threshold, neighbors, coms, in_peak, max_indices
+    )
+    # the sums are numpy's, over the pixels of the peak in raster order
+    return [
+        None if i_max < 0 else (com, data[o0:o1][in_peak[o0:o1]].sum(), raw[i_max])
+        for com, i_max, o0, o1 in zip(coms, max_indices, offsets[:-1], offsets[1:])
+    ]
+
+
+@numba.njit(nogil=True, cache=True)
+def _weighted_centroid(data, labels, label, lo, hi, nr, nc):
+    """The intensity weighted centroid of the pixels of a blob"""
+    f0, r0, c0 = lo
+    m000 = m100 = m010 = m001 = 0.0
+    for f in range(f0, hi[0] + 1):
+        for r in range(r0, hi[1] + 1):
+            for c in range(c0, hi[2] + 1):
+                q = (f * nr + r) * nc + c
+                if labels[q] == label:
+                    w = np.float64(data[q])
+                    m000 += w
+                    m100 += w * (f - f0)
+                    m010 += w * (r - r0)
+                    m001 += w * (c - c0)
+    if m000 == 0:
+        # as regionprops, for a blob without any weight
+        return np.nan, np.nan, np.nan
+    return m100 / m000 + f0, m010 / m000 + r0, m001 / m000 + c0
+
+
+@numba.njit(nogil=True, cache=True)
+def _label_patches(
+    data, raw, shapes, offsets, threshold, neighbors, coms, in_peak, max_indices
+):
+    """Label the patches and measure the blob closest to each center.
+
+    Blobs are numbered in raster order, as `ndimage.label` does, so that
+    ties between blobs are broken the same way.  The pixels of the closest
+    blob are flagged in `in_peak`.  A negative entry in `max_indices`
+    marks a patch without any blobs.
+    """
+    # work arrays, sized for the largest patch
+    max_size = np.max(offsets[1:] - offsets[:-1])
+    all_labels = np.empty(max_size, dtype=np.int64)
+    stack = np.empty(max_size, dtype=np.int64)
+    lo = np.empty((max_size, 3), dtype=np.int64)
+    hi = np.empty((max_size, 3), dtype=np.int64)
+    for p in range(len(shapes)):
+        nf, nr, nc = shapes[p]
+        o = offsets[p]
+        n = nf * nr * nc
+        labels = all_labels[:n]
+        labels[:] = 0
+        num_peaks = 0
+        for start in range(n):
+            if labels[start] != 0 or not data[o + start] > threshold:
+                continue
+            num_peaks += 1
+            labels[start] = num_peaks
+            lo[num_peaks - 1] = np.iinfo(np.int64).max
+            hi[num_peaks - 1] = -1
+            stack[0] = start
+            top = 1
+            while top > 0:
+                top -= 1
+                idx = stack[top]
+                f = idx // (nr * nc)
+                r = (idx // nc) % nr
+                c = idx % nc
+                lo[num_peaks - 1, 0] = min(lo[num_peaks - 1, 0], f)
+                lo[num_peaks - 1, 1] = min(lo[num_peaks - 1, 1], r)
+                lo[num_peaks - 1, 2] = min(lo[num_peaks - 1, 2], c)
+                hi[num_peaks - 1, 0] = max(hi[num_peaks - 1, 0], f)
+                hi[num_peaks - 1, 1] = max(hi[num_peaks - 1, 1], r)
+                hi[num_peaks - 1, 2] = max(hi[num_peaks - 1, 2], c)
+                for k in range(len(neighbors)):
+                    ff = f + neighbors[k, 0]
+                    rr = r + neighbors[k, 1]
+                    cc = c + neighbors[k, 2]
+                    if ff < 0 or ff >= nf or rr < 0 or rr >= nr or cc < 0 or cc >= nc:
+                        continue
+                    q = (ff * nr + rr) * nc + cc
+                    if labels[q] == 0 and data[o + q] > threshold:
+                        labels[q] = num_peaks
+                        stack[top] = q
+                        top += 1
+
+        if num_peaks == 0:
+            max_indices[p] = -1
+            continue
+
+        # weighted centroids, and the blob closest to the patch center
+        closest = -1
+        closest_dist = 0.0
+        for lab in range(num_peaks):
+            com0, com1, com2 = _weighted_centroid(
+                data[o : o + n], labels, lab + 1, lo[lab], hi[lab], nr, nc
+            )
+            d0 = com0 - nf / 2
+            d1 = com1 - nr / 2
+            d2 = com2 - nc / 2
+            dist = d0 * d0 + d1 * d1 + d2 * d2
+            # as np.argmin: the first minimum, or the first NaN
+            if np.isnan(dist) or closest < 0 or dist < closest_dist:
+                closest = lab
+                closest_dist = dist
+                coms[p, 0] = com0
+                coms[p, 1] = com1
+                coms[p, 2] = com2
+                if np.isnan(dist):
+                    break
+
+        # flag the closest blob, and find its maximum
+        i_max = -1
+        for q in range(n):
+            if labels[q] != closest + 1:
+                continue
+            in_peak[o + q] = True
+            # as ndarray.max: the maximum, or the first NaN
+            v = raw[o + q]
+            if i_max < 0:
+                i_max = o + q
+            elif raw[i_max] == raw[i_max] and (v != v or v > raw[i_max]):
+                i_max = o + q
+        max_indices[p] = i_max
 
 
 def _extract_detector_line_positions(
@@ -8,9 +8,8 @@ from hexrd.core.transforms.xfcapi import (
     make_beam_rmat,
     angles_to_dvec,
 )
-from hexrd.core.utils.decorators import memoize
 
-from .detector import Detector
+from .detector import Detector, memoize_pixel_quantity
 
 
 class PlanarDetector(Detector):
@@ -103,43 +102,41 @@ class PlanarDetector(Detector):
             bvec = self.bvec
 
         return _pixel_angles(
-            origin,
-            self.pixel_coords,
-            self.distortion,
-            self.rmat,
-            self.tvec,
-            bvec,
-            self.evec,
-            self.rows,
-            self.cols,
+            origin=origin,
+            bvec=bvec,
+            **self._pixel_angle_kwargs,
         )
 
     def pixel_tth_gradient(self, origin=ct.zeros_3):
         return _pixel_tth_gradient(
-            origin,
-            self.pixel_coords,
-            self.distortion,
-            self.rmat,
-            self.tvec,
-            self.bvec,
-            self.evec,
-            self.rows,
-            self.cols,
+            origin=origin,
+            bvec=self.bvec,
+            **self._pixel_angle_kwargs,
         )
 
     def pixel_eta_gradient(self, origin=ct.zeros_3):
         return _pixel_eta_gradient(
-            origin,
-            self.pixel_coords,
-            self.distortion,
-            self.rmat,
-            self.tvec,
-            self.bvec,
-            self.evec,
-            self.rows,
-            self.cols,
+            origin=origin,
+            bvec=self.bvec,
+            **self._pixel_angle_kwargs,
         )
 
+    @property
+    def _pixel_angle_kwargs(self):
+        # kwargs used for pixel angles, pixel_tth_gradient,
+        # and pixel_eta_gradient
+        return {
+            'pixel_coords': self._pixel_coords_views,
+            'distortion': self.distortion,
+            'rmat': self.rmat,
+            'tvec': self.tvec,
+            'evec': self.evec,
+            'rows': self.rows,
+            'cols': self.cols,
+            'geometry_version': self.geometry_version,
+            'panel_id': id(self),
+        }
+
     def calc_filter_coating_transmission(
         self, energy: np.floating
     ) -> tuple[np.ndarray, np.ndarray]:
@@ -210,19 +207,26 @@ class PlanarDetector(Detector):
 
     @staticmethod
     def update_memoization_sizes(all_panels):
+        # the caches of the pixel quantities are bounded by size instead
         Detector.update_memoization_sizes(all_panels)
 
-        num_matches = sum(isinstance(x, PlanarDetector) for x in all_panels)
-        funcs = [
-            _pixel_angles,
-            _pixel_tth_gradient,
-            _pixel_eta_gradient,
-        ]
-        Detector.increase_memoization_sizes(funcs, num_matches)
-
 
-@memoize
-def _pixel_angles(origin, pixel_coords, distortion, rmat, tvec, bvec, evec, rows, cols):
+@memoize_pixel_quantity
+def _pixel_angles(
+    origin,
+    pixel_coords,
+    distortion,
+    rmat,
+    tvec,
+    bvec,
+    evec,
+    rows,
+    cols,
+    geometry_version=None,
+    panel_id=None,
+):
+    # geometry_version and panel_id only key the cache (see
+    # Detector.geometry_version)
     assert len(origin) == 3, "origin must have 3 elements"
 
     pix_i, pix_j = pixel_coords
@@ -240,25 +244,17 @@ def _pixel_angles(origin, pixel_coords, distortion, rmat, tvec, bvec, evec, rows
     return tth, eta
 
 
-@memoize
-def _pixel_tth_gradient(
-    origin, pixel_coords, distortion, rmat, tvec, bvec, evec, rows, cols
-):
+@memoize_pixel_quantity
+def _pixel_tth_gradient(origin, **pixel_angle_kwargs):
     assert len(origin) == 3, "origin must have 3 elements"
-    ptth, _ = _pixel_angles(
-        origin, pixel_coords, distortion, rmat, tvec, bvec, evec, rows, cols
-    )
+    ptth, _ = _pixel_angles(origin=origin, **pixel_angle_kwargs)
     return np.linalg.norm(np.stack(np.gradient(ptth)), axis=0)
 
 
-@memoize
-def _pixel_eta_gradient(
-    origin, pixel_coords, distortion, rmat, tvec, bvec, evec, rows, cols
-):
+@memoize_pixel_quantity
+def _pixel_eta_gradient(origin, **pixel_angle_kwargs):
     assert len(origin) == 3, "origin must have 3 elemnts"
-    _, peta = _pixel_angles(
-        origin, pixel_coords, distortion, rmat, tvec, bvec, evec, rows, cols
-    )
+    _, peta = _pixel_angles(origin=origin, **pixel_angle_kwargs)
 
     peta_grad_row = np.gradient(peta, axis=0)
     peta_grad_col = np.gradient(peta, axis=1)
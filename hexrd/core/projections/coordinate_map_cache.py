@@ -0,0 +1,256 @@
+"""Cache of the coordinate maps of polar views
+
+Generating the map from the (2theta, eta) pixels of a `PolarView` to the
+detector pixels is the most expensive part of warping images.  The maps
+are cached here under a fingerprint of everything they depend on (see
+`PolarView.coordinate_map_key`), in memory and, if a directory is set, on
+disk, so that the polar views of the same geometry in any number of
+processes only generate the map once.  Any change to the geometry changes
+the fingerprint, so a stale map is never used.
+
+The disk store is enabled by setting the `directory` of
+`coordinate_map_cache`, or the HEXRD_COORDINATE_MAP_CACHE_DIR environment
+variable before hexrd is imported.
+"""
+
+import logging
+import os
+import zipfile
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# environment variable with the directory of the disk store
+CACHE_DIR_ENV_VAR = 'HEXRD_COORDINATE_MAP_CACHE_DIR'
+
+DEFAULT_MAX_MEMORY_BYTES = 2**30
+DEFAULT_MAX_DISK_BYTES = 2**33
+
+_SUFFIX = '.npz'
+
+
+class CoordinateMapCache:
+    """A size-bounded cache of polar view coordinate maps
+
+    The maps are kept in memory and in the files of a directory, and the
+    least recently used ones are evicted when either store grows over its
+    size limit.  The cached arrays are read-only.
+
+    Parameters
+    ----------
+    directory : str or Path, optional
+        the directory of the disk store, which is created if needed.  If
+        None, the maps are only cached in memory.
+    max_memory_bytes : int, optional
+        the maximum size of the maps kept in memory.
+    max_disk_bytes : int, optional
+        the maximum size of the files of the disk store.
+    """
+
+    def __init__(
+        self,
+        directory=None,
+        max_memory_bytes=DEFAULT_MAX_MEMORY_BYTES,
+        max_disk_bytes=DEFAULT_MAX_DISK_BYTES,
+    ):
+        self.directory = directory
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+
+        self._entries = OrderedDict()
+        self._nbytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @property
+    def directory(self):
+        return self._directory
+
+    @directory.setter
+    def directory(self, x):
+        self._directory = None if x is None else Path(x)
+
+    def get(self, key, generate):
+        """The (mapping, nan_mask) of a fingerprint
+
+        Parameters
+        ----------
+        key : str
+            the fingerprint of the map.
+        generate : callable
+            called without arguments to generate the (mapping, nan_mask)
+            if the map is not cached.
+        """
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+        entry = self._load(key)
+        if entry is not None:
+            self.disk_hits += 1
+        else:
+            self.misses += 1
+            mapping, nan_mask = generate()
+            entry = (mapping, nan_mask)
+            for arr in _entry_arrays(entry):
+                arr.flags.writeable = False
+            self._save(key, entry)
+
+        self._remember(key, entry)
+        return entry
+
+    def clear(self, disk=False):
+        """Empty the memory cache, and the disk store if `disk` is True"""
+        self._entries.clear()
+        self._nbytes = 0
+        if disk and self.directory is not None:
+            for path, _ in self._disk_entries():
+                _remove(path)
+
+    def cache_info(self):
+        return {
+            'hits': self.hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'currsize': len(self._entries),
+            'nbytes': self._nbytes,
+            'max_memory_bytes': self.max_memory_bytes,
+        }
+
+    def _remember(self, key, entry):
+        nbytes = _entry_nbytes(entry)
+        if nbytes > self.max_memory_bytes:
+            return
+
+        self._entries[key] = entry
+        self._nbytes += nbytes
+        while self._nbytes > self.max_memory_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._nbytes -= _entry_nbytes(evicted)
+
+    def _path(self, key):
+        return self.directory / f'{key}{_SUFFIX}'
+
+    def _load(self, key):
+        if self.directory is None:
+            return None
+
+        path = self._path(key)
+        if not path.exists():
+            return None
+
+        try:
+            with np.load(path, allow_pickle=False) as npz:
+                if str(npz['key']) != key:
+                    raise ValueError(f'the file is for {npz["key"]}')
+                entry = _unflatten_entry(npz)
+            # mark it as recently used
+            os.utime(path)
+        except (OSError, KeyError, ValueError, zipfile.BadZipFile) as e:
+            # a partial or otherwise broken file: generate it again
+            logger.warning(f'discarding coordinate map cache file {path}: {e}')
+            _remove(path)
+            return None
+
+        for arr in _entry_arrays(entry):
+            arr.flags.writeable = False
+        return entry
+
+    def _save(self, key, entry):
+        if self.directory is None or _entry_nbytes(entry) > self.max_disk_bytes:
+            return
+
+        path = self._path(key)
+        tmp_path = path.with_name(f'.{path.name}.{os.getpid()}.tmp')
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            with open(tmp_path, 'wb') as f:
+                np.savez(f, key=np.array(key), **_flatten_entry(entry))
+            # other processes only ever see complete files
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f'could not write coordinate map cache file {path}: {e}')
+            _remove(tmp_path)
+            return
+
+        self._evict_disk()
+
+    def _disk_entries(self):
+        entries = []
+        for path in self.directory.glob(f'*{_SUFFIX}'):
+            try:
+                entries.append((path, path.stat()))
+            except FileNotFoundError:
+                # evicted by another process
+                pass
+        return entries
+
+    def _evict_disk(self):
+        entries = sorted(self._disk_entries(), key=lambda x: x[1].st_mtime)
+        total = sum(stat.st_size for _, stat in entries)
+        for path, stat in entries:
+            if total <= self.max_disk_bytes:
+                break
+            _remove(path)
+            total -= stat.st_size
+
+
+def _entry_arrays(entry):
+    mapping, nan_mask = entry
+    yield nan_mask
+    for panel_map in mapping.values():
+        yield panel_map['xypts']
+        yield panel_map['on_panel_idx']
+        yield from panel_map['bilinear_interp_dict'].values()
+
+
+def _entry_nbytes(entry):
+    return sum(arr.nbytes for arr in _entry_arrays(entry))
+
+
+def _flatten_entry(entry):
+    # the arrays of the panels are named by the index of the panel, since
+    # detector names are arbitrary strings
+    mapping, nan_mask = entry
+    arrays = {
+        'detectors': np.array(list(mapping)),
+        'nan_mask': nan_mask,
+    }
+    for i, panel_map in enumerate(mapping.values()):
+        arrays[f'{i}.xypts'] = panel_map['xypts']
+        arrays[f'{i}.on_panel_idx'] = panel_map['on_panel_idx']
+        for k, v in panel_map['bilinear_interp_dict'].items():
+            arrays[f'{i}.interp.{k}'] = v
+    return arrays
+
+
+def _unflatten_entry(npz):
+    mapping = {}
+    for i, detector_id in enumerate(npz['detectors'].tolist()):
+        prefix = f'{i}.interp.'
+        mapping[detector_id] = {
+            'xypts': npz[f'{i}.xypts'],
+            'on_panel_idx': npz[f'{i}.on_panel_idx'],
+            'bilinear_interp_dict': {
+                name[len(prefix) :]: npz[name]
+                for name in npz.files
+                if name.startswith(prefix)
+            },
+        }
+    return mapping, npz['nan_mask']
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+coordinate_map_cache = CoordinateMapCache(directory=os.environ.get(CACHE_DIR_ENV_VAR))
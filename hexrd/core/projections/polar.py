@@ -1,16 +1,28 @@
+from concurrent.futures import ThreadPoolExecutor
 import warnings
 
+import numba
 import numpy as np
+from scipy import sparse
+import xxhash
 
 from hexrd.core import constants
 from hexrd.core.instrument.detector import _interpolate_bilinear_in_place
 from hexrd.core.material.crystallography import PlaneData
+from hexrd.core.projections.coordinate_map_cache import coordinate_map_cache
 from hexrd.hed.xrdutil.utils import (
     _project_on_detector_cylinder,
     _project_on_detector_plane,
 )
+from hexrd.core.utils.decorators import _make_hashable
 from hexrd.core.utils.panel_buffer import panel_buffer_as_2d_array
 
+# bumped whenever the contents of the coordinate maps change
+_COORDINATE_MAP_VERSION = 1
+
+# number of frames of a stack warped at a time
+polar_warp_block_size = 8
+
 
 class PolarView:
     """
@@ -47,12 +59,12 @@ class PolarView:
             The angular pixels sizes (2theta, eta) in degrees.
             The default is (0.1, 0.25).
         cache_coordinate_map : bool, optional
-            If True, the coordinate map will be cached so that calls to
-            `warp_image()` will be *significantly* faster.
-            If set to True, the caller *must* ensure that no parameters
-            on the instrument that would affect polar view generation,
-            and no parameters set on this class, will be modified,
-            because doing so would result in an incorrect `warp_image()`.
+            If True, the coordinate map is generated now and kept by this
+            object, rather than looked up for each call to `warp_image()`.
+            In any case, the maps are cached by
+            `hexrd.core.projections.coordinate_map_cache`, and are
+            generated again whenever the instrument or this class are
+            modified in a way that changes them.
 
         Returns
         -------
@@ -83,16 +95,18 @@ class PolarView:
 
         self._instrument = instrument
 
+        self._coordinate_map_key = None
         self._coordinate_mapping = None
         self._nan_mask = None
+        self._warp_operator_key = None
+        self._warp_operator = None
         self._cache_coordinate_map = cache_coordinate_map
         if cache_coordinate_map:
             # It is important to generate the cached map now, rather than
             # later, because this object might be sent to other processes
             # for parallelization, and it will be faster if the mapping
             # is already generated.
-            self._coordinate_mapping = self._generate_coordinate_mapping()
-            self._nan_mask = self._generate_nan_mask(self._coordinate_mapping)
+            self._get_coordinate_map()
 
     @property
     def instrument(self):
@@ -260,47 +274,204 @@ class PolarView:
         """
         Performs the polar mapping of the input images.
 
-        Note: this function has the potential to run much faster if
-        `cache_coordinate_map` is set to `True` on the `PolarView`
-        initialization.
+        Note: the coordinate map of the detectors is only generated for the
+        first image of each geometry (see `coordinate_map_key()`).
 
         Parameters
         ----------
         image_dict : dict
-            DIctionary of image arrays, 1 per detector.
+            DIctionary of image arrays, 1 per detector.  These may also be
+            stacks of frames (e.g. of an omega series) of shape
+            (nframes, rows, cols), which are all warped at once.
 
         Returns
         -------
         wimg : numpy.ndarray
             The composite polar mapping of the detector images.  Dimensions are
-            self.shape
+            self.shape, or (nframes,) + self.shape for stacks of frames.
 
         Notes
         -----
         Tested ouput using Maud.
 
         """
+        key = self.coordinate_map_key()
+        mapping, nan_mask = self._get_coordinate_map(key)
+        first_det = next(iter(self.detectors))
+        if np.ndim(image_dict[first_det]) == 2:
+            return self._warp_image_from_coordinate_map(
+                image_dict,
+                mapping,
+                nan_mask,
+                pad_with_nans=pad_with_nans,
+                do_interpolation=do_interpolation,
+            )
+
+        nframes = len(image_dict[first_det])
+        if do_interpolation:
+            operator = self._get_warp_operator(key, mapping)
+            output_img = self._warp_images_from_operator(image_dict, operator, nframes)
+        else:
+            output_img = np.empty((nframes,) + self.shape)
+            for i in range(nframes):
+                output_img[i] = self._warp_image_from_coordinate_map(
+                    {k: image_dict[k][i] for k in self.detectors},
+                    mapping,
+                    nan_mask,
+                    do_interpolation=False,
+                ).data
+
+        mask = np.broadcast_to(nan_mask, output_img.shape).copy()
+        if pad_with_nans:
+            output_img[mask] = np.nan
+
+        return np.ma.masked_array(data=output_img, mask=mask, fill_value=0.0)
+
+    def coordinate_map_key(self) -> str:
+        """Fingerprint of everything the coordinate map depends on
+
+        This covers the geometry of each detector (including its distortion
+        and panel buffer), the sample chi and tvec, and the 2theta and eta
+        ranges and pixel sizes of this polar view.
+        """
+        items = [
+            _COORDINATE_MAP_VERSION,
+            self.tth_min,
+            self.tth_max,
+            self.tth_pixel_size,
+            self.eta_min,
+            self.eta_max,
+            self.eta_pixel_size,
+            self.chi,
+            np.asarray(self.tvec, dtype=float),
+        ]
+        for detector_id, panel in self.detectors.items():
+            items.extend(
+                [
+                    detector_id,
+                    panel.detector_type,
+                    panel.shape,
+                    panel.pixel_size_row,
+                    panel.pixel_size_col,
+                    np.asarray(panel.tvec, dtype=float),
+                    np.asarray(panel.tilt, dtype=float),
+                    np.asarray(panel.bvec, dtype=float),
+                    panel.roi,
+                    panel.panel_buffer,
+                ]
+            )
+            distortion = panel.distortion
+            if distortion is not None:
+                items.extend(
+                    [
+                        type(distortion).__name__,
+                        getattr(distortion, 'params', None),
+                    ]
+                )
+            if panel.detector_type == 'cylindrical':
+                items.append(panel.radius)
+        return xxhash.xxh3_128_hexdigest(repr(_make_hashable(items)).encode())
+
+    def _get_coordinate_map(self, key=None):
+        """The coordinate map and nan mask of the current geometry"""
+        if key is None:
+            key = self.coordinate_map_key()
+        if key == self._coordinate_map_key:
+            return self._coordinate_mapping, self._nan_mask
+
+        mapping, nan_mask = coordinate_map_cache.get(key, self._generate_coordinate_map)
         if self.cache_coordinate_map:
-            # The mapping should have already been generated.
-            mapping = self._coordinate_mapping
-            nan_mask = self._nan_mask
+            self._coordinate_map_key = key
+            self._coordinate_mapping = mapping
+            self._nan_mask = nan_mask
+        return mapping, nan_mask
+
+    def _get_warp_operator(self, key, mapping):
+        """Sparse operators of the bilinear interpolation of each panel
+
+        Returns a dict of the (self.neta * self.ntth, rows * cols) CSR
+        matrices whose products with the flattened panel images are their
+        contributions to the flattened polar image.  The operators are kept
+        until the coordinate map changes.
+        """
+        if key == self._warp_operator_key:
+            return self._warp_operator
+
+        n_points = self.neta * self.ntth
+        operator = {}
+        for detector_id, panel in self.detectors.items():
+            panel_map = mapping[detector_id]
+            interp_dict = panel_map['bilinear_interp_dict']
+            i_floor = interp_dict['i_floor_img'] * panel.cols
+            i_ceil = interp_dict['i_ceil_img'] * panel.cols
+            j_floor = interp_dict['j_floor_img']
+            j_ceil = interp_dict['j_ceil_img']
+
+            # The four neighbors of each point on the panel, in the order
+            # of the bilinear kernel so that the sums are the same.  Zero
+            # weights are kept, so that NaN pixels spread as they do there.
+            counts = np.zeros(n_points, dtype=np.int64)
+            counts[panel_map['on_panel_idx']] = 4
+            operator[detector_id] = sparse.csr_matrix(
+                (
+                    np.stack(
+                        [interp_dict[k] for k in ('cc', 'fc', 'cf', 'ff')], axis=1
+                    ).ravel(),
+                    np.stack(
+                        [
+                            i_floor + j_floor,
+                            i_floor + j_ceil,
+                            i_ceil + j_floor,
+                            i_ceil + j_ceil,
+                        ],
+                        axis=1,
+                    ).ravel(),
+                    np.hstack([0, np.cumsum(counts)]),
+                ),
+                shape=(n_points, panel.rows * panel.cols),
+            )
+
+        self._warp_operator_key = key
+        self._warp_operator = operator
+        return operator
+
+    def _warp_images_from_operator(self, image_dict, warp_operator, nframes):
+        """Warp stacks of frames with the sparse warp operators
+
+        The frames are warped in blocks, on as many threads as the
+        instrument's max_workers.
+        """
+        result = np.zeros((nframes, self.neta * self.ntth))
+
+        def warp_block(frames):
+            start, stop = frames
+            for detector_id, operator in warp_operator.items():
+                images = np.asarray(image_dict[detector_id][start:stop])
+                _csr_warp_frames(
+                    operator.indptr,
+                    operator.indices,
+                    operator.data,
+                    images.reshape(stop - start, -1),
+                    result[start:stop],
+                )
+
+        blocks = [
+            (i, min(i + polar_warp_block_size, nframes))
+            for i in range(0, nframes, polar_warp_block_size)
+        ]
+        max_workers = min(getattr(self.instrument, 'max_workers', 1), len(blocks))
+        if max_workers <= 1:
+            for block in blocks:
+                warp_block(block)
         else:
-            # Otherwise, we must generate it every time
-            mapping = self._generate_coordinate_mapping()
-            # FIXME: this performs a bilinear interpolation
-            # each time. Maybe it doesn't matter that much
-            # since the interpolation is very fast now, but
-            # it'd be nice if we could figure out another
-            # way to do it.
-            nan_mask = self._generate_nan_mask(mapping)
-
-        return self._warp_image_from_coordinate_map(
-            image_dict,
-            mapping,
-            nan_mask,
-            pad_with_nans=pad_with_nans,
-            do_interpolation=do_interpolation,
-        )
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                list(executor.map(warp_block, blocks))
+
+        return result.reshape((nframes,) + self.shape)
+
+    def _generate_coordinate_map(self):
+        mapping = self._generate_coordinate_mapping()
+        return mapping, self._generate_nan_mask(mapping)
 
     def _generate_coordinate_mapping(self) -> dict[str, dict[str, np.ndarray]]:
         """Generate mapping of detector coordinates to generate polar view
@@ -435,7 +606,8 @@ class PolarView:
             # We pad with nans manually here
             output_img[nan_mask] = np.nan
 
-        return np.ma.masked_array(data=output_img, mask=nan_mask, fill_value=0.0)
+        # the nan mask may be cached: don't let the masked array share it
+        return np.ma.masked_array(data=output_img, mask=nan_mask.copy(), fill_value=0.0)
 
     def tth_to_pixel(self, tth):
         """
@@ -444,6 +616,21 @@ class PolarView:
         return np.degrees(tth - self.tth_min) / self.tth_pixel_size
 
 
+@numba.njit(nogil=True, cache=True)
+def _csr_warp_frames(indptr, indices, weights, frames, output):
+    """Add the products of a CSR matrix with each frame to the output rows"""
+    for f in range(frames.shape[0]):
+        frame = frames[f]
+        output_img = output[f]
+        for i in range(indptr.shape[0] - 1):
+            if indptr[i] == indptr[i + 1]:
+                continue
+            value = 0.0
+            for jj in range(indptr[i], indptr[i + 1]):
+                value += weights[jj] * frame[indices[jj]]
+            output_img[i] += value
+
+
 def bin_polar_view(
     polar_obj: PolarView,
     pv: np.ndarray,
@@ -453,13 +640,16 @@ def bin_polar_view(
     '''bin the polar view image into a coarser
     grid by integration around +/- "integration_range"
     every "azimuthal_interval" degree
+
+    pv may also be a stack of polar view images (see
+    `PolarView.warp_image`), which are all binned at once.
     '''
     eta_mi = np.degrees(polar_obj.eta_min)
     eta_ma = np.degrees(polar_obj.eta_max)
 
     nspec = int((eta_ma - eta_mi) / azimuthal_interval) - 1
 
-    pv_binned = np.zeros((nspec, pv.shape[1]))
+    pv_binned = np.zeros(pv.shape[:-2] + (nspec, pv.shape[-1]))
 
     tth_step = polar_obj.tth_pixel_size
     eta_step = polar_obj.eta_pixel_size
@@ -474,6 +664,6 @@ def bin_polar_view(
         # Ignore any warnings about empty slices
         with warnings.catch_warnings():
             warnings.simplefilter("ignore", category=RuntimeWarning)
-            pv_binned[i, :] = np.squeeze(np.nanmean(pv[start:stop, :], axis=0))
+            pv_binned[..., i, :] = np.nanmean(pv[..., start:stop, :], axis=-2)
 
     return pv_binned
@@ -456,6 +456,96 @@ def quatAverageCluster(q_in, qsym):
     return q_bar
 
 
+def quatAverageClusters(q_in, cl, qsym, chunk_size=65536):
+    """
+    Average quaternions by cluster, for all clusters at once.
+
+    This is equivalent to calling `quatAverageCluster` on the members of
+    each cluster in turn, but the members are grouped with a single sort and
+    every step is applied to all clusters in one vectorized pass.
+
+    Parameters
+    ----------
+    q_in : (4, n) ndarray
+        hstacked quaternions.
+    cl : (n, ) array_like
+        integer cluster label for each quaternion; negative labels (noise)
+        are ignored.
+    qsym : (4, m) ndarray
+        the crystal symmetry group, as quaternions.
+    chunk_size : int, optional
+        the number of quaternions reduced to the fundamental region at a
+        time, which bounds the temporary memory.  The default is 65536.
+
+    Returns
+    -------
+    q_bar : (4, k) ndarray
+        the average quaternion of each of the k clusters, in order of
+        increasing label.
+    """
+    assert q_in.ndim == 2, 'input must be 2-s hstacked quats'
+    cl = np.asarray(cl).flatten()
+
+    keep = cl >= 0
+    order = np.argsort(cl[keep], kind='stable')
+    q_in = unitVector(q_in[:, keep][:, order])
+    labels, starts, counts = np.unique(
+        cl[keep][order], return_index=True, return_counts=True
+    )
+    nclusters = len(labels)
+    q_bar = np.empty((4, nclusters))
+
+    # singletons
+    single = counts == 1
+    q_bar[:, single] = q_in[:, starts[single]]
+
+    # pairs: half way along the misorientation
+    pair = counts == 2
+    if np.any(pair):
+        q1 = q_in[:, starts[pair]]
+        q2 = q_in[:, starts[pair] + 1]
+        m = qsym.shape[1]
+        npair = q1.shape[1]
+        q2s = np.dot(quatProductMatrix(qsym, mult='right'), q2)
+        eqvMis = fixQuat(
+            np.einsum(
+                'nij,mjn->imn',
+                quatProductMatrix(invertQuat(q1), mult='right'),
+                q2s,
+            ).reshape(4, m * npair)
+        ).reshape(4, m, npair)
+        imax = np.argmax(eqvMis[0], axis=0)
+        mis = eqvMis[:, imax, np.arange(npair)]
+        ma = 2 * arccosSafe(mis[0])
+        q_bar[:, pair] = quatProduct(
+            q1, quatOfExpMap(0.5 * ma * unitVector(mis[1:])).reshape(4, npair)
+        )
+
+    # three or more: average in the fundamental region about the first
+    multi = counts > 2
+    if np.any(multi):
+        idx = np.where(np.repeat(multi, counts))[0]
+        q0 = np.repeat(q_in[:, starts[multi]], counts[multi], axis=1)
+        qrot = np.einsum(
+            'nij,jn->in',
+            quatProductMatrix(invertQuat(q0), mult='left'),
+            q_in[:, idx],
+        )
+        for i in range(0, qrot.shape[1], chunk_size):
+            qrot[:, i : i + chunk_size] = toFundamentalRegion(
+                qrot[:, i : i + chunk_size], crysSym=qsym
+            )
+        offsets = np.r_[0, np.cumsum(counts[multi])[:-1]]
+        q_avg = unitVector(np.add.reduceat(qrot, offsets, axis=1) / counts[multi])
+        q_avg = np.einsum(
+            'nij,jn->in',
+            quatProductMatrix(q_in[:, starts[multi]], mult='left'),
+            q_avg,
+        )
+        q_bar[:, multi] = toFundamentalRegion(q_avg, crysSym=qsym)
+    return q_bar
+
+
 def quatAverage(q_in, qsym):
     """ """
     assert q_in.ndim == 2, 'input must be 2-s hstacked quats'
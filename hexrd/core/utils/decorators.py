@@ -22,7 +22,7 @@ def undoc(func):
     return func
 
 
-def memoize(func=None, maxsize=2):
+def memoize(func=None, maxsize=2, maxbytes=None, key=None, group=None):
     """Decorator. Caches a function's return value each time it is called.
     If called later with the same arguments, the cached value is returned
     (not reevaluated).
@@ -30,7 +30,22 @@ def memoize(func=None, maxsize=2):
     This uses an LRU cache, where, before the maxsize is exceeded, the
     least recently used item will be removed.
 
-    Numpy array arguments will be hashed for use in the cache.
+    If `maxbytes` is set, least recently used items are also removed
+    to keep the total size of the numpy arrays held by the cache under
+    it, and outputs bigger than it are not cached.  `maxsize` may then be
+    None, to only bound the cache by size.
+
+    Numpy array arguments will be hashed for use in the cache.  Hashing
+    big arrays on every call can cost as much as the function, so `key`
+    may instead be a function of the arguments returning a cheap hashable
+    key for them, e.g. built from a version counter of the object they
+    come from.  If it returns None, the arguments are hashed.
+
+    `group` may be a function of the arguments returning a hashable
+    (group, version) pair, e.g. the object the arguments come from and its
+    state, or None.  When an output is cached, the cached outputs of other
+    versions of its group are removed, for when only the current version of
+    an object is ever used again.
 
     We are not using `functools.lru_cache()` only because it requires
     hashed arguments. Here, we can create hashes for the arguments on
@@ -42,6 +57,7 @@ def memoize(func=None, maxsize=2):
         cache = OrderedDict()
         hits = 0
         misses = 0
+        nbytes = 0
 
         def cache_info():
             return {
@@ -49,48 +65,96 @@ def memoize(func=None, maxsize=2):
                 'misses': misses,
                 'maxsize': maxsize,
                 'currsize': len(cache),
+                'nbytes': nbytes,
+                'maxbytes': maxbytes,
             }
 
+        def evict(new_nbytes=0, new_items=0):
+            nonlocal nbytes
+            while cache and (
+                (maxsize is not None and len(cache) + new_items > maxsize)
+                or (maxbytes is not None and nbytes + new_nbytes > maxbytes)
+            ):
+                # Remove the left item (least recently used)
+                _, (_, item_nbytes, _) = cache.popitem(last=False)
+                nbytes -= item_nbytes
+
+        def evict_other_versions(new_group):
+            nonlocal nbytes
+            group_id, version = new_group
+            stale = [
+                k
+                for k, (_, _, g) in cache.items()
+                if g is not None and g[0] == group_id and g[1] != version
+            ]
+            for k in stale:
+                nbytes -= cache.pop(k)[1]
+
         def set_cache_maxsize(x):
             nonlocal maxsize
             maxsize = x
+            evict()
 
-            while len(cache) > maxsize:
-                # Remove the left item (least recently used)
-                cache.popitem(last=False)
+        def set_cache_maxbytes(x):
+            nonlocal maxbytes
+            maxbytes = x
+            evict()
+
+        def cache_clear():
+            nonlocal nbytes
+            cache.clear()
+            nbytes = 0
 
         setattr(func, 'cache_info', cache_info)
         setattr(func, 'set_cache_maxsize', set_cache_maxsize)
+        setattr(func, 'set_cache_maxbytes', set_cache_maxbytes)
+        setattr(func, 'cache_clear', cache_clear)
 
         @wraps(func)
         def wrapped(*args, **kwargs):
             nonlocal misses
             nonlocal hits
-
-            all_args = list(args) + sorted(kwargs.items())
-            key = _make_hashable(all_args)
-            if key not in cache:
-                # Make sure the current size is less than the max size
-                while len(cache) >= maxsize:
-                    # Remove the left item (least recently used)
-                    cache.popitem(last=False)
-
-                output = func(*args, **kwargs)
-                if isinstance(output, np.ndarray):
-                    # Make the array readonly so that caller functions *cannot*
-                    # modify the cached output array. Otherwise, we run into
-                    # hard-to-track-down bugs.
-                    output.flags.writeable = False
-
-                # This inserts the item on the right (most recently used)
-                cache[key] = output
-                misses += 1
+            nonlocal nbytes
+
+            cache_key = None
+            if key is not None:
+                cache_key = key(*args, **kwargs)
+            if cache_key is None:
+                all_args = list(args) + sorted(kwargs.items())
+                cache_key = _make_hashable(all_args)
             else:
+                # never equal to the key of hashed arguments
+                cache_key = ('__key', cache_key)
+
+            if cache_key in cache:
                 # Move the item to the right (most recently used)
-                cache.move_to_end(key)
+                cache.move_to_end(cache_key)
                 hits += 1
+                return cache[cache_key][0]
+
+            output = func(*args, **kwargs)
+            misses += 1
+            if isinstance(output, np.ndarray):
+                # Make the array readonly so that caller functions *cannot*
+                # modify the cached output array. Otherwise, we run into
+                # hard-to-track-down bugs.
+                output.flags.writeable = False
+
+            output_group = None if group is None else group(*args, **kwargs)
+            if output_group is not None:
+                evict_other_versions(output_group)
+
+            output_nbytes = _nbytes(output)
+            if maxbytes is not None and output_nbytes > maxbytes:
+                return output
 
-            return cache[key]
+            # Make sure the cache stays within its bounds
+            evict(output_nbytes, 1)
+
+            # This inserts the item on the right (most recently used)
+            cache[cache_key] = (output, output_nbytes, output_group)
+            nbytes += output_nbytes
+            return output
 
         return wrapped
 
@@ -100,6 +164,17 @@ def memoize(func=None, maxsize=2):
         return decorator(func)
 
 
+def _nbytes(x):
+    """Size of the numpy arrays in an output"""
+    if isinstance(x, np.ndarray):
+        return x.nbytes
+    elif isinstance(x, (list, tuple)):
+        return sum(map(_nbytes, x))
+    elif isinstance(x, dict):
+        return sum(map(_nbytes, x.values()))
+    return 0
+
+
 def _make_hashable(items):
     """Convert a list of items into hashable forms
 
@@ -0,0 +1,141 @@
+"""Pass objects holding big numpy arrays to worker processes
+
+Objects given to the workers of a `multiprocessing.Pool` (for instance as
+`initargs`) are pickled once per worker, so each worker ends up with its
+own copy of every array they hold.  A `SharedPickle` instead copies the
+arrays once into a single `multiprocessing.shared_memory` block and pickles
+only the rest of the object; the workers unpickle it with read-only views
+of the shared block, so their start-up time and memory use do not grow
+with the size of the arrays.
+"""
+
+import io
+import pickle
+from multiprocessing import shared_memory
+
+import numpy as np
+
+# smaller arrays are cheaper to pickle along with the rest of the object
+DEFAULT_MIN_SHARED_NBYTES = 256
+
+# arrays are placed in the block on cache line boundaries
+_ALIGNMENT = 64
+
+# Blocks attached by this process.  The arrays unpickled from a block are
+# views of its buffer, which can't be closed while any of them is alive,
+# so the blocks are kept open until the process exits.
+_attached_blocks = {}
+
+
+class SharedPickle:
+    """An object pickled with its numpy arrays in shared memory
+
+    The process creating a `SharedPickle` owns the shared memory block and
+    must `unlink` it once the workers are done with it, which is done on
+    exit when it is used as a context manager.  Pickling a `SharedPickle`
+    only sends the name of the block, the layout of the arrays and the
+    pickled object without them; `load` then rebuilds the object.
+
+    Parameters
+    ----------
+    obj : object
+        any picklable object.  Each plain `np.ndarray` of at least
+        `min_nbytes` bytes that it references (e.g. the data of the frames
+        of a frame-cache image series, or of an array image series) is
+        stored in the shared block.
+    min_nbytes : int, optional
+        the size of the smallest array to put in the shared block.
+
+    Notes
+    -----
+    The arrays of the loaded object are read-only, and arrays that were not
+    C-contiguous are loaded as C-contiguous copies.
+    """
+
+    def __init__(self, obj, min_nbytes=DEFAULT_MIN_SHARED_NBYTES):
+        arrays = []
+        keys = {}
+
+        def persistent_id(x):
+            if type(x) is not np.ndarray or x.dtype.hasobject or x.nbytes < min_nbytes:
+                return None
+            # arrays referenced several times are only stored once
+            key = keys.get(id(x))
+            if key is None:
+                key = keys[id(x)] = len(arrays)
+                arrays.append(x)
+            return key
+
+        f = io.BytesIO()
+        pickler = pickle.Pickler(f, protocol=pickle.HIGHEST_PROTOCOL)
+        pickler.persistent_id = persistent_id
+        pickler.dump(obj)
+        self._pickle = f.getvalue()
+
+        layout = []
+        size = 0
+        for arr in arrays:
+            layout.append((size, arr.dtype, arr.shape))
+            size += -(-arr.nbytes // _ALIGNMENT) * _ALIGNMENT
+        self._layout = layout
+
+        self._shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        self._owner = True
+        for arr, (offset, dtype, shape) in zip(arrays, layout):
+            np.ndarray(shape, dtype, buffer=self._shm.buf, offset=offset)[...] = arr
+
+    @property
+    def name(self):
+        """The name of the shared memory block"""
+        return self._shm.name
+
+    @property
+    def nbytes(self):
+        """The size of the shared memory block"""
+        return self._shm.size
+
+    def load(self):
+        """Unpickle the object, with views of the shared arrays"""
+        buf = self._shm.buf
+
+        def persistent_load(key):
+            offset, dtype, shape = self._layout[key]
+            arr = np.ndarray(shape, dtype, buffer=buf, offset=offset)
+            arr.flags.writeable = False
+            return arr
+
+        unpickler = pickle.Unpickler(io.BytesIO(self._pickle))
+        unpickler.persistent_load = persistent_load
+        return unpickler.load()
+
+    def unlink(self):
+        """Release the shared memory block (owner only)"""
+        if self._owner and self._shm is not None:
+            self._shm.close()
+            self._shm.unlink()
+            self._shm = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.unlink()
+
+    def __getstate__(self):
+        if self._shm is None:
+            raise RuntimeError('the shared memory block was unlinked')
+        return {
+            'name': self._shm.name,
+            'layout': self._layout,
+            'pickle': self._pickle,
+        }
+
+    def __setstate__(self, state):
+        name = state['name']
+        shm = _attached_blocks.get(name)
+        if shm is None:
+            shm = _attached_blocks[name] = shared_memory.SharedMemory(name=name)
+        self._shm = shm
+        self._owner = False
+        self._layout = state['layout']
+        self._pickle = state['pickle']
@@ -185,6 +185,12 @@ def configure_parser(sub_parsers):
         action='store_true',
         help='runs the analysis with cProfile enabled',
     )
+    p.add_argument(
+        '-r',
+        '--resume',
+        action='store_true',
+        help='resumes an interrupted analysis, skipping the grains it fitted',
+    )
     p.set_defaults(func=execute)
 
 
@@ -393,6 +399,8 @@ def execute(args, parser):
             grains_table,
             show_progress=not args.quiet,
             ids_to_refine=gid_list,
+            checkpoint_filename=cfg.fit_grains.checkpoint_file,
+            resume=args.resume,
         )
 
         if args.profile:
@@ -411,6 +419,9 @@ def execute(args, parser):
 
         write_results(fit_results, cfg)
 
+        # the checkpoint is only needed until the results are written
+        cfg.fit_grains.checkpoint_file.unlink(missing_ok=True)
+
     logger.info('=== end fit-grains ===')
     # stop logging to the console
     ch.flush()
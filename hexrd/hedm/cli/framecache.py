@@ -0,0 +1,54 @@
+"""Convert frame-cache archives to the version 2 fch5 format"""
+
+descr = r"""convert an npz or fch5 frame-cache into the version 2 fch5 format,
+      which has a per-frame offset table and chunks that decode in parallel
+"""
+
+
+def configure_parser(sub_parsers):
+    p = sub_parsers.add_parser('framecache', description=descr, help=descr)
+    p.set_defaults(func=execute)
+
+    p.add_argument('infile', type=str, help='name of frame-cache to convert')
+    p.add_argument('outfile', type=str, help='name of fch5 file to write')
+    p.add_argument(
+        '-s',
+        '--style',
+        choices=['npz', 'fch5'],
+        default=None,
+        help='style of the input file; by default taken from its extension',
+    )
+    p.add_argument(
+        '-c',
+        '--chunk-size',
+        type=int,
+        default=None,
+        help='number of elements per compressed chunk',
+    )
+    p.add_argument(
+        '-j',
+        '--ncpus',
+        type=int,
+        default=None,
+        help='number of threads to use; by default all CPUs',
+    )
+
+
+def execute(args, p):
+    """convert the frame-cache"""
+    from hexrd.core.imageseries.save import (
+        convert_frame_cache,
+        FCH5_V2_CHUNK_SIZE,
+    )
+
+    chunk_size = args.chunk_size
+    if chunk_size is None:
+        chunk_size = FCH5_V2_CHUNK_SIZE
+
+    convert_frame_cache(
+        args.infile,
+        args.outfile,
+        style=args.style,
+        chunk_size=chunk_size,
+        max_workers=args.ncpus,
+    )
@@ -15,6 +15,7 @@ from hexrd.core.utils import profiler
 
 from hexrd.hedm.cli import find_orientations
 from hexrd.hedm.cli import fit_grains
+from hexrd.hedm.cli import framecache
 from hexrd.hedm.cli import pickle23
 from hexrd.hedm.cli import preprocess
 
@@ -64,6 +65,7 @@ def main():
 
     find_orientations.configure_parser(sub_parsers)
     fit_grains.configure_parser(sub_parsers)
+    framecache.configure_parser(sub_parsers)
     pickle23.configure_parser(sub_parsers)
     preprocess.configure_parser(sub_parsers)
 
@@ -51,6 +51,11 @@ class FitGrainsConfig(Config):
     def grains_file(self):
         return self.parent.analysis_dir / "grains.out"
 
+    @property
+    def checkpoint_file(self):
+        """Grain fits written as they finish, to resume an interrupted run"""
+        return self.parent.analysis_dir / "grains-checkpoint.out"
+
     @property
     def reset_exclusions(self):
         """Flag to use hkls saved in the material"""
@@ -10,8 +10,10 @@ import numpy as np
 
 # import tqdm
 
-import scipy.cluster as cluster
 from scipy import ndimage
+from scipy import sparse
+from scipy.sparse.csgraph import connected_components
+from scipy.spatial import cKDTree
 
 from hexrd.core import constants as const
 from hexrd.core import matrixutil as mutil
@@ -26,7 +28,6 @@ from hexrd.hedm.xrdutil import EtaOmeMaps
 have_sklearn = False
 try:
     from sklearn.cluster import dbscan
-    from sklearn.metrics.pairwise import pairwise_distances
 
     have_sklearn = True
 except ImportError:
@@ -35,6 +36,7 @@ except ImportError:
 
 save_as_ascii = False  # FIXME LATER...
 filter_stdev_DFLT = 1.0
+fr_chunk_size_DFLT = 65536
 
 logger = logging.getLogger(__name__)
 
@@ -200,6 +202,97 @@ def discretefiber_reduced(params_in):
     return tmp
 
 
+def _misorientation_graph(quats, qsym, radius):
+    """Sparse matrix of the pairwise misorientations within `radius`.
+
+    The orientations are reduced to the fundamental region and indexed in a
+    KD-tree.  For unit quaternions the chord length is a monotonic function
+    of the misorientation, 2*sin(angle/4), so a misorientation ball is a
+    Euclidean ball around each symmetric equivalent of the query (and its
+    antipode).  Since every point in the tree has the smallest rotation
+    angle of its equivalence class, the equivalent q*s of a query q can only
+    have neighbors if its rotation angle exceeds that of q by at most twice
+    the radius; all other (query, symmetry) combinations are skipped.
+
+    Parameters
+    ----------
+    quats : (4, n) ndarray
+        unit quaternions.
+    qsym : (4, m) ndarray
+        the symmetry group, as quaternions.
+    radius : float
+        the maximum misorientation in radians.
+
+    Returns
+    -------
+    graph : (n, n) scipy.sparse.csr_matrix
+        the misorientation angles, computed as in `xfcapi.quat_distance`,
+        for all pairs within `radius` (including the explicit zeros on
+        the diagonal).
+    """
+    n = quats.shape[1]
+    qr = np.empty((n, 4))
+    for i in range(0, n, fr_chunk_size_DFLT):
+        qr[i : i + fr_chunk_size_DFLT] = rot.toFundamentalRegion(
+            quats[:, i : i + fr_chunk_size_DFLT], crysSym=qsym
+        ).T
+
+    tree = cKDTree(qr)
+    # pad the chord slightly; the exact distances are checked below
+    max_chord = 2.0 * np.sin(0.25 * radius) * (1.0 + 1e-8) + const.epsf
+    half_ang = np.arccos(np.clip(np.abs(qr[:, 0]), 0.0, 1.0))
+
+    rows, cols, dots = [], [], []
+    for qmat in rot.quatProductMatrix(qsym, 'right'):
+        qs = np.dot(qr, qmat.T)
+        idx = np.where(
+            np.arccos(np.clip(np.abs(qs[:, 0]), 0.0, 1.0))
+            <= half_ang + radius + const.sqrt_epsf
+        )[0]
+        for k in range(0, len(idx), fr_chunk_size_DFLT):
+            kdx = idx[k : k + fr_chunk_size_DFLT]
+            qk = qs[kdx]
+            pairs = tree.sparse_distance_matrix(
+                cKDTree(np.vstack([qk, -qk])), max_chord, output_type='ndarray'
+            )
+            j = pairs['j'] % len(kdx)
+            rows.append(pairs['i'])
+            cols.append(kdx[j])
+            dots.append(np.abs(np.sum(qr[pairs['i']] * qk[j], axis=1)))
+
+    rows = np.hstack(rows)
+    cols = np.hstack(cols)
+    dots = np.hstack(dots)
+
+    # keep the closest equivalent for each pair
+    keys = rows.astype(np.int64) * n + cols
+    order = np.lexsort((-dots, keys))
+    keys = keys[order]
+    first = np.r_[True, keys[1:] != keys[:-1]]
+    rows = rows[order][first]
+    cols = cols[order][first]
+    dots = dots[order][first]
+
+    dist = 2.0 * np.arccos(np.minimum(dots, 1.0))
+    keep = dist <= radius
+    return sparse.csr_matrix((dist[keep], (rows[keep], cols[keep])), shape=(n, n))
+
+
+def _single_linkage(quats, qsym, radius):
+    """Flat single linkage clusters of `quats`, cut at `radius`.
+
+    Equivalent to `fclusterdata` with the `quat_distance` metric and the
+    'distance' criterion: the clusters are the connected components of the
+    misorientation graph.  Labels start at 1.
+    """
+    pdist = _misorientation_graph(quats, qsym, radius)
+    adjacency = sparse.csr_matrix(
+        (np.ones_like(pdist.data), pdist.indices, pdist.indptr),
+        shape=pdist.shape,
+    )
+    return connected_components(adjacency, directed=False)[1] + 1
+
+
 def run_cluster(
     compl, qfib, qsym, cfg, min_samples=None, compl_thresh=None, radius=None
 ):
@@ -230,28 +323,13 @@ def run_cluster(
         qbar = qfib[:, np.array(compl) > min_compl]
         cl = [1]
     else:
-        # use compiled module for distance
         # just to be safe, must order qsym as C-contiguous
         qsym = np.array(qsym.T, order='C').T
 
-        def quat_distance(x, y):
-            return xfcapi.quat_distance(
-                np.array(x, order='C'), np.array(y, order='C'), qsym
-            )
-
         qfib_r = qfib[:, np.array(compl) > min_compl]
 
         num_ors = qfib_r.shape[1]
 
-        if num_ors > 25000:
-            if algorithm == 'sph-dbscan' or algorithm == 'fclusterdata':
-                logger.info("falling back to euclidean DBSCAN")
-                algorithm = 'ort-dbscan'
-            # raise RuntimeError(
-            #     "Requested clustering of %d orientations, "
-            #     + "which would be too slow!" % qfib_r.shape[1]
-            # )
-
         logger.info(
             "Feeding %d orientations above %.1f%% to clustering",
             num_ors,
@@ -272,8 +350,8 @@ def run_cluster(
 
             if algorithm == 'sph-dbscan':
                 logger.info("using spherical DBSCAN")
-                # compute distance matrix
-                pdist = pairwise_distances(qfib_r.T, metric=quat_distance, n_jobs=1)
+                # sparse distance matrix of the neighborhoods
+                pdist = _misorientation_graph(qfib_r, qsym, np.radians(cl_radius))
 
                 # run dbscan
                 core_samples, labels = dbscan(
@@ -311,12 +389,7 @@ def run_cluster(
             logger.info("dbscan found %d noise points", sum(noise_points))
         elif algorithm == 'fclusterdata':
             logger.info("using spherical fclusetrdata")
-            cl = cluster.hierarchy.fclusterdata(
-                qfib_r.T,
-                np.radians(cl_radius),
-                criterion='distance',
-                metric=quat_distance,
-            )
+            cl = _single_linkage(qfib_r, qsym, np.radians(cl_radius))
         else:
             raise RuntimeError("Clustering algorithm %s not recognized" % algorithm)
 
@@ -327,19 +400,11 @@ def run_cluster(
             nblobs = len(np.unique(cl))
 
         """ PERFORM AVERAGING TO GET CLUSTER CENTROIDS """
-        qbar = np.zeros((4, nblobs))
-        for i in range(nblobs):
-            npts = sum(cl == i + 1)
-            qbar[:, i] = rot.quatAverageCluster(qfib_r[:, cl == i + 1], qsym).flatten()
+        qbar = rot.quatAverageClusters(qfib_r, cl, qsym)
 
     if algorithm in ('dbscan', 'ort-dbscan') and qbar.size / 4 > 1:
         logger.info("\tchecking for duplicate orientations...")
-        cl = cluster.hierarchy.fclusterdata(
-            qbar.T,
-            np.radians(cl_radius),
-            criterion='distance',
-            metric=quat_distance,
-        )
+        cl = _single_linkage(qbar, qsym, np.radians(cl_radius))
         nblobs_new = len(np.unique(cl))
         if nblobs_new < nblobs:
             logger.info(
@@ -347,13 +412,7 @@ def run_cluster(
                 nblobs - nblobs_new,
                 cl_radius,
             )
-            tmp = np.zeros((4, nblobs_new))
-            for i in range(nblobs_new):
-                npts = sum(cl == i + 1)
-                tmp[:, i] = rot.quatAverageCluster(
-                    qbar[:, cl == i + 1].reshape(4, npts), qsym
-                ).flatten()
-            qbar = tmp
+            qbar = rot.quatAverageClusters(qbar, cl, qsym)
 
     logger.info("clustering took %f seconds", timeit.default_timer() - start)
     logger.info(
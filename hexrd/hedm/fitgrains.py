@@ -5,6 +5,7 @@ Created on Wed Mar 22 19:04:10 2017
 
 @author: bernier2
 """
+import contextlib
 import os
 import logging
 import multiprocessing
@@ -18,6 +19,7 @@ from hexrd.core import instrument
 from hexrd.core.transforms import xfcapi
 from hexrd.core import rotations
 from hexrd.core.fitting import fitGrain, objFuncFitGrain, gFlag_ref
+from hexrd.core.utils.shared_memory import SharedPickle
 
 logger = logging.getLogger(__name__)
 
@@ -37,7 +39,8 @@ def fit_grain_FF_init(params):
     Parameters
     ----------
     params : dict
-        The dictionary of fitting parameters.
+        The dictionary of fitting parameters.  Its `imgser_dict` may be
+        a `SharedPickle`, holding the image data in shared memory.
 
     Returns
     -------
@@ -48,6 +51,8 @@ def fit_grain_FF_init(params):
     See fit_grain_FF_reduced for specification.
     """
     global paramMP
+    if isinstance(params['imgser_dict'], SharedPickle):
+        params = dict(params, imgser_dict=params['imgser_dict'].load())
     paramMP = params
 
 
@@ -105,7 +110,8 @@ def fit_grain_FF_reduced(grain_id):
     spots_filename = None if prefix is None else prefix % grain_id
 
     grain = grains_table[grain_id]
-    grain_params = grain[3:15]
+    # a copy, since the fit updates the parameters in place
+    grain_params = np.array(grain[3:15])
 
     for tols in zip(tth_tol, eta_tol, ome_tol):
         complvec, results = instrument.pull_spots(
@@ -369,6 +375,58 @@ def refine_valid_reflections(
     return culled_results_r, num_refl_valid
 
 
+def read_fit_checkpoint(filename):
+    """
+    Read the grain fits written to a checkpoint file by `fit_grains`.
+
+    Parameters
+    ----------
+    filename : str or Path
+        The checkpoint file, in the grains.out format.
+
+    Returns
+    -------
+    dict
+        The (grain_id, completeness, chisq, grain_params) fit results,
+        keyed by grain id.
+    """
+    results = {}
+    with open(filename, 'r') as f:
+        for line in f:
+            if line.startswith('#') or not line.endswith('\n'):
+                # the header, or a line cut short by the interruption
+                continue
+            row = np.array(line.split(), dtype=float)
+            grain_id = int(row[0])
+            results[grain_id] = (grain_id, row[1], row[2], row[3:15])
+    return results
+
+
+def _predicted_reflection_counts(
+    instr, plane_data, grain_params, imsd, eta_ranges, ome_period
+):
+    """
+    The number of reflections predicted on the detectors for each grain.
+
+    This is the estimate of the cost of fitting each grain.
+    """
+    oims = next(iter(imsd.values()))
+    ome_ranges = [
+        np.radians([i['ostart'], i['ostop']]) for i in oims.omegawedges.wedges
+    ]
+    sim_results = instr.simulate_rotation_series(
+        plane_data,
+        grain_params,
+        eta_ranges=eta_ranges,
+        ome_ranges=ome_ranges,
+        ome_period=ome_period,
+    )
+    counts = np.zeros(len(grain_params), dtype=int)
+    for valid_ids, *_ in sim_results.values():
+        counts += [len(ids) for ids in valid_ids]
+    return counts
+
+
 def fit_grains(
     cfg,
     grains_table,
@@ -376,12 +434,21 @@ def fit_grains(
     ids_to_refine=None,
     write_spots_files=True,
     check_if_canceled_func=None,
+    checkpoint_filename=None,
+    resume=False,
 ):
     """
     Performs optimization of grain parameters.
 
     operates on a single HEDM config block
 
+    The grains are handed out to the processes one at a time, those with
+    the most predicted reflections first.  If `checkpoint_filename` is
+    given, the result of each grain is appended to that file (in the
+    grains.out format) as soon as it is fitted.  With `resume`, the grains
+    already in an existing checkpoint file are not fitted again; their
+    results are read back from it instead.
+
     The `check_if_canceled_func` has the following signature:
 
         check_if_canceled_func() -> bool
@@ -436,56 +503,110 @@ def fit_grains(
         spots_filename=spots_filename,
     )
 
+    grain_ids = np.array(grains_table[:, 0], dtype=int)
+    ngrains = len(grain_ids)
+
+    # grains already fitted by an interrupted run
+    done = {}
+    if checkpoint_filename is not None and resume:
+        if os.path.exists(checkpoint_filename):
+            done = read_fit_checkpoint(checkpoint_filename)
+        done = {k: v for k, v in done.items() if k in grain_ids}
+        logger.info(
+            "\tresuming from '%s' with %d grains already fitted",
+            checkpoint_filename,
+            len(done),
+        )
+    todo = np.array([i for i in grain_ids if i not in done], dtype=int)
+
+    # Fit the grains with the most reflections first, so that the slowest
+    # fits don't end up as the stragglers of the run.
+    if len(todo) > 1:
+        nrefl = _predicted_reflection_counts(
+            instr,
+            cfg.material.plane_data,
+            grains_table[todo, 3:15],
+            imsd,
+            eta_ranges,
+            ome_period,
+        )
+        todo = todo[np.argsort(-nrefl, kind='stable')]
+
+    # Each fit is written to the checkpoint file as soon as it finishes
+    gw = None
+    if checkpoint_filename is not None:
+        gw = instrument.GrainDataWriter(str(checkpoint_filename))
+        for grain_id in grain_ids:
+            if grain_id in done:
+                gw.dump_grain(*done[grain_id])
+        gw.fid.flush()
+
+    def record(fit_result):
+        done[fit_result[0]] = fit_result
+        if gw is not None:
+            gw.dump_grain(*fit_result)
+            gw.fid.flush()
+        logger.debug("\tfitted grain %d (%d/%d)", fit_result[0], len(done), ngrains)
+
     # =====================================================================
     # EXECUTE MP FIT
     # =====================================================================
 
     # DO FIT!
-    if (len(grains_table) == 1 or ncpus == 1) and not check_if_canceled_func:
-        logger.info("\tstarting serial fit")
-        start = timeit.default_timer()
-        fit_grain_FF_init(params)
-        fit_results = list(
-            map(fit_grain_FF_reduced, np.array(grains_table[:, 0], dtype=int))
-        )
-        fit_grain_FF_cleanup()
-        elapsed = timeit.default_timer() - start
-    else:
-        nproc = min(ncpus, len(grains_table))
-        chunksize = max(1, len(grains_table) // ncpus)
-
-        if multiprocessing.get_start_method() == 'fork':
-            # For frame cache, we need to load in all of the data up-front
-            # so it can use fork multiprocessing to share with the other
-            # processes. Otherwise, every process will load in the data on
-            # its own. Accessing one frame in the imageseries is currently
-            # all we need to do to trigger frame caches to load in all the data.
+    start = timeit.default_timer()
+    try:
+        if (len(todo) <= 1 or ncpus == 1) and not check_if_canceled_func:
+            logger.info("\tstarting serial fit")
+            fit_grain_FF_init(params)
+            for grain_id in todo:
+                record(fit_grain_FF_reduced(grain_id))
+            fit_grain_FF_cleanup()
+        elif len(todo) > 0:
+            nproc = min(ncpus, len(todo))
+
+            # For frame cache, we need to load in all of the data up-front so
+            # that it is shared with the other processes. Otherwise, every
+            # process will load in the data on its own. Accessing one frame in
+            # the imageseries is currently all we need to do to trigger frame
+            # caches to load in all the data.
             for ims in imsd.values():
                 ims[0]
 
-        logger.info(
-            "\tstarting fit on %d processes with chunksize %d", nproc, chunksize
-        )
-        start = timeit.default_timer()
-        pool = multiprocessing.Pool(nproc, fit_grain_FF_init, (params,))
-
-        async_result = pool.map_async(
-            fit_grain_FF_reduced,
-            np.array(grains_table[:, 0], dtype=int),
-            chunksize=chunksize,
-        )
-        while not async_result.ready():
-            if check_if_canceled_func and check_if_canceled_func():
-                pool.terminate()
-                logger.info('Fit grains canceled.')
-                # Perform an early return if we need to cancel.
-                return None
-
-            async_result.wait(0.25)
-
-        fit_results = async_result.get()
-        pool.close()
-        pool.join()
-        elapsed = timeit.default_timer() - start
+            if multiprocessing.get_start_method() == 'fork':
+                # forked processes inherit the data in process memory
+                shared_imsd = contextlib.nullcontext(imsd)
+            else:
+                # publish the image data once in shared memory, rather than
+                # pickling a copy of it for every process
+                shared_imsd = SharedPickle(imsd)
+
+            # The grains are handed out one at a time, as the processes
+            # become free
+            logger.info("\tstarting fit on %d processes", nproc)
+            with shared_imsd as init_imsd:
+                init_params = dict(params, imgser_dict=init_imsd)
+                # the pool is terminated on the way out, even on an error, so
+                # that no process outlives the shared image data
+                with multiprocessing.Pool(
+                    nproc, fit_grain_FF_init, (init_params,)
+                ) as pool:
+                    results = pool.imap_unordered(fit_grain_FF_reduced, todo)
+                    while len(done) < ngrains:
+                        if check_if_canceled_func and check_if_canceled_func():
+                            logger.info('Fit grains canceled.')
+                            # Perform an early return if we need to cancel.
+                            return None
+
+                        try:
+                            record(results.next(timeout=0.25))
+                        except multiprocessing.TimeoutError:
+                            pass
+
+                    pool.close()
+                    pool.join()
+    finally:
+        if gw is not None:
+            gw.close()
+    elapsed = timeit.default_timer() - start
     logger.info("fitting took %f seconds", elapsed)
-    return fit_results
+    return [done[grain_id] for grain_id in grain_ids]
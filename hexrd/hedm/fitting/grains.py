@@ -1,6 +1,7 @@
 """Grain fitting functions"""
 
 import numpy as np
+from numba import njit
 
 from scipy import optimize
 
@@ -89,43 +90,32 @@ def fitGrain(
 
     gFit = gFull[gFlag]
 
-    # objFuncFitGrain can run *significantly* faster if we convert the
-    # results to use a dictionary instead of lists or numpy arrays.
-    # Do that conversion here, if necessary.
-    new_reflections_dict = {}
-    for det_key, results in reflections_dict.items():
-        if not isinstance(results, (list, np.ndarray)) or len(results) == 0:
-            # Maybe it's already a dict...
-            new_reflections_dict[det_key] = results
-            continue
+    # the residuals of objFuncFitGrain, with their analytic Jacobian
+    refls = _GrainReflections(instrument, [reflections_dict], bMat, wavelength)
+    pFull = np.array(gFull, dtype=float)
+    evaluated = {}
 
-        if isinstance(results, list):
-            hkls = np.atleast_2d(np.vstack([x[2] for x in results])).T
-            meas_xyo = np.atleast_2d(
-                np.vstack([np.r_[x[7], x[6][-1]] for x in results])
-            )
-        else:
-            hkls = np.atleast_2d(results[:, 2:5]).T
-            meas_xyo = np.atleast_2d(results[:, [15, 16, 12]])
+    def evaluate(gFit):
+        key = gFit.tobytes()
+        if key not in evaluated:
+            pFull[gFlag] = gFit
+            model = refls.residuals(pFull)
+            if model is None:
+                raise RuntimeError("infeasible pFull")
+            evaluated.clear()
+            evaluated[key] = model
+        return evaluated[key]
 
-        new_reflections_dict[det_key] = {
-            'hkls': hkls,
-            'meas_xyo': meas_xyo,
-        }
+    def func(gFit):
+        return evaluate(gFit)[0].flatten()
+
+    def dfun(gFit):
+        return evaluate(gFit)[1].reshape(-1, 12)[:, gFlag]
 
-    fitArgs = (
-        gFull,
-        gFlag,
-        instrument,
-        new_reflections_dict,
-        bMat,
-        wavelength,
-        omePeriod,
-    )
     results = optimize.leastsq(
-        objFuncFitGrain,
+        func,
         gFit,
-        args=fitArgs,
+        Dfun=dfun,
         diag=1.0 / gScl[gFlag].flatten(),
         factor=0.1,
         xtol=xtol,
@@ -440,3 +430,718 @@ def matchOmegas(
     calc_omes = calc_omes.T.flatten()[match_omes.T.flatten()]
 
     return match_omes, calc_omes
+
+
+def fitGrains(
+    gFull,
+    instrument,
+    reflections_dicts,
+    bMat,
+    wavelength,
+    gFlag=gFlag_ref,
+    omePeriod=None,
+    xtol=sqrt_epsf,
+    ftol=sqrt_epsf,
+    maxiter=200,
+):
+    """
+    Perform least-squares optimization of the parameters of many grains.
+
+    All the grains are refined at once by a Levenberg-Marquardt solver:
+    each iteration evaluates the residuals of `objFuncFitGrain` and their
+    analytic Jacobian for every grain in a single pass, and solves the
+    stacked (12 x 12) normal equations of the grains together.  Each grain
+    stops as soon as it has converged.
+
+    Parameters
+    ----------
+    gFull : array_like
+        The (n, 12) initial parameters of the grains.
+    instrument : HEDMInstrument
+        The instrument.
+    reflections_dicts : list of dict
+        The reflections of each grain, keyed by detector, as passed to
+        `fitGrain`.
+    bMat : numpy.ndarray
+        The (3, 3) reciprocal lattice B matrix.
+    wavelength : float
+        The wavelength, in angstroms.
+    gFlag : array_like, optional
+        The (12, ) boolean mask of the parameters to refine.  The default
+        is gFlag_ref.
+    omePeriod : optional
+        Not supported; must be None.
+    xtol : float, optional
+        The relative tolerance on the (scaled) parameters.  The default is
+        sqrt_epsf.
+    ftol : float, optional
+        The relative tolerance on the sum of squared residuals.  The
+        default is sqrt_epsf.
+    maxiter : int, optional
+        The maximum number of iterations.  The default is 200.
+
+    Raises
+    ------
+    RuntimeError
+        If the initial parameters of a grain are infeasible.
+
+    Returns
+    -------
+    numpy.ndarray
+        The (n, 12) refined parameters of the grains.
+    """
+    # FIXME: will currently fail if omePeriod is specifed
+    if omePeriod is not None:
+        raise RuntimeError
+
+    params = np.array(gFull, dtype=float, ndmin=2)
+    free = np.flatnonzero(gFlag)
+    ngrains = len(params)
+    if ngrains == 0 or len(free) == 0:
+        return params
+
+    refls = _GrainReflections(instrument, reflections_dicts, bMat, wavelength)
+    jtj, jtr, cost, feasible = refls.normal_equations(params, free)
+    if not np.all(feasible):
+        raise RuntimeError("infeasible pFull for grains %s" % np.flatnonzero(~feasible))
+
+    # variables are scaled by the norms of the columns of the Jacobian
+    scale = np.sqrt(np.diagonal(jtj, axis1=1, axis2=2)).copy()
+    scale[scale == 0] = 1.0
+
+    mu = np.full(ngrains, 1e-3)
+    nu = np.full(ngrains, 2.0)
+    active = cost > 0
+    for _ in range(maxiter):
+        idx = np.flatnonzero(active)
+        if len(idx) == 0:
+            break
+
+        # the damped Gauss-Newton steps
+        A = jtj[idx]
+        g = jtr[idx]
+        D2 = scale[idx] ** 2
+        lhs = A + (mu[idx, None] * D2)[:, :, None] * np.eye(len(free))
+        delta = -np.linalg.solve(lhs, g[:, :, None])[:, :, 0]
+
+        trial = params[idx].copy()
+        trial[:, free] += delta
+        jtj_t, jtr_t, cost_t, feasible_t = refls.normal_equations(
+            trial, free, grains=idx
+        )
+
+        # actual and predicted reductions of 0.5 * sum(resid**2)
+        actual = 0.5 * (cost[idx] - cost_t)
+        predicted = -np.sum(delta * g, axis=1) - 0.5 * np.einsum(
+            'ni,nij,nj->n', delta, A, delta
+        )
+        accept = feasible_t & (actual > 0) & (predicted > 0)
+
+        dxnorm = np.linalg.norm(scale[idx] * delta, axis=1)
+        xnorm = np.linalg.norm(scale[idx] * params[idx][:, free], axis=1)
+        converged = dxnorm <= xtol * (xnorm + xtol)
+        converged |= (
+            accept
+            & (actual <= ftol * 0.5 * cost[idx])
+            & (predicted <= ftol * 0.5 * cost[idx])
+        )
+
+        # update the accepted grains
+        acc = idx[accept]
+        params[acc] = trial[accept]
+        jtj[acc] = jtj_t[accept]
+        jtr[acc] = jtr_t[accept]
+        cost[acc] = cost_t[accept]
+        scale[acc] = np.maximum(
+            scale[acc], np.sqrt(np.diagonal(jtj_t[accept], axis1=1, axis2=2))
+        )
+        rho = actual[accept] / predicted[accept]
+        mu[acc] *= np.maximum(1.0 / 3.0, 1.0 - (2.0 * rho - 1.0) ** 3)
+        nu[acc] = 2.0
+
+        rej = idx[~accept]
+        mu[rej] *= nu[rej]
+        nu[rej] *= 2.0
+
+        active[idx[converged]] = False
+        active[cost == 0] = False
+
+    return params
+
+
+def _reflection_arrays(results):
+    """
+    The hkls (3, n) and measured x, y, omega (n, 3) of a list, array or dict
+    of reflections (see `objFuncFitGrain`), or None if there are none.
+    """
+    if not isinstance(results, dict) and len(results) == 0:
+        return None
+    if isinstance(results, list):
+        hkls = np.atleast_2d(np.vstack([x[2] for x in results])).T
+        meas_xyo = np.atleast_2d(np.vstack([np.r_[x[7], x[6][-1]] for x in results]))
+    elif isinstance(results, np.ndarray):
+        hkls = np.atleast_2d(results[:, 2:5]).T
+        meas_xyo = np.atleast_2d(results[:, [15, 16, 12]])
+    else:
+        hkls = results['hkls']
+        meas_xyo = results['meas_xyo']
+    return hkls, meas_xyo
+
+
+class _GrainReflections:
+    """
+    The reflections of a set of grains, stacked for the fitting kernels.
+
+    The reflections of grain `i` are `offsets[i]:offsets[i + 1]`, in the
+    order of the residuals of `objFuncFitGrain` (panel by panel).  Each has
+    its reciprocal lattice vector in the CRYSTAL frame, its measured
+    (unwarped) x, y and omega, and the index of its panel.
+    """
+
+    def __init__(self, instrument, reflections_dicts, bMat, wavelength):
+        panel_xforms = [
+            extract_detector_transformation(instrument.detector_parameters[k])
+            for k in instrument.detectors
+        ]
+        self.rmat_d = np.array([x[0] for x in panel_xforms], dtype=float)
+        self.tvec_d = np.array([np.ravel(x[1]) for x in panel_xforms], dtype=float)
+        self.chi = np.array([x[2] for x in panel_xforms], dtype=float)
+        self.tvec_s = np.array([np.ravel(x[3]) for x in panel_xforms], dtype=float)
+        self.bhat = np.ravel(
+            mutil.unitVector(np.reshape(instrument.beam_vector, (3, 1)))
+        ).astype(float)
+        self.wavelength = float(wavelength)
+
+        # the energy correction (see `apply_correction_to_wavelength`) as
+        # a gradient of the beam energy along one axis of the grain position
+        self.ec_axis = -1
+        self.ec_offset = 0.0
+        self.ec_slope = 0.0
+        energy_correction = instrument.energy_correction
+        if energy_correction:
+            self.ec_axis = 1 if energy_correction['axis'] == 'y' else 0
+            self.ec_offset = float(
+                np.ravel(instrument.tvec)[self.ec_axis] - energy_correction['intercept']
+            )
+            self.ec_slope = energy_correction['slope'] / 1e3
+
+        gvec_c = [np.empty((0, 3))]
+        meas_xyo = [np.empty((0, 3))]
+        panel_ids = [np.empty(0, dtype=int)]
+        counts = []
+        for reflections_dict in reflections_dicts:
+            count = 0
+            for i_det, (det_key, panel) in enumerate(instrument.detectors.items()):
+                arrays = _reflection_arrays(reflections_dict[det_key])
+                if arrays is None:
+                    continue
+                hkls, meas = arrays
+                meas = np.array(meas, dtype=float)
+                if panel.distortion is not None:
+                    meas[:, :2] = panel.distortion.apply(meas[:, :2])
+                gvec_c.append(np.dot(bMat, hkls).T)
+                meas_xyo.append(meas)
+                panel_ids.append(np.full(len(meas), i_det))
+                count += len(meas)
+            counts.append(count)
+
+        self.offsets = np.r_[0, np.cumsum(counts)].astype(np.int64)
+        self.gvec_c = np.ascontiguousarray(np.vstack(gvec_c), dtype=float)
+        self.meas_xyo = np.ascontiguousarray(np.vstack(meas_xyo), dtype=float)
+        self.panel_ids = np.hstack(panel_ids).astype(np.int64)
+
+    def _kernel_args(self):
+        return (
+            self.gvec_c,
+            self.meas_xyo,
+            self.panel_ids,
+            self.rmat_d,
+            self.tvec_d,
+            self.chi,
+            self.tvec_s,
+            self.bhat,
+            self.wavelength,
+            self.ec_axis,
+            self.ec_offset,
+            self.ec_slope,
+            constants.keVToAngstrom(1),
+        )
+
+    def residuals(self, params, grain=0):
+        """
+        The (n, 3) residuals of the reflections of a grain, and their
+        (n, 3, 12) Jacobian, or None if the parameters are infeasible.
+        """
+        start, stop = self.offsets[grain], self.offsets[grain + 1]
+        resid = np.empty((stop - start, 3))
+        jac = np.empty((stop - start, 3, 12))
+        feasible = _grain_residuals(
+            np.asarray(params, dtype=float),
+            start,
+            stop,
+            *self._kernel_args(),
+            resid,
+            jac,
+        )
+        if not feasible:
+            return None
+        return resid, jac
+
+    def normal_equations(self, params, free, grains=None):
+        """
+        The normal equations J^T J, J^T r, the sum of squared residuals
+        and the feasibility of the parameters of each grain (all of them,
+        or those with the given indices), for the `free` parameters.
+        """
+        if grains is None:
+            grains = np.arange(len(self.offsets) - 1)
+        n = len(grains)
+        nfree = len(free)
+        jtj = np.zeros((n, nfree, nfree))
+        jtr = np.zeros((n, nfree))
+        cost = np.zeros(n)
+        feasible = np.zeros(n, dtype=bool)
+        _grain_normal_equations(
+            np.ascontiguousarray(params, dtype=float),
+            self.offsets[grains],
+            self.offsets[np.asarray(grains) + 1],
+            np.asarray(free, dtype=np.int64),
+            *self._kernel_args(),
+            jtj,
+            jtr,
+            cost,
+            feasible,
+        )
+        cost[~feasible] = np.inf
+        return jtj, jtr, cost, feasible
+
+
+@njit(cache=True, nogil=True)
+def _grain_setup(
+    params,
+    ec_axis,
+    ec_offset,
+    ec_slope,
+    wavelength,
+    kev_ang,
+    rmat_c,
+    drmat_c,
+    vmat_s,
+    dwavelength,
+):
+    # the orientation and its derivatives w.r.t. the exponential map
+    # (Gallego & Yezzi, J. Math. Imaging Vis. 51, 378 (2015))
+    w0, w1, w2 = params[0], params[1], params[2]
+    phi2 = w0 * w0 + w1 * w1 + w2 * w2
+    phi = np.sqrt(phi2)
+    kmat = np.array([[0.0, -w2, w1], [w2, 0.0, -w0], [-w1, w0, 0.0]])
+    rmat_c[:] = np.eye(3)
+    if phi > epsf:
+        f1 = np.sin(phi) / phi
+        f2 = (1.0 - np.cos(phi)) / phi2
+        rmat_c += f1 * kmat + f2 * np.dot(kmat, kmat)
+        for k in range(3):
+            # w_k [w]x + [w x (I - R) e_k]x, times R / |w|^2
+            v = -rmat_c[:, k].copy()
+            v[k] += 1.0
+            c0 = w1 * v[2] - w2 * v[1]
+            c1 = w2 * v[0] - w0 * v[2]
+            c2 = w0 * v[1] - w1 * v[0]
+            m = params[k] * kmat + np.array(
+                [[0.0, -c2, c1], [c2, 0.0, -c0], [-c1, c0, 0.0]]
+            )
+            drmat_c[k] = np.dot(m, rmat_c) / phi2
+    else:
+        rmat_c += kmat
+        for k in range(3):
+            drmat_c[k] = 0.0
+        drmat_c[0, 1, 2] = -1.0
+        drmat_c[0, 2, 1] = 1.0
+        drmat_c[1, 0, 2] = 1.0
+        drmat_c[1, 2, 0] = -1.0
+        drmat_c[2, 0, 1] = -1.0
+        drmat_c[2, 1, 0] = 1.0
+
+    # the inverse stretch, from its Mandel-Voigt vector
+    isq2 = 1.0 / np.sqrt(2.0)
+    vmat_s[0, 0] = params[6]
+    vmat_s[1, 1] = params[7]
+    vmat_s[2, 2] = params[8]
+    vmat_s[1, 2] = vmat_s[2, 1] = params[9] * isq2
+    vmat_s[0, 2] = vmat_s[2, 0] = params[10] * isq2
+    vmat_s[0, 1] = vmat_s[1, 0] = params[11] * isq2
+
+    # the energy corrected wavelength, and its derivatives
+    dwavelength[:] = 0.0
+    if ec_axis < 0:
+        return wavelength
+    adjustment = (params[3 + ec_axis] + ec_offset) * ec_slope
+    wl = kev_ang / (kev_ang / wavelength + adjustment)
+    dwavelength[3 + ec_axis] = -wl * wl / kev_ang * ec_slope
+    return wl
+
+
+@njit(cache=True, nogil=True)
+def _reflection_model(
+    gvec_c,
+    meas_xyo,
+    rmat_c,
+    drmat_c,
+    vmat_s,
+    tvec_c,
+    wavelength,
+    dwavelength,
+    rmat_d,
+    tvec_d,
+    chi,
+    tvec_s,
+    bhat,
+    resid,
+    jac,
+    vecs,
+    work,
+):
+    """
+    The residual (x, y, omega) of a reflection and its (3, 12) Jacobian,
+    as in `objFuncFitGrain`.  Returns False if the reflection can't be
+    predicted.
+    """
+    ztol = epsf
+    isq2 = 1.0 / np.sqrt(2.0)
+    q = vecs[0]
+    s = vecs[1]
+    ghat = vecs[2]
+    gl = vecs[3]
+    dvec = vecs[4]
+    p0 = vecs[5]
+    rg = vecs[6]
+    rt = vecs[7]
+    ds = work[0]
+    dghat = work[1]
+    dgl = work[2]
+    ddvec = work[3]
+    dp0 = work[4]
+    dsintht = work[5, :, 0]
+    dome = work[5, :, 1]
+
+    # stretched G-vector in the SAMPLE frame, and its derivatives
+    for i in range(3):
+        q[i] = (
+            rmat_c[i, 0] * gvec_c[0]
+            + rmat_c[i, 1] * gvec_c[1]
+            + rmat_c[i, 2] * gvec_c[2]
+        )
+    for i in range(3):
+        s[i] = vmat_s[i, 0] * q[0] + vmat_s[i, 1] * q[1] + vmat_s[i, 2] * q[2]
+    ds[:] = 0.0
+    for k in range(3):
+        for i in range(3):
+            rg[i] = (
+                drmat_c[k, i, 0] * gvec_c[0]
+                + drmat_c[k, i, 1] * gvec_c[1]
+                + drmat_c[k, i, 2] * gvec_c[2]
+            )
+        for i in range(3):
+            ds[k, i] = (
+                vmat_s[i, 0] * rg[0] + vmat_s[i, 1] * rg[1] + vmat_s[i, 2] * rg[2]
+            )
+    ds[6, 0] = q[0]
+    ds[7, 1] = q[1]
+    ds[8, 2] = q[2]
+    ds[9, 1] = q[2] * isq2
+    ds[9, 2] = q[1] * isq2
+    ds[10, 0] = q[2] * isq2
+    ds[10, 2] = q[0] * isq2
+    ds[11, 0] = q[1] * isq2
+    ds[11, 1] = q[0] * isq2
+
+    # unit G-vector and sine of the Bragg angle
+    nrm = np.sqrt(s[0] * s[0] + s[1] * s[1] + s[2] * s[2])
+    for i in range(3):
+        ghat[i] = s[i] / nrm
+    sintht = 0.5 * wavelength * nrm
+    for k in range(12):
+        gds = ghat[0] * ds[k, 0] + ghat[1] * ds[k, 1] + ghat[2] * ds[k, 2]
+        for i in range(3):
+            dghat[k, i] = (ds[k, i] - ghat[i] * gds) / nrm
+        dsintht[k] = 0.5 * wavelength * gds + 0.5 * nrm * dwavelength[k]
+
+    # the omega solving a * sin(ome) + b * cos(ome) = c closest to the
+    # measured one (see `matchOmegas`)
+    cchi = np.cos(chi)
+    schi = np.sin(chi)
+    ca = schi * bhat[1] - cchi * bhat[2]
+    cb = cchi * bhat[2] - schi * bhat[1]
+    cc = -cchi * bhat[1] - schi * bhat[2]
+    a = ca * ghat[0] + bhat[0] * ghat[2]
+    b = bhat[0] * ghat[0] + cb * ghat[2]
+    c = cc * ghat[1] - sintht
+    rhs = c / np.sqrt(a * a + b * b)
+    if not np.abs(rhs) <= 1.0:
+        return False
+    phase = np.arctan2(b, a)
+    rhs_ang = np.arcsin(rhs)
+    ome0 = rhs_ang - phase
+    ome1 = np.pi - rhs_ang - phase
+    meas_ome = meas_xyo[2]
+    dome0 = np.abs(meas_ome - ome0)
+    dome0 = min(dome0, 2.0 * np.pi - dome0)
+    dome1 = np.abs(meas_ome - ome1)
+    dome1 = min(dome1, 2.0 * np.pi - dome1)
+    ome = ome1 if dome1 < dome0 else ome0
+    come = np.cos(ome)
+    some = np.sin(ome)
+    dfdome = a * come - b * some
+    for k in range(12):
+        da = ca * dghat[k, 0] + bhat[0] * dghat[k, 2]
+        db = bhat[0] * dghat[k, 0] + cb * dghat[k, 2]
+        dc = cc * dghat[k, 1] - dsintht[k]
+        dome[k] = (dc - da * some - db * come) / dfdome
+
+    # the G-vector in the LAB frame, from the sample rotation (see
+    # `make_sample_rmat`) and its derivative w.r.t. omega
+    rmat_s = np.array(
+        [
+            [come, 0.0, some],
+            [schi * some, cchi, -schi * come],
+            [-cchi * some, schi, cchi * come],
+        ]
+    )
+    drmat_s = np.array(
+        [
+            [-some, 0.0, come],
+            [schi * come, 0.0, schi * some],
+            [-cchi * come, 0.0, -cchi * some],
+        ]
+    )
+    for i in range(3):
+        gl[i] = rmat_s[i, 0] * ghat[0] + rmat_s[i, 1] * ghat[1] + rmat_s[i, 2] * ghat[2]
+        rg[i] = (
+            drmat_s[i, 0] * ghat[0] + drmat_s[i, 1] * ghat[1] + drmat_s[i, 2] * ghat[2]
+        )
+    for k in range(12):
+        for i in range(3):
+            dgl[k, i] = rg[i] * dome[k] + (
+                rmat_s[i, 0] * dghat[k, 0]
+                + rmat_s[i, 1] * dghat[k, 1]
+                + rmat_s[i, 2] * dghat[k, 2]
+            )
+
+    # the diffracted beam (see `gvec_to_xy`)
+    bdot = -(bhat[0] * gl[0] + bhat[1] * gl[1] + bhat[2] * gl[2])
+    if not (bdot >= ztol and bdot <= 1.0 - ztol):
+        return False
+    for i in range(3):
+        dvec[i] = bhat[i] + 2.0 * bdot * gl[i]
+    for k in range(12):
+        dbdot = -(bhat[0] * dgl[k, 0] + bhat[1] * dgl[k, 1] + bhat[2] * dgl[k, 2])
+        for i in range(3):
+            ddvec[k, i] = 2.0 * (dbdot * gl[i] + bdot * dgl[k, i])
+
+    # the origin of the CRYSTAL frame
+    for i in range(3):
+        p0[i] = tvec_s[i] + (
+            rmat_s[i, 0] * tvec_c[0]
+            + rmat_s[i, 1] * tvec_c[1]
+            + rmat_s[i, 2] * tvec_c[2]
+        )
+        rt[i] = (
+            drmat_s[i, 0] * tvec_c[0]
+            + drmat_s[i, 1] * tvec_c[1]
+            + drmat_s[i, 2] * tvec_c[2]
+        )
+    for k in range(12):
+        for i in range(3):
+            dp0[k, i] = rt[i] * dome[k]
+    for k in range(3):
+        for i in range(3):
+            dp0[3 + k, i] += rmat_s[i, k]
+
+    # intersection with the detector plane
+    denom = 0.0
+    num = 0.0
+    for i in range(3):
+        denom += rmat_d[i, 2] * dvec[i]
+        num += rmat_d[i, 2] * (tvec_d[i] - p0[i])
+    if np.abs(denom) < ztol or denom > 0.0:
+        return False
+    u = num / denom
+    resid[0] = -meas_xyo[0]
+    resid[1] = -meas_xyo[1]
+    for i in range(3):
+        p2 = p0[i] + u * dvec[i] - tvec_d[i]
+        resid[0] += rmat_d[i, 0] * p2
+        resid[1] += rmat_d[i, 1] * p2
+    for k in range(12):
+        dnum = 0.0
+        dden = 0.0
+        for i in range(3):
+            dnum -= rmat_d[i, 2] * dp0[k, i]
+            dden += rmat_d[i, 2] * ddvec[k, i]
+        du = (dnum - u * dden) / denom
+        jac[0, k] = 0.0
+        jac[1, k] = 0.0
+        for i in range(3):
+            dp2 = dp0[k, i] + du * dvec[i] + u * ddvec[k, i]
+            jac[0, k] += rmat_d[i, 0] * dp2
+            jac[1, k] += rmat_d[i, 1] * dp2
+
+    # the omega residual (see `angularDifference`)
+    diff = np.abs(meas_ome - ome)
+    sign = 1.0 if ome >= meas_ome else -1.0
+    if 2.0 * np.pi - diff < diff:
+        resid[2] = 2.0 * np.pi - diff
+        sign = -sign
+    else:
+        resid[2] = diff
+    for k in range(12):
+        jac[2, k] = sign * dome[k]
+    return True
+
+
+@njit(cache=True, nogil=True)
+def _grain_residuals(
+    params,
+    start,
+    stop,
+    gvec_c,
+    meas_xyo,
+    panel_ids,
+    rmat_d,
+    tvec_d,
+    chi,
+    tvec_s,
+    bhat,
+    wavelength,
+    ec_axis,
+    ec_offset,
+    ec_slope,
+    kev_ang,
+    resid,
+    jac,
+):
+    rmat_c = np.empty((3, 3))
+    drmat_c = np.empty((3, 3, 3))
+    vmat_s = np.zeros((3, 3))
+    dwavelength = np.empty(12)
+    vecs = np.empty((8, 3))
+    work = np.empty((6, 12, 3))
+    wl = _grain_setup(
+        params,
+        ec_axis,
+        ec_offset,
+        ec_slope,
+        wavelength,
+        kev_ang,
+        rmat_c,
+        drmat_c,
+        vmat_s,
+        dwavelength,
+    )
+    tvec_c = params[3:6]
+    for j in range(start, stop):
+        ip = panel_ids[j]
+        if not _reflection_model(
+            gvec_c[j],
+            meas_xyo[j],
+            rmat_c,
+            drmat_c,
+            vmat_s,
+            tvec_c,
+            wl,
+            dwavelength,
+            rmat_d[ip],
+            tvec_d[ip],
+            chi[ip],
+            tvec_s[ip],
+            bhat,
+            resid[j - start],
+            jac[j - start],
+            vecs,
+            work,
+        ):
+            return False
+    return True
+
+
+@njit(cache=True, nogil=True)
+def _grain_normal_equations(
+    params,
+    starts,
+    stops,
+    free,
+    gvec_c,
+    meas_xyo,
+    panel_ids,
+    rmat_d,
+    tvec_d,
+    chi,
+    tvec_s,
+    bhat,
+    wavelength,
+    ec_axis,
+    ec_offset,
+    ec_slope,
+    kev_ang,
+    jtj,
+    jtr,
+    cost,
+    feasible,
+):
+    rmat_c = np.empty((3, 3))
+    drmat_c = np.empty((3, 3, 3))
+    vmat_s = np.zeros((3, 3))
+    dwavelength = np.empty(12)
+    vecs = np.empty((8, 3))
+    work = np.empty((6, 12, 3))
+    resid = np.empty(3)
+    jac = np.empty((3, 12))
+    nfree = len(free)
+    for ig in range(len(starts)):
+        wl = _grain_setup(
+            params[ig],
+            ec_axis,
+            ec_offset,
+            ec_slope,
+            wavelength,
+            kev_ang,
+            rmat_c,
+            drmat_c,
+            vmat_s,
+            dwavelength,
+        )
+        tvec_c = params[ig, 3:6]
+        feasible[ig] = True
+        for j in range(starts[ig], stops[ig]):
+            ip = panel_ids[j]
+            if not _reflection_model(
+                gvec_c[j],
+                meas_xyo[j],
+                rmat_c,
+                drmat_c,
+                vmat_s,
+                tvec_c,
+                wl,
+                dwavelength,
+                rmat_d[ip],
+                tvec_d[ip],
+                chi[ip],
+                tvec_s[ip],
+                bhat,
+                resid,
+                jac,
+                vecs,
+                work,
+            ):
+                feasible[ig] = False
+                break
+            for r in range(3):
+                cost[ig] += resid[r] * resid[r]
+                for a in range(nfree):
+                    ja = jac[r, free[a]]
+                    jtr[ig, a] += ja * resid[r]
+                    for b in range(a + 1):
+                        jtj[ig, a, b] += ja * jac[r, free[b]]
+        for a in range(nfree):
+            for b in range(a):
+                jtj[ig, b, a] = jtj[ig, a, b]
@@ -14,11 +14,12 @@ import yaml
 import argparse
 import timeit
 import contextlib
+import functools
+import hashlib
 import multiprocessing
-import tempfile
-import shutil
 import socket
 import copy
+from concurrent.futures import ThreadPoolExecutor
 
 # import of hexrd modules
 # import hexrd
@@ -28,9 +29,9 @@ from hexrd.core import material
 from hexrd.core import rotations
 from hexrd.core.transforms import xfcapi
 from hexrd.core import valunits
+from hexrd.core.utils.shared_memory import SharedPickle
 from hexrd.hedm import xrdutil
-
-from skimage.morphology import dilation as ski_dilation
+from hexrd.hed.xrdutil.utils import _project_on_detector_plane
 
 import matplotlib.pyplot as plt
 
@@ -424,8 +425,9 @@ def _gvec_to_detector_array(vG_sn, rD, rSn, rC, tD, tS, tC):
 
 
 @numba.njit(nogil=True, cache=True)
-def _quant_and_clip_confidence(coords, angles, image, base, inv_deltas, clip_vals, bsp):
-    """quantize and clip the parametric coordinates in coords + angles
+def _quant_and_clip_counts(coords, angles, image, base, inv_deltas, clip_vals, bsp):
+    """quantize and clip the parametric coordinates in coords + angles,
+    counting the hits in the image
 
     coords - (..., 2) array: input 2d parametric coordinates
     angles - (...) array: additional dimension for coordinates
@@ -437,8 +439,8 @@ def _quant_and_clip_confidence(coords, angles, image, base, inv_deltas, clip_val
     clipping is performed on ranges [0, clip_vals[0]] for x and
     [0, clip_vals[1]] for y
 
-    returns an array with the quantized coordinates, with coordinates
-    falling outside the clip zone filtered out.
+    returns the number of coordinates inside the clip zone, and the number
+    of those that are set in the image.
 
     """
     count = len(coords)
@@ -480,9 +482,40 @@ def _quant_and_clip_confidence(coords, angles, image, base, inv_deltas, clip_val
         if image[z, y, x]:
             matches += 1
 
+    return in_sensor, matches
+
+
+@numba.njit(nogil=True, cache=True)
+def _quant_and_clip_confidence(coords, angles, image, base, inv_deltas, clip_vals, bsp):
+    """the fraction of the coordinates in coords + angles inside the clip zone
+    that are set in the image (see _quant_and_clip_counts)
+    """
+    in_sensor, matches = _quant_and_clip_counts(
+        coords, angles, image, base, inv_deltas, clip_vals, bsp
+    )
     return 0 if in_sensor == 0 else float(matches) / float(in_sensor)
 
 
+@numba.njit(nogil=True, cache=True)
+def _quant_and_clip_segment_confidences(
+    coords, angles, offsets, image, base, inv_deltas, clip_vals, bsp, result
+):
+    """_quant_and_clip_confidence of each segment offsets[i]:offsets[i + 1] of
+    coords + angles, in result[i]
+    """
+    for i in range(len(offsets) - 1):
+        result[i] = _quant_and_clip_confidence(
+            coords[offsets[i] : offsets[i + 1]],
+            angles[offsets[i] : offsets[i + 1]],
+            image,
+            base,
+            inv_deltas,
+            clip_vals,
+            bsp,
+        )
+    return result
+
+
 # ==============================================================================
 # %% DIFFRACTION SIMULATION
 # ==============================================================================
@@ -519,7 +552,6 @@ def simulate_diffractions(grain_params, experiment, controller):
     count = len(grain_params)
     subprocess = 'simulate diffractions'
 
-    _project = xrdutil._project_on_detector_plane
     rD = experiment.rMat_d
     chi = experiment.chi
     tD = experiment.tVec_d
@@ -552,7 +584,9 @@ def simulate_diffractions(grain_params, experiment, controller):
         )
         all_angs[:, 2] = rotations.mapAngle(all_angs[:, 2], ome_period)
 
-        proj_pts = _project(all_angs, rD, rC, chi, tD, tC, tS, distortion)
+        proj_pts = _project_on_detector_plane(
+            all_angs, rD, rC, chi, tD, tC, tS, distortion
+        )
         det_xy = proj_pts[0]
         _write_pixels(
             det_xy,
@@ -577,38 +611,128 @@ def simulate_diffractions(grain_params, experiment, controller):
 def get_dilated_image_stack(
     image_stack, experiment, controller, cache_file='gold_cubes_dilated.npy'
 ):
+    """getter function that handles the caching of the dilation
 
+    The cached stack is stored next to cache_file, with a name including a
+    hash of the image stack and of the dilation parameters (e.g.
+    gold_cubes_dilated_<hash>.npy), so that it is only reused for the same
+    input.
+    """
+    root, ext = os.path.splitext(cache_file)
+    cache_file = f'{root}_{_dilation_key(image_stack, experiment)}{ext or ".npy"}'
     try:
         dilated_image_stack = np.load(cache_file, mmap_mode='r', allow_pickle=False)
+        if dilated_image_stack.shape != image_stack.shape:
+            raise ValueError(f'"{cache_file}" has the wrong shape')
     except Exception:
         dilated_image_stack = dilate_image_stack(image_stack, experiment, controller)
-        np.save(cache_file, dilated_image_stack)
+        # write to a temporary file first, so that an interrupted write is
+        # never loaded
+        tmp_file = f'{cache_file}.{os.getpid()}.tmp'
+        with open(tmp_file, 'wb') as f:
+            np.save(f, dilated_image_stack)
+        os.replace(tmp_file, cache_file)
 
     return dilated_image_stack
 
 
+def _dilation_key(image_stack, experiment):
+    """hash of a packed image stack and the dilation parameters"""
+    h = hashlib.blake2b(digest_size=16)
+    h.update(
+        repr(
+            (
+                image_stack.shape,
+                str(image_stack.dtype),
+                int(experiment.row_dilation),
+                int(experiment.col_dilation),
+            )
+        ).encode()
+    )
+    for image in image_stack:
+        h.update(np.ascontiguousarray(image).data)
+    return h.hexdigest()
+
+
 def dilate_image_stack(image_stack, experiment, controller):
-    # first, perform image dilation ===========================================
-    # perform image dilation (using scikit_image dilation)
+    """dilates each image of a packed image stack (see simulate_diffractions)
+    by a rectangle of (2 * row_dilation + 1, 2 * col_dilation + 1) pixels.
+
+    The images are dilated directly on their packed bytes, by as many
+    threads as the controller has cpus.
+    """
     subprocess = 'dilate image_stack'
-    dilation_shape = np.ones(
-        (2 * experiment.row_dilation + 1, 2 * experiment.col_dilation + 1),
-        dtype=np.uint8,
-    )
-    image_stack_dilated = np.empty_like(image_stack)
-    dilated = np.empty((image_stack.shape[-2], image_stack.shape[-1] << 3), dtype=bool)
+    image_stack_dilated = np.empty(image_stack.shape, dtype=np.uint8)
     n_images = len(image_stack)
+
+    def dilate(i_image):
+        _dilate_packed_image(
+            np.ascontiguousarray(image_stack[i_image], dtype=np.uint8),
+            experiment.row_dilation,
+            experiment.col_dilation,
+            image_stack_dilated[i_image],
+        )
+
     controller.start(subprocess, n_images)
-    for i_image in range(n_images):
-        to_dilate = np.unpackbits(image_stack[i_image], axis=-1)
-        ski_dilation(to_dilate, dilation_shape, out=dilated)
-        image_stack_dilated[i_image] = np.packbits(dilated, axis=-1)
-        controller.update(i_image + 1)
+    ncpus = controller.get_process_count()
+    with ThreadPoolExecutor(max_workers=ncpus) as executor:
+        for i, _ in enumerate(executor.map(dilate, range(n_images))):
+            controller.update(i + 1)
     controller.finish(subprocess)
 
     return image_stack_dilated
 
 
+@numba.njit(nogil=True, cache=True)
+def _dilate_packed_image(image, row_dilation, col_dilation, out):
+    """binary dilation of a bit packed image by a rectangle
+
+    image - (rows, bytes) uint8 array: image packed along the last axis
+            (most significant bit first, as np.packbits).
+    row_dilation, col_dilation - half sizes of the rectangle.
+    out - (rows, bytes) uint8 array: the dilated image.
+
+    This is equivalent to unpacking the image and dilating it with
+    skimage.morphology.dilation, then packing it back.
+    """
+    n_rows, n_bytes = image.shape
+
+    # dilation along the rows of pixels (the bits): OR of shifted rows
+    dilated = np.empty((n_rows, n_bytes), dtype=np.uint8)
+    for row in range(n_rows):
+        src = image[row]
+        for j in range(n_bytes):
+            dilated[row, j] = src[j]
+        for k in range(1, col_dilation + 1):
+            q = k // 8
+            r = k % 8
+            for j in range(n_bytes):
+                v = 0
+                # the pixels k to the left
+                jj = j - q
+                if jj >= 0:
+                    v |= src[jj] >> r
+                    if r > 0 and jj > 0:
+                        v |= (src[jj - 1] << (8 - r)) & 0xFF
+                # the pixels k to the right
+                jj = j + q
+                if jj < n_bytes:
+                    v |= (src[jj] << r) & 0xFF
+                    if r > 0 and jj + 1 < n_bytes:
+                        v |= src[jj + 1] >> (8 - r)
+                dilated[row, j] |= v
+
+    # dilation along the columns: OR of the neighboring rows
+    for row in range(n_rows):
+        lo = max(0, row - row_dilation)
+        hi = min(n_rows, row + row_dilation + 1)
+        for j in range(n_bytes):
+            v = 0
+            for rr in range(lo, hi):
+                v |= dilated[rr, j]
+            out[row, j] = v
+
+
 # This part is critical for the performance of simulate diffractions. It
 # basically "renders" the "pixels". It takes the coordinates, quantizes to an
 # image coordinate and writes to the appropriate image in the stack. Note
@@ -709,35 +833,19 @@ def test_orientations(
     chunk_size = controller.get_chunk_size()
     ncpus = controller.get_process_count()
 
-    # generate angles =========================================================
-    # all_angles will be a list containing arrays for the different angles to
-    # use, one entry per grain.
-    #
-    # Note that the angle generation is driven by the exp_maps
-    # in the experiment
-    all_angles = evaluate_diffraction_angles(experiment, controller)
+    # precompute per-grain stuff ==============================================
+    all_angles, precomp = precompute_grains(experiment, controller)
 
     # generate coords =========================================================
     n_coords = controller.limit('coords', len(test_crds))
 
-    # precompute per-grain stuff ==============================================
-    # gVec_cs and rmat_ss can be precomputed, do so.
-    subprocess = 'precompute gVec_cs'
-    controller.start(subprocess, len(all_angles))
-    precomp = []
-    for i, angs in enumerate(all_angles):
-        rmat_ss = xfcapi.make_sample_rmat(experiment.chi, angs[:, 2])
-        gvec_cs = _anglesToGVec(angs, rmat_ss, experiment.rMat_c[i])
-        precomp.append((gvec_cs, rmat_ss))
-    controller.finish(subprocess)
-
     # Divide coords by ranks
     (offset, size) = get_offset_size(n_coords)
 
     # grand loop ==============================================================
     # The near field simulation 'grand loop'. Where the bulk of computing is
     # performed. We are looking for a confidence matrix that has a n_grains
-    chunks = range(offset, offset + size, chunk_size)
+    chunks = _coord_chunks(offset, offset + size, chunk_size)
 
     subprocess = 'grand_loop'
     controller.start(subprocess, n_coords)
@@ -748,45 +856,9 @@ def test_orientations(
 
     logger.info('Checking confidence for %d coords, %d grains.', n_coords, n_grains)
     confidence = np.empty((n_grains, size))
-    if ncpus > 1:
-        global _multiprocessing_start_method
-        _multiprocessing_start_method = multiprocessing_start_method
-        logger.info(
-            'Running multiprocess %d processes (%s)',
-            ncpus,
-            _multiprocessing_start_method,
-        )
-        with grand_loop_pool(
-            ncpus=ncpus,
-            state=(
-                chunk_size,
-                image_stack,
-                all_angles,
-                precomp,
-                test_crds,
-                experiment,
-            ),
-        ) as pool:
-            for rslice, rvalues in pool.imap_unordered(multiproc_inner_loop, chunks):
-                count = rvalues.shape[1]
-                # We need to adjust this slice for the offset
-                rslice = slice(rslice.start - offset, rslice.stop - offset)
-                confidence[:, rslice] = rvalues
-                finished += count
-                controller.update(finished)
-    else:
-        logger.info('Running in a single process')
-        for chunk_start in chunks:
-            chunk_stop = min(n_coords, chunk_start + chunk_size)
-            rslice, rvalues = _grand_loop_inner(
-                image_stack,
-                all_angles,
-                precomp,
-                test_crds,
-                experiment,
-                start=chunk_start,
-                stop=chunk_stop,
-            )
+    state = (chunk_size, image_stack, all_angles, precomp, test_crds, experiment)
+    with grand_loop_evaluator(ncpus, state, multiprocessing_start_method) as evaluate:
+        for rslice, rvalues in evaluate(chunks):
             count = rvalues.shape[1]
             # We need to adjust this slice for the offset
             rslice = slice(rslice.start - offset, rslice.stop - offset)
@@ -805,6 +877,346 @@ def test_orientations(
     return confidence
 
 
+def test_orientations_tiled(
+    image_stack,
+    experiment,
+    test_crds,
+    controller,
+    filename,
+    tile_size=10000,
+    store_confidence=True,
+    resume=False,
+    multiprocessing_start_method='fork',
+):
+    """out-of-core version of test_orientations
+
+    The coords are tested one tile at a time, and the results of each tile
+    are written to the HDF5 file `filename` as soon as they are done, so the
+    memory use is bounded by the size of a tile instead of growing with the
+    number of coords.  The file holds:
+
+    confidence  -- (n_grains, n_coords) the confidence of every grain at
+                   every coord (only if store_confidence), chunked by tile.
+    confidence_map -- (n_coords,) the maximum confidence at each coord.
+    grain_map   -- (n_coords,) the grain index of the maximum confidence
+                   at each coord (-1 where not tested yet).
+    tiles_done  -- (n_tiles,) the tiles that are complete.
+
+    With resume, the tiles already done in an existing file are skipped, so
+    an interrupted run can be continued.  With MPI, each rank tests its own
+    share of the coords and writes to its own file (the rank number is
+    added to the file name); only the maps are gathered to rank 0.
+
+    image-stack, experiment, test_crds and controller are as in
+    test_orientations.  image_stack may be memory mapped (see
+    get_dilated_image_stack).
+
+    returns the (confidence_map, grain_map) of the coords (on rank 0 only
+    with MPI, None on the other ranks).
+    """
+    n_grains = experiment.n_grains
+    chunk_size = controller.get_chunk_size()
+    ncpus = controller.get_process_count()
+
+    n_coords = controller.limit('coords', len(test_crds))
+    (offset, size) = get_offset_size(n_coords)
+
+    # tiles are made of whole chunks
+    tile_size = max(1, -(-tile_size // chunk_size)) * chunk_size
+    tiles = range(offset, offset + size, tile_size)
+
+    if USE_MPI and world_size > 1:
+        root, ext = os.path.splitext(filename)
+        filename = f'{root}_rank{rank}{ext}'
+
+    with h5py.File(filename, 'a' if resume else 'w') as f:
+        if 'tiles_done' in f:
+            if (
+                f.attrs['n_grains'] != n_grains
+                or f.attrs['offset'] != offset
+                or f.attrs['size'] != size
+                or f.attrs['tile_size'] != tile_size
+            ):
+                raise ValueError(
+                    f'"{filename}" is for a different set of grains or coords'
+                )
+        else:
+            f.attrs['n_grains'] = n_grains
+            f.attrs['offset'] = offset
+            f.attrs['size'] = size
+            f.attrs['tile_size'] = tile_size
+            if store_confidence:
+                chunk_cols = max(1, min(tile_size, size, (1 << 23) // n_grains))
+                f.create_dataset(
+                    'confidence',
+                    (n_grains, size),
+                    dtype=np.float64,
+                    chunks=(n_grains, chunk_cols),
+                )
+            f.create_dataset('confidence_map', data=np.zeros(size))
+            f.create_dataset('grain_map', data=np.full(size, -1, dtype=np.int64))
+            f.create_dataset('tiles_done', data=np.zeros(len(tiles), dtype=bool))
+        tiles_done = f['tiles_done'][()]
+
+        all_angles, precomp = precompute_grains(experiment, controller)
+
+        subprocess = 'grand_loop'
+        controller.start(subprocess, n_coords)
+        finished = sum(
+            min(tile_size, offset + size - tile)
+            for tile, done in zip(tiles, tiles_done)
+            if done
+        )
+        controller.update(finished)
+        todo = [i for i, done in enumerate(tiles_done) if not done]
+        ncpus = min(ncpus, max(1, -(-min(tile_size, size) // chunk_size)))
+
+        logger.info(
+            'Checking confidence for %d coords, %d grains, in %d tiles '
+            + '(%d left) of %d coords.',
+            size,
+            n_grains,
+            len(tiles),
+            len(todo),
+            tile_size,
+        )
+        state = (chunk_size, image_stack, all_angles, precomp, test_crds, experiment)
+        with grand_loop_evaluator(
+            ncpus, state, multiprocessing_start_method
+        ) as evaluate:
+            for i_tile in todo:
+                tile_start = tiles[i_tile]
+                tile_stop = min(tile_start + tile_size, offset + size)
+                confidence = np.empty((n_grains, tile_stop - tile_start))
+                chunks = _coord_chunks(tile_start, tile_stop, chunk_size)
+                for rslice, rvalues in evaluate(chunks):
+                    count = rvalues.shape[1]
+                    rslice = slice(rslice.start - tile_start, rslice.stop - tile_start)
+                    confidence[:, rslice] = rvalues
+                    finished += count
+                    controller.update(finished)
+
+                tslice = slice(tile_start - offset, tile_stop - offset)
+                if store_confidence:
+                    f['confidence'][:, tslice] = confidence
+                if n_grains > 0:
+                    f['confidence_map'][tslice] = np.max(confidence, axis=0)
+                    f['grain_map'][tslice] = np.argmax(confidence, axis=0)
+                f['tiles_done'][i_tile] = True
+                f.flush()
+
+        controller.finish(subprocess)
+
+        confidence_map = f['confidence_map'][()]
+        grain_map = f['grain_map'][()]
+
+    if USE_MPI:
+        confidence_map = gather_coords_array(controller, confidence_map, n_coords)
+        grain_map = gather_coords_array(controller, grain_map, n_coords)
+        if rank != 0:
+            return None
+
+    return confidence_map, grain_map
+
+
+def test_orientations_pruned(
+    image_stack,
+    experiment,
+    test_crds,
+    controller,
+    top_k=10,
+    subsample=4,
+    min_confidence=0.0,
+    multiprocessing_start_method='fork',
+):
+    """two stage grand loop, finding the best grain at each coord
+
+    Instead of the confidence of every grain at every coord (as in
+    test_orientations), only the grain with the highest confidence at each
+    coord is looked for:
+
+    1. the confidence of every grain is estimated from every subsample-th
+       of its reflections, in a single projection of all the grains.
+    2. the full confidence of the top_k best estimated grains is computed,
+       in blocks of reflections, dropping a grain as soon as its best
+       achievable confidence falls below the best one found so far, or
+       below min_confidence.
+
+    With top_k >= n_grains, the result is the same as the maximum and argmax
+    of the confidence of test_orientations (for a min_confidence of 0).
+
+    image-stack, experiment, test_crds and controller are as in
+    test_orientations.
+
+    returns the (confidence_map, grain_map) of the coords: the highest
+    confidence found at each coord and the index of its grain, or 0 and -1
+    where no grain reaches min_confidence (on rank 0 only with MPI, None on
+    the other ranks).
+    """
+    n_grains = experiment.n_grains
+    chunk_size = controller.get_chunk_size()
+    ncpus = controller.get_process_count()
+
+    all_angles, precomp = precompute_grains(experiment, controller)
+    pruning = precompute_pruning(
+        experiment,
+        all_angles,
+        precomp,
+        top_k=top_k,
+        subsample=subsample,
+        min_confidence=min_confidence,
+    )
+
+    n_coords = controller.limit('coords', len(test_crds))
+    (offset, size) = get_offset_size(n_coords)
+    chunks = _coord_chunks(offset, offset + size, chunk_size)
+
+    subprocess = 'grand_loop'
+    controller.start(subprocess, n_coords)
+    finished = 0
+    ncpus = min(ncpus, len(chunks))
+
+    logger.info(
+        'Finding the best of %d grains (top %d of 1/%d reflections) '
+        + 'for %d coords.',
+        n_grains,
+        top_k,
+        subsample,
+        size,
+    )
+    confidence_map = np.zeros(size)
+    grain_map = np.full(size, -1, dtype=np.int64)
+    state = (chunk_size, image_stack, all_angles, pruning, test_crds, experiment)
+    with grand_loop_evaluator(
+        ncpus,
+        state,
+        multiprocessing_start_method,
+        inner_loop=_pruned_grand_loop_inner,
+    ) as evaluate:
+        for rslice, (rconfidence, rgrains) in evaluate(chunks):
+            count = len(rconfidence)
+            rslice = slice(rslice.start - offset, rslice.stop - offset)
+            confidence_map[rslice] = rconfidence
+            grain_map[rslice] = rgrains
+            finished += count
+            controller.update(finished)
+
+    controller.finish(subprocess)
+
+    if USE_MPI:
+        confidence_map = gather_coords_array(controller, confidence_map, n_coords)
+        grain_map = gather_coords_array(controller, grain_map, n_coords)
+        if rank != 0:
+            return None
+
+    return confidence_map, grain_map
+
+
+def precompute_pruning(
+    experiment,
+    all_angles,
+    precomp,
+    top_k=10,
+    subsample=4,
+    min_confidence=0.0,
+    n_blocks=2,
+):
+    """precomputes the per-grain stuff of _pruned_grand_loop_inner
+
+    The reflections of each grain are reordered so that every subsample-th
+    one comes first; those are the ones used for the estimates, which are
+    stacked for all the grains (in the SAMPLE frame).  The full confidence
+    is computed over the subsample first, then over the rest of the
+    reflections in n_blocks - 1 blocks, checking the best achievable
+    confidence before each block.
+    """
+    pruning = argparse.Namespace()
+    pruning.top_k = top_k
+    pruning.min_confidence = min_confidence
+    pruning.grains = []
+    coarse_gvecs = [np.empty((0, 3))]
+    coarse_rmats = [np.empty((0, 3, 3))]
+    coarse_omes = [np.empty(0)]
+    coarse_counts = []
+    for igrn, angs in enumerate(all_angles):
+        gvec_cs, rmat_ss = precomp[igrn]
+        n_refl = len(angs)
+        sampled = np.arange(0, n_refl, subsample)
+        order = np.r_[sampled, np.setdiff1d(np.arange(n_refl), sampled)]
+        n_sampled = len(sampled)
+        edges = np.unique(
+            np.r_[0, np.linspace(n_sampled, n_refl, n_blocks).round().astype(int)]
+        )
+        gvecs = np.ascontiguousarray(gvec_cs[order])
+        rmats = np.ascontiguousarray(rmat_ss[order])
+        omes = np.ascontiguousarray(angs[order, 2])
+        pruning.grains.append((gvecs, rmats, omes, edges))
+
+        coarse_gvecs.append(np.dot(gvecs[:n_sampled], experiment.rMat_c[igrn].T))
+        coarse_rmats.append(rmats[:n_sampled])
+        coarse_omes.append(omes[:n_sampled])
+        coarse_counts.append(n_sampled)
+    pruning.coarse_gvecs = np.ascontiguousarray(np.vstack(coarse_gvecs))
+    pruning.coarse_rmats = np.ascontiguousarray(np.vstack(coarse_rmats))
+    pruning.coarse_omes = np.ascontiguousarray(np.hstack(coarse_omes))
+    pruning.coarse_offsets = np.r_[0, np.cumsum(coarse_counts)].astype(np.int64)
+    return pruning
+
+
+def gather_coords_array(controller, values, n_coords):
+    """gathers an array with a value per coord (divided by ranks as in
+    get_offset_size) to rank 0"""
+    if rank == 0:
+        global_values = np.empty(n_coords, dtype=values.dtype)
+    else:
+        global_values = None
+
+    coords_per_rank = n_coords // world_size
+    send_counts = np.full(world_size, coords_per_rank)
+    send_counts[-1] = n_coords - (coords_per_rank * (world_size - 1))
+
+    comm.Gatherv(
+        np.ascontiguousarray(values), (global_values, send_counts), root=0
+    )
+    return global_values
+
+
+def precompute_grains(experiment, controller):
+    """generates the diffraction angles of each grain (see
+    evaluate_diffraction_angles), and precomputes the gVec_cs and rmat_ss
+    of each grain for the grand loop.
+
+    returns all_angles, precomp
+    """
+    # generate angles =========================================================
+    # all_angles will be a list containing arrays for the different angles to
+    # use, one entry per grain.
+    #
+    # Note that the angle generation is driven by the exp_maps
+    # in the experiment
+    all_angles = evaluate_diffraction_angles(experiment, controller)
+
+    # gVec_cs and rmat_ss can be precomputed, do so.
+    subprocess = 'precompute gVec_cs'
+    controller.start(subprocess, len(all_angles))
+    precomp = []
+    for i, angs in enumerate(all_angles):
+        rmat_ss = xfcapi.make_sample_rmat(experiment.chi, angs[:, 2])
+        gvec_cs = _anglesToGVec(angs, rmat_ss, experiment.rMat_c[i])
+        precomp.append((gvec_cs, rmat_ss))
+    controller.finish(subprocess)
+
+    return all_angles, precomp
+
+
+def _coord_chunks(start, stop, chunk_size):
+    """the (start, stop) of the chunks of coords in [start, stop)"""
+    return [
+        (chunk, min(chunk + chunk_size, stop))
+        for chunk in range(start, stop, chunk_size)
+    ]
+
+
 def evaluate_diffraction_angles(experiment, controller=None):
     """Uses simulateGVecs to generate the angles used per each grain.
     returns a list containg one array per grain.
@@ -951,6 +1363,117 @@ def _grand_loop_inner(
     return slice(start, stop), confidence
 
 
+def _pruned_grand_loop_inner(
+    image_stack, angles, pruning, coords, experiment, start=0, stop=None
+):
+    """Two stage simulation code for a chunk of data (see
+    test_orientations_pruned), finding the best grain at each coord.
+
+    image_stack -- the image stack from the sensors
+    angles -- the angles (grains) to test
+    pruning -- the per grain reordered reflections (see precompute_pruning)
+    coords -- all the coords to test
+    experiment -- bag with experiment parameters
+    start -- chunk start offset
+    stop -- chunk end offset
+
+    returns the slice of the chunk, and the best confidence and grain of
+    each of its coords
+    """
+    n_coords = len(coords)
+
+    # experiment geometric layout parameters
+    rD = experiment.rMat_d
+    rCn = experiment.rMat_c
+    tD = experiment.tVec_d
+    tS = experiment.tVec_s
+
+    # experiment panel related configuration
+    base = experiment.base
+    inv_deltas = experiment.inv_deltas
+    clip_vals = experiment.clip_vals
+    distortion = experiment.distortion
+    bsp = experiment.bsp  # beam stop vertical center and width
+
+    _to_detector = xfcapi.gvec_to_xy
+    stop = min(stop, n_coords) if stop is not None else n_coords
+
+    # FIXME: distortion hanlding is broken!
+    distortion_fn = None
+    if distortion is not None and len(distortion > 0):
+        distortion_fn, distortion_args = distortion
+
+    def project(gvecs, rmats, rC, crd):
+        det_xy = _to_detector(gvecs, rD, rmats, rC, tD, tS, crd)
+        if distortion_fn is not None:
+            det_xy = distortion_fn(det_xy, distortion_args, invert=True)
+        return det_xy
+
+    n_grains = len(pruning.grains)
+    top_k = min(pruning.top_k, n_grains)
+    min_confidence = pruning.min_confidence
+    rI = np.eye(3)
+    estimates = np.empty(n_grains)
+    confidence = np.zeros(stop - start)
+    grains = np.full(stop - start, -1, dtype=np.int64)
+
+    for icrd in range(start, stop):
+        crd = coords[icrd]
+
+        # first stage: estimates from a subsample of the reflections
+        det_xy = project(pruning.coarse_gvecs, pruning.coarse_rmats, rI, crd)
+        _quant_and_clip_segment_confidences(
+            det_xy,
+            pruning.coarse_omes,
+            pruning.coarse_offsets,
+            image_stack,
+            base,
+            inv_deltas,
+            clip_vals,
+            bsp,
+            estimates,
+        )
+        candidates = np.argsort(-estimates, kind='stable')[:top_k]
+
+        # second stage: full confidence of the candidates, while they can
+        # still beat the best one
+        best = -1.0
+        best_grain = -1
+        for igrn in candidates:
+            gvecs, rmats, omes, edges = pruning.grains[igrn]
+            threshold = max(best, min_confidence)
+            n_refl = edges[-1]
+            in_sensor = 0
+            matches = 0
+            for i0, i1 in zip(edges[:-1], edges[1:]):
+                left = n_refl - i0
+                if float(matches + left) / float(in_sensor + left) < threshold:
+                    break
+                det_xy = project(gvecs[i0:i1], rmats[i0:i1], rCn[igrn], crd)
+                n_in, n_match = _quant_and_clip_counts(
+                    det_xy,
+                    omes[i0:i1],
+                    image_stack,
+                    base,
+                    inv_deltas,
+                    clip_vals,
+                    bsp,
+                )
+                in_sensor += n_in
+                matches += n_match
+            else:
+                c = 0 if in_sensor == 0 else float(matches) / float(in_sensor)
+                if c > best or (c == best and igrn < best_grain):
+                    best = c
+                    best_grain = igrn
+
+        if best_grain >= 0 and best >= min_confidence:
+            confidence[icrd - start] = best
+            grains[icrd - start] = best_grain
+
+    return slice(start, stop), (confidence, grains)
+
+
 def generate_test_grid(low, top, samples):
     """generates a test grid of coordinates"""
     cvec_s = np.linspace(low, top, samples)
@@ -965,36 +1488,27 @@ def generate_test_grid(low, top, samples):
 #
 # On fork platforms, take advantage of process memory inheritance.
 #
-# On non fork platforms, rely on joblib dumping the state to disk and loading
-# back in the target processes, pickling only the minimal information to load
-# state back. Pickling the big arrays directly was causing memory errors and
-# would be less efficient in memory (as joblib memmaps by default the big
-# arrays, meaning they may be shared between processes).
+# On non fork platforms, the big arrays are published once in shared memory
+# and the spawned processes attach to them, pickling only the rest of the
+# state. Pickling the big arrays directly was causing memory errors, and would
+# give every process its own copy of them.
 
 
-def multiproc_inner_loop(chunk):
+def multiproc_inner_loop(chunk, inner_loop=None):
     """function to use in multiprocessing that computes the simulation over the
     task's alloted chunk of data"""
 
-    chunk_size = _mp_state[0]
-    n_coords = len(_mp_state[4])
+    loop = _grand_loop_inner if inner_loop is None else inner_loop
+    chunk_start, chunk_stop = chunk
+    return loop(*_mp_state[1:], start=chunk_start, stop=chunk_stop)
 
-    (offset, size) = get_offset_size(n_coords)
-
-    chunk_stop = min(offset + size, chunk + chunk_size)
-    return _grand_loop_inner(*_mp_state[1:], start=chunk, stop=chunk_stop)
 
-
-def worker_init(id_state, id_exp):
+def worker_init(shared_state):
     """process initialization function. This function is only used when the
     child processes are spawned (instead of forked). When using the fork model
     of multiprocessing the data is just inherited in process memory."""
-    import joblib
-
     global _mp_state
-    state = joblib.load(id_state)
-    experiment = joblib.load(id_exp)
-    _mp_state = state + (experiment,)
+    _mp_state = shared_state.load()
 
 
 @contextlib.contextmanager
@@ -1026,37 +1540,64 @@ def grand_loop_pool(ncpus, state):
         # theprocessing the global is removed.
         global _mp_state
         _mp_state = state
-        pool = multiprocessing.Pool(ncpus)
-        yield pool
+        with multiprocessing.Pool(ncpus) as pool:
+            yield pool
         del _mp_state
     else:
         # Use SPAWN multiprocessing.
 
-        # As we can not inherit process data, all the required data is
-        # serialized into a temporary directory using joblib. The
-        # multiprocessing pool will have the "worker_init" as initialization
-        # function that takes the key for the serialized data, which will be
-        # used to load the parameter memory into the spawn process (also using
-        # joblib). In theory, joblib uses memmap for arrays if they are not
-        # compressed, so no compression is used for the bigger arrays.
-        import joblib
+        # As we can not inherit process data, the arrays of the state (image
+        # stack, angles, coords, ...) are copied once into a shared memory
+        # block. The multiprocessing pool will have the "worker_init" as
+        # initialization function, which receives the rest of the state
+        # together with the name of the block, and rebuilds the state with
+        # read-only views of the shared arrays.
+        with SharedPickle(state) as shared_state:
+            logger.info(
+                'Sharing %d bytes of state in "%s".',
+                shared_state.nbytes,
+                shared_state.name,
+            )
+            with multiprocessing.Pool(ncpus, worker_init, (shared_state,)) as pool:
+                yield pool
 
-        tmp_dir = tempfile.mkdtemp(suffix='-nf-grand-loop')
-        try:
-            # dumb dumping doesn't seem to work very well.. do something ad-hoc
-            logger.info('Using "%s" as temporary directory.', tmp_dir)
 
-            id_exp = joblib.dump(
-                state[-1],
-                os.path.join(tmp_dir, 'grand-loop-experiment.gz'),
-                compress=True,
-            )
-            id_state = joblib.dump(state[:-1], os.path.join(tmp_dir, 'grand-loop-data'))
-            pool = multiprocessing.Pool(ncpus, worker_init, (id_state[0], id_exp[0]))
-            yield pool
-        finally:
-            logger.info('Deleting "%s".', tmp_dir)
-            shutil.rmtree(tmp_dir)
+@contextlib.contextmanager
+def grand_loop_evaluator(
+    ncpus, state, multiprocessing_start_method='fork', inner_loop=None
+):
+    """context manager yielding a function that runs the grand loop over a
+    list of (start, stop) chunks of coords, generating the (slice,
+    confidence) of each chunk, in any order.  With more than one cpu the
+    chunks are processed by a multiprocessing pool (see grand_loop_pool),
+    which is reused for every call until the context exits.
+
+    inner_loop is the function processing a chunk (_grand_loop_inner by
+    default), called with the state (except the chunk size) and the start
+    and stop of the chunk.
+    """
+    if ncpus > 1:
+        global _multiprocessing_start_method
+        _multiprocessing_start_method = multiprocessing_start_method
+        logger.info(
+            'Running multiprocess %d processes (%s)',
+            ncpus,
+            _multiprocessing_start_method,
+        )
+        task = multiproc_inner_loop
+        if inner_loop is not None:
+            task = functools.partial(multiproc_inner_loop, inner_loop=inner_loop)
+        with grand_loop_pool(ncpus=ncpus, state=state) as pool:
+            yield lambda chunks: pool.imap_unordered(task, chunks)
+    else:
+        logger.info('Running in a single process')
+
+        def evaluate(chunks):
+            loop = _grand_loop_inner if inner_loop is None else inner_loop
+            for chunk_start, chunk_stop in chunks:
+                yield loop(*state[1:], start=chunk_start, stop=chunk_stop)
+
+        yield evaluate
 
 
 # %% Test Grid Generation
@@ -1440,12 +1981,27 @@ def process_raw_confidence(
 ):
 
     logger.info('Compiling Confidence Map...')
-    if vol_shape == None:
-        confidence_map = np.max(raw_confidence, axis=0)
-        grain_map = np.argmax(raw_confidence, axis=0)
-    else:
-        confidence_map = np.max(raw_confidence, axis=0).reshape(vol_shape)
-        grain_map = np.argmax(raw_confidence, axis=0).reshape(vol_shape)
+    confidence_map = np.max(raw_confidence, axis=0)
+    grain_map = np.argmax(raw_confidence, axis=0)
+
+    return process_confidence_maps(
+        confidence_map,
+        grain_map,
+        vol_shape=vol_shape,
+        id_remap=id_remap,
+        min_thresh=min_thresh,
+    )
+
+
+def process_confidence_maps(
+    confidence_map, grain_map, vol_shape=None, id_remap=None, min_thresh=0.0
+):
+    """finishes the per coord maximum confidence and grain index maps (as
+    returned by test_orientations_tiled) the way process_raw_confidence does
+    """
+    if vol_shape is not None:
+        confidence_map = confidence_map.reshape(vol_shape)
+        grain_map = grain_map.reshape(vol_shape)
 
     # fix grain indexing
     not_indexed = np.where(confidence_map <= min_thresh)
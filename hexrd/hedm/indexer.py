@@ -48,6 +48,7 @@ omega_period_DFLT = np.radians(np.r_[-180.0, 180.0])
 
 paramMP = None
 nCPUs_DFLT = multiprocessing.cpu_count()
+blockSize_DFLT = 4096
 logger = logging.getLogger(__name__)
 
 
@@ -67,6 +68,8 @@ def paintGrid(
     doMultiProc=False,
     nCPUs=None,
     debug=False,
+    engine='batched',
+    blockSize=blockSize_DFLT,
 ):
     r"""
     Spherical map-based indexing algorithm, i.e. paintGrid.
@@ -103,11 +106,21 @@ def paintGrid(
         the period to use for omega angles in radians,
         e.g. np.radians([-180, 180])
     doMultiProc : bool, optional
-        flag for enabling multiprocessing
+        flag for enabling parallel execution
     nCPUs : int, optional
-        number of processes to use in case doMultiProc = True
+        number of threads (or processes for the 'pool' engine) to use in
+        case doMultiProc = True
     debug : bool, optional
         debugging mode flag
+    engine : {'batched', 'pool'}, optional
+        'batched' scores blocks of `blockSize` orientations at a time in a
+        numba kernel parallelized over threads, sharing the eta-omega maps
+        in memory.  'pool' is the original per-quaternion implementation,
+        distributed over a multiprocessing pool if doMultiProc = True.
+        The default is 'batched'.
+    blockSize : int, optional
+        number of orientations per block for the 'batched' engine; this
+        bounds the memory used for the rotation matrices.
 
     Raises
     ------
@@ -234,9 +247,19 @@ def paintGrid(
     etaMin = np.asarray(etaMin)
     etaMax = np.asarray(etaMax)
 
+    if engine not in ('batched', 'pool'):
+        raise RuntimeError("unknown paintGrid engine '%s'" % engine)
+
     multiProcMode = nCPUs_DFLT > 1 and doMultiProc
 
-    if multiProcMode:
+    if engine == 'batched':
+        nCPUs = (nCPUs or nCPUs_DFLT) if multiProcMode else 1
+        logger.debug(
+            "using batched engine with %d threads and a block size of %d",
+            nCPUs,
+            blockSize,
+        )
+    elif multiProcMode:
         nCPUs = nCPUs or nCPUs_DFLT
         chunksize = min(quats.shape[1] // nCPUs, 10)
         logger.debug(
@@ -281,16 +304,20 @@ def paintGrid(
     }
 
     # do the mapping
+    global paramMP
     start = timeit.default_timer()
     retval = None
-    if multiProcMode:
+    if engine == 'batched':
+        paintgrid_init(params)
+        retval = _paint_grid_batched(quats, params, nCPUs, blockSize).tolist()
+        paramMP = None
+    elif multiProcMode:
         # multiple process version
         pool = multiprocessing.Pool(nCPUs, paintgrid_init, (params,))
         retval = pool.map(paintGridThis, quats.T, chunksize=chunksize)
         pool.close()
     else:
         # single process version.
-        global paramMP
         paintgrid_init(params)  # sets paramMP
         retval = list(map(paintGridThis, quats.T))
         paramMP = None  # clear paramMP
@@ -300,6 +327,57 @@ def paintGrid(
     return retval
 
 
+def benchmark_paintGrid(quats, etaOmeMaps, nCPUs=None, **kwargs):
+    """
+    Time the batched paintGrid engine against the multiprocessing pool.
+
+    Both engines are run with doMultiProc = True on the same inputs, and the
+    completeness scores are checked for agreement.
+
+    Parameters
+    ----------
+    quats : (4, N) ndarray
+        hstacked array of trial orientations in the form of unit quaternions.
+    etaOmeMaps : object
+        an spherical map object of type `hexrd.hedm.instrument.GenerateEtaOmeMaps`.
+    nCPUs : int, optional
+        number of threads/processes for both engines.  Defaults to all cores.
+    **kwargs
+        any other paintGrid arguments, e.g. threshold or blockSize.
+
+    Raises
+    ------
+    RuntimeError
+        if the two engines return different completeness scores.
+
+    Returns
+    -------
+    timings : dict
+        wall times in seconds, keyed by engine name.
+    """
+    nCPUs = nCPUs or nCPUs_DFLT
+    # the first call compiles the numba kernels
+    paintGrid(quats[:, :1], etaOmeMaps, engine='batched', **kwargs)
+
+    timings = {}
+    results = {}
+    for engine in ('pool', 'batched'):
+        start = timeit.default_timer()
+        results[engine] = paintGrid(
+            quats, etaOmeMaps, doMultiProc=True, nCPUs=nCPUs, engine=engine, **kwargs
+        )
+        timings[engine] = timeit.default_timer() - start
+        logger.info(
+            "paintGrid engine '%s' scored %d orientations in %.3f seconds",
+            engine,
+            quats.shape[1],
+            timings[engine],
+        )
+    if not np.allclose(results['pool'], results['batched']):
+        raise RuntimeError("paintGrid engines disagree!")
+    return timings
+
+
 def _meshgrid2d(x, y):
     """
     Special-cased implementation of np.meshgrid.
@@ -731,3 +809,251 @@ def _filter_and_count_hits(
 def _map_angle(angle, offset):
     """Numba-firendly equivalent to xf.mapAngle."""
     return np.mod(angle - offset, 2 * np.pi) + offset
+
+
+###############################################################################
+#
+# Batched paintGrid.  Instead of marshalling one quaternion at a time to a
+# worker process, blocks of orientations are converted to rotation matrices
+# in a single vectorized call and scored by a parallel numba kernel.  Every
+# thread reads the same eta-omega maps, so nothing is copied per worker.
+#
+# The oscillation angles are computed inline, mirroring the C implementation
+# of oscill_angles_of_HKLs (with an identity stretch tensor) operation for
+# operation, so that the completeness scores match those of paintGridThis.
+###############################################################################
+
+
+def _paint_grid_batched(quats, params, nCPUs, blockSize):
+    """Score all of `quats` with the batched kernel.
+
+    Parameters
+    ----------
+    quats : (4, N) ndarray
+        the trial orientations as unit quaternions.
+    params : dict
+        the paintGrid parameter dictionary, as completed by paintgrid_init.
+    nCPUs : int
+        the number of numba threads to use.
+    blockSize : int
+        the number of orientations per block.
+
+    Returns
+    -------
+    retval : (N, ) ndarray
+        completeness score for each of `quats`.
+    """
+    omeEdges = params['omeEdges']
+    etaEdges = params['etaEdges']
+    del_ome = abs(omeEdges[1] - omeEdges[0])
+    del_eta = abs(etaEdges[1] - etaEdges[0])
+    dpix_ome = int(round(params['omeTol'] / del_ome))
+    dpix_eta = int(round(params['etaTol'] / del_eta))
+
+    gVecs_c = _hkls_to_gvecs(
+        np.ascontiguousarray(params['symHKLs'], dtype=float),
+        np.ascontiguousarray(params['bMat'], dtype=float),
+    )
+    bHat_l = np.ascontiguousarray(constants.beam_vec.flatten(), dtype=float)
+    rMat_e = xfcapi.make_beam_rmat(constants.beam_vec, constants.eta_vec)
+
+    nQuats = quats.shape[1]
+    blockSize = max(int(blockSize), 1)
+    retval = np.empty(nQuats)
+
+    nThreads = max(min(nCPUs, numba.config.NUMBA_NUM_THREADS), 1)
+    prev_num_threads = numba.get_num_threads()
+    numba.set_num_threads(nThreads)
+    try:
+        for i in range(0, nQuats, blockSize):
+            block = np.ascontiguousarray(quats[:, i : i + blockSize], dtype=float)
+            rMats = rotations.rotMatOfQuat(block).reshape(-1, 3, 3)
+            _paint_grid_block(
+                rMats,
+                gVecs_c,
+                params['symHKLs_ix'],
+                0.0,
+                bHat_l,
+                rMat_e,
+                params['wavelength'],
+                etaEdges,
+                params['valid_eta_spans'],
+                params['valid_ome_spans'],
+                omeEdges,
+                params['omePeriod'],
+                params['etaOmeMaps'],
+                params['etaIndices'],
+                params['omeIndices'],
+                dpix_eta,
+                dpix_ome,
+                params['threshold'],
+                nThreads,
+                retval[i : i + blockSize],
+            )
+    finally:
+        numba.set_num_threads(prev_num_threads)
+    return retval
+
+
+@numba.njit(nogil=True, cache=True)
+def _hkls_to_gvecs(hkls, bMat):
+    """Reciprocal lattice vectors of `hkls` in the crystal frame."""
+    npts = hkls.shape[0]
+    gVecs = np.empty((npts, 3))
+    for i in range(npts):
+        for j in range(3):
+            acc = 0.0
+            for k in range(3):
+                acc += bMat[j, k] * hkls[i, k]
+            gVecs[i, j] = acc
+    return gVecs
+
+
+@numba.njit(nogil=True, cache=True)
+def _oscill_angles(gVecs_c, rMat_c, chi, bHat_l, rMat_e, wavelength, angs_0, angs_1):
+    """Numba version of xfcapi.oscill_angles_of_hkls for one orientation.
+
+    `gVecs_c` are the reciprocal lattice vectors (bMat applied to the hkls)
+    and `bHat_l` the unit beam vector.  The two solutions are written into
+    `angs_0` and `angs_1`; unreachable reflections are filled with NaNs.
+    """
+    cchi = np.cos(chi)
+    schi = np.sin(chi)
+    gHat_s = np.empty(3)
+    tVec0 = np.empty(3)
+    for i in range(gVecs_c.shape[0]):
+        for j in range(3):
+            acc = 0.0
+            for k in range(3):
+                acc += rMat_c[j, k] * gVecs_c[i, k]
+            gHat_s[j] = acc
+
+        nrm0 = 0.0
+        for j in range(3):
+            acc = 0.0
+            for k in range(3):
+                acc += rMat_c[k, j] * gHat_s[k]
+            nrm0 += acc * acc
+        nrm0 = np.sqrt(nrm0)
+
+        if nrm0 > constants.epsf:
+            for j in range(3):
+                gHat_s[j] /= nrm0
+
+        sintht = 0.5 * wavelength * nrm0
+
+        a = (
+            gHat_s[2] * bHat_l[0]
+            + schi * gHat_s[0] * bHat_l[1]
+            - cchi * gHat_s[0] * bHat_l[2]
+        )
+        b = (
+            gHat_s[0] * bHat_l[0]
+            - schi * gHat_s[2] * bHat_l[1]
+            + cchi * gHat_s[2] * bHat_l[2]
+        )
+        c = -sintht - cchi * gHat_s[1] * bHat_l[1] - schi * gHat_s[1] * bHat_l[2]
+
+        abMag = np.sqrt(a * a + b * b)
+        phaseAng = np.arctan2(b, a)
+        rhs = c / abMag
+
+        if abs(rhs) > 1.0:
+            for j in range(3):
+                angs_0[i, j] = np.nan
+                angs_1[i, j] = np.nan
+            continue
+
+        rhsAng = np.arcsin(rhs)
+        tth = 2.0 * np.arcsin(sintht)
+        for isol in range(2):
+            if isol == 0:
+                ome = rhsAng - phaseAng
+                angs = angs_0
+            else:
+                ome = np.pi - rhsAng - phaseAng
+                angs = angs_1
+
+            # rMat_s = make_sample_rmat(chi, ome)
+            come = np.cos(ome)
+            some = np.sin(ome)
+            tVec0[0] = come * gHat_s[0] + 0.0 * gHat_s[1] + some * gHat_s[2]
+            tVec0[1] = (
+                schi * some * gHat_s[0] + cchi * gHat_s[1] - schi * come * gHat_s[2]
+            )
+            tVec0[2] = (
+                -cchi * some * gHat_s[0] + schi * gHat_s[1] + cchi * come * gHat_s[2]
+            )
+
+            gVec_e0 = 0.0
+            gVec_e1 = 0.0
+            for k in range(3):
+                gVec_e0 += rMat_e[k, 0] * tVec0[k]
+                gVec_e1 += rMat_e[k, 1] * tVec0[k]
+
+            angs[i, 0] = tth
+            angs[i, 1] = np.arctan2(gVec_e1, gVec_e0)
+            angs[i, 2] = ome
+
+
+@numba.njit(nogil=True, cache=True, parallel=True)
+def _paint_grid_block(
+    rMats,
+    gVecs_c,
+    symHKLs_ix,
+    chi,
+    bHat_l,
+    rMat_e,
+    wavelength,
+    etaEdges,
+    valid_eta_spans,
+    valid_ome_spans,
+    omeEdges,
+    omePeriod,
+    etaOmeMaps,
+    etaIndices,
+    omeIndices,
+    dpix_eta,
+    dpix_ome,
+    threshold,
+    nChunks,
+    out,
+):
+    """Completeness scores for a block of rotation matrices.
+
+    The block is split into `nChunks` contiguous chunks, one per thread,
+    each with its own buffers for the oscillation angles.
+    """
+    nQuats = rMats.shape[0]
+    npts = gVecs_c.shape[0]
+    nChunks = min(nChunks, nQuats)
+    for ichunk in numba.prange(nChunks):
+        angs_0 = np.empty((npts, 3))
+        angs_1 = np.empty((npts, 3))
+        for iq in range(ichunk * nQuats // nChunks, (ichunk + 1) * nQuats // nChunks):
+            _oscill_angles(
+                gVecs_c,
+                rMats[iq],
+                chi,
+                bHat_l,
+                rMat_e,
+                wavelength,
+                angs_0,
+                angs_1,
+            )
+            out[iq] = _filter_and_count_hits(
+                angs_0,
+                angs_1,
+                symHKLs_ix,
+                etaEdges,
+                valid_eta_spans,
+                valid_ome_spans,
+                omeEdges,
+                omePeriod,
+                etaOmeMaps,
+                etaIndices,
+                omeIndices,
+                dpix_eta,
+                dpix_ome,
+                threshold,
+            )
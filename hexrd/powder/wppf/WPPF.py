@@ -33,6 +33,7 @@ from hexrd.powder.wppf.peakfunctions import (
     calc_Iobs_pvtch,
     calc_Iobs_pvpink,
 )
+from hexrd.powder.wppf.derivatives import jacobian_pvfcj, jacobian_pvtch
 from hexrd.powder.wppf import wppfsupport
 from hexrd.powder.wppf.spectrum import Spectrum
 from hexrd.powder.wppf.phase import (
@@ -65,6 +66,21 @@ class AbstractWPPF(ABC):
     def _get_phase(self, name: str, wavelength_type: str):
         pass
 
+    @abstractmethod
+    def _reflections(self) -> dict:
+        """
+        the (tth, Xs, intensity, dsp) of the peaks of every phase and
+        wavelength, as used in computespectrum
+        """
+        pass
+
+    @abstractmethod
+    def _reflection_parameters(self) -> set:
+        """
+        names of the parameters which only change the reflections
+        """
+        pass
+
     # Shared methods which each WPPF type uses
     def __str__(self):
         cls_name = self.__class__.__name__
@@ -273,6 +289,43 @@ class AbstractWPPF(ABC):
                     self.sf_hkl_factors[p][k] = sf_f[limit]
                     self.sf_lfactor[p][k] = lfact_sf[limit]
 
+    def compute_tth_after_shifts(self, p, k):
+        '''helper function to be used by the computespectrum
+        functions of LeBail and Rietveld, and by
+        Rietveld.computespectrum_2d
+
+        Parameters
+        ----------
+
+        p: str
+            name of the phase
+        k: str
+            wavelength key
+        '''
+        phase = self._get_phase(p, k)
+        lam = self.phases.wavelength[k][0].getVal("nm")
+        shft_c = np.cos(0.5 * np.radians(self.tth[p][k])) * self.shft
+        trns_c = np.sin(np.radians(self.tth[p][k])) * self.trns
+        if phase.sf_alpha is None:
+            sf_shift = 0.0
+            Xs = np.zeros(self.tth[p][k].shape)
+        else:
+            alpha = getattr(self, f"{p}_sf_alpha")
+            beta = getattr(self, f"{p}_twin_beta")
+            sf_shift = (
+                alpha
+                * np.tan(np.radians(0.5 * self.tth[p][k]))
+                * self.sf_hkl_factors[p][k]
+            )
+            Xs = np.degrees(
+                0.9
+                * (1.5 * alpha + beta)
+                * (self.sf_lfactor[p][k] * lam / phase.lparms[0])
+            )
+        tth = self.tth[p][k] + self.zero_error + shft_c + trns_c + sf_shift
+
+        return tth, Xs
+
     def calcRwp(self, params):
         """
         >> @AUTHOR:  Saransh Singh, Lawrence Livermore National Lab,
@@ -295,6 +348,189 @@ class AbstractWPPF(ABC):
 
         return errvec
 
+    @property
+    def jacobian(self):
+        return self._jacobian
+
+    @jacobian.setter
+    def jacobian(self, v):
+        if v not in ("2-point", "analytic"):
+            msg = f'invalid jacobian "{v}". must be "2-point" or "analytic"'
+            raise ValueError(msg)
+        self._jacobian = v
+
+    @property
+    def least_squares_jac(self):
+        """
+        the jac argument of the least squares refinement
+        """
+        if self.jacobian == "analytic":
+            return self.calcJacobian
+        return "2-point"
+
+    def calcJacobian(self, params):
+        """
+        >> @DETAILS: the jacobian of the residual of calcRwp w.r.t. the
+                     varied parameters, used in the "analytic" jacobian mode.
+                     the derivatives of the spectrum are those of the peak
+                     profiles in wppf.derivatives, chained with the
+                     derivatives of the positions, widths and intensities
+                     of the peaks. for the parameters which only change the
+                     reflections (e.g. lattice parameters) the latter are
+                     differences of the reflections, without computing the
+                     spectrum. the other parameters (and all but the
+                     background with the pink beam peak shape) fall back to
+                     forward differences of the residual
+        """
+        names = [n for n, par in params.items() if par.vary]
+        errvec = self.calcRwp(params)
+
+        bkg_names = []
+        peak_names = []
+        fd_names = []
+        peak_rows = self._peak_parameter_rows()
+        reflection_parameters = self._reflection_parameters()
+        for n in names:
+            if "chebyshev" in self.bkgmethod and n.startswith("bkg_"):
+                bkg_names.append(n)
+            elif self.peakshape == 2:
+                fd_names.append(n)
+            elif n in peak_rows or n in reflection_parameters:
+                peak_names.append(n)
+            elif n == "scale" and params[n].value != 0.0:
+                peak_names.append(n)
+            else:
+                fd_names.append(n)
+
+        # the reflections after a step of each parameter which only
+        # changes the reflections
+        reflections = self._reflections()
+        shifted = {}
+        for n in peak_names:
+            if n not in reflection_parameters:
+                continue
+            par = params[n]
+            x0 = par.value
+            h = _forward_step(par)
+            par.value = x0 + h
+            try:
+                self._set_params_vals_to_class(params)
+                shifted[n] = (h, self._reflections())
+            finally:
+                par.value = x0
+        if shifted:
+            self._set_params_vals_to_class(params)
+
+        for n, (h, refl) in shifted.items():
+            if any(
+                len(refl[pk][2]) != len(reflections[pk][2])
+                or len(refl[pk][0]) != len(reflections[pk][0])
+                for pk in reflections
+            ):
+                # a peak moved in or out of the spectrum
+                peak_names.remove(n)
+                fd_names.append(n)
+
+        x = self.tth_list
+        tth_list = np.ascontiguousarray(x)
+        jac = np.zeros((x.shape[0], len(names)))
+        peak_cols = [names.index(n) for n in peak_names]
+        for (p, k), (tth, Xs, Ic, dsp) in reflections.items():
+            if not peak_names:
+                break
+            phase = self._get_phase(p, k)
+            name = phase.name
+            hkls = self.hkls[p][k]
+            nref = min(tth.shape[0], Ic.shape[0], dsp.shape[0], hkls.shape[0])
+            tth0 = self.tth[p][k][:nref]
+            phase_rows = (f"{name}_P", f"{name}_X", f"{name}_Y")
+
+            # derivatives of the intensity and peak_derivative_names
+            coef = np.zeros((nref, 9, len(peak_names)))
+            for j, n in enumerate(peak_names):
+                if n in shifted:
+                    h, refl = shifted[n]
+                    tth_h, Xs_h, Ic_h, dsp_h = refl[p, k]
+                    coef[:, 0, j] = (Ic_h[:nref] - Ic[:nref]) / h
+                    coef[:, 1, j] = (tth_h[:nref] - tth[:nref]) / h
+                    coef[:, 2, j] = (dsp_h[:nref] - dsp[:nref]) / h
+                    coef[:, 7, j] = (Xs_h[:nref] - Xs[:nref]) / h
+                elif n == "scale":
+                    coef[:, 0, j] = Ic[:nref] / params[n].value
+                elif n == "shft":
+                    coef[:, 1, j] = np.cos(0.5 * np.radians(tth0))
+                elif n == "trns":
+                    coef[:, 1, j] = np.sin(np.radians(tth0))
+                elif n in ("zero_error", "U", "V", "W") or n in phase_rows:
+                    coef[:, peak_rows[n], j] = 1.0
+
+            args = (
+                np.array([self.U, self.V, self.W]),
+                getattr(self, f"{name}_P"),
+                np.array([getattr(self, f"{name}_X"), getattr(self, f"{name}_Y")]),
+                Xs,
+                phase.shkl,
+                getattr(self, f"{name}_eta_fwhm"),
+            )
+            if self.peakshape == 0:
+                jac[:, peak_cols] += jacobian_pvfcj(
+                    *args,
+                    self.HL,
+                    self.SL,
+                    tth,
+                    dsp,
+                    hkls,
+                    tth_list,
+                    Ic,
+                    self.xn,
+                    self.wn,
+                    coef,
+                )
+            else:
+                jac[:, peak_cols] += jacobian_pvtch(
+                    *args, tth, dsp, hkls, tth_list, Ic, coef
+                )
+
+        for n in bkg_names:
+            degree = int(n.split("_")[1])
+            basis = np.polynomial.Chebyshev.basis(
+                degree, domain=[self.tth_list[0], self.tth_list[-1]]
+            )
+            jac[:, names.index(n)] = basis(x)
+
+        # the residual is sqrt(weights) * |simulated - experimental|
+        sim = self.spectrum_sim.y
+        mask = ~np.isnan(sim)
+        fact = np.sqrt(self.weights.y) * np.sign(sim - self.spectrum_expt.y)
+        jac = jac[mask] * fact[mask, None]
+
+        for n in fd_names:
+            par = params[n]
+            x0 = par.value
+            h = _forward_step(par)
+            par.value = x0 + h
+            try:
+                jac[:, names.index(n)] = (self.calcRwp(params) - errvec) / h
+            finally:
+                par.value = x0
+        if fd_names:
+            self.calcRwp(params)
+
+        return jac
+
+    def _peak_parameter_rows(self):
+        """
+        the parameters with analytic derivatives of the peaks, and the
+        row of the peak derivative they contribute to (see
+        derivatives.peak_derivative_names, after the intensity)
+        """
+        rows = {"zero_error": 1, "shft": 1, "trns": 1, "U": 3, "V": 4, "W": 5}
+        for p in self.phases:
+            for k in self.phases.wavelength:
+                name = self._get_phase(p, k).name
+                rows.update({f"{name}_P": 6, f"{name}_X": 7, f"{name}_Y": 8})
+        return rows
+
     @property
     def spectrum_sim(self):
         tth, inten = self._spectrum_sim.data
@@ -928,6 +1164,9 @@ class LeBail(AbstractWPPF):
                         User has option to pass in dictionary of structure
                         factors. must ensure that the size of structure factor
                         matches the possible reflections (added 01/22/2021 SS)
+        jacobian: "2-point" for a forward difference jacobian in the
+                  refinement, or "analytic" for the derivatives of the peak
+                  profiles (see calcJacobian)
     ============================================================================
     """
 
@@ -945,8 +1184,10 @@ class LeBail(AbstractWPPF):
         peakshape="pvfcj",
         amorphous_model=None,
         reset_background_params=True,
+        jacobian="2-point",
     ):
         self.peakshape = peakshape
+        self.jacobian = jacobian
         self.bkgmethod = bkgmethod
         self.intensity_init = intensity_init
 
@@ -1035,6 +1276,22 @@ class LeBail(AbstractWPPF):
         # LeBail just ignores the wavelength type for phases
         return self.phases[name]
 
+    def _reflections(self) -> dict:
+        reflections = {}
+        for p in self.phases:
+            for k in self.phases.wavelength:
+                tth, Xs = self.compute_tth_after_shifts(p, k)
+                reflections[p, k] = (tth, Xs, self.Icalc[p][k], self.dsp[p][k])
+        return reflections
+
+    def _reflection_parameters(self) -> set:
+        names = set()
+        for p in self.phases:
+            names.update(f"{p}_{x}" for x in wppfsupport._lpname)
+            if self.phases[p].sgnum == 225:
+                names.update((f"{p}_sf_alpha", f"{p}_twin_beta"))
+        return names
+
     def initialize_Icalc(self):
         """
         @DATE 01/22/2021 SS modified the function so Icalc can be initialized
@@ -1109,30 +1366,9 @@ class LeBail(AbstractWPPF):
         for iph, p in enumerate(self.phases):
             for k, l in self.phases.wavelength.items():
                 name = self.phases[p].name
-                lam = l[0].getVal("nm")
                 Ic = self.Icalc[p][k]
 
-                shft_c = np.cos(0.5 * np.radians(self.tth[p][k])) * self.shft
-                trns_c = np.sin(np.radians(self.tth[p][k])) * self.trns
-
-                if self.phases[p].sf_alpha is None:
-                    sf_shift = 0.0
-                    Xs = np.zeros(Ic.shape)
-                else:
-                    alpha = getattr(self, f"{p}_sf_alpha")
-                    beta = getattr(self, f"{p}_twin_beta")
-                    sf_shift = (
-                        alpha
-                        * np.tan(np.radians(0.5 * self.tth[p][k]))
-                        * self.sf_hkl_factors[p][k]
-                    )
-                    Xs = np.degrees(
-                        0.9
-                        * (1.5 * alpha + beta)
-                        * (self.sf_lfactor[p][k] * lam / self.phases[p].lparms[0])
-                    )
-
-                tth = self.tth[p][k] + self.zero_error + shft_c + trns_c + sf_shift
+                tth, Xs = self.compute_tth_after_shifts(p, k)
 
                 dsp = self.dsp[p][k]
                 hkls = self.hkls[p][k]
@@ -1229,28 +1465,8 @@ class LeBail(AbstractWPPF):
             for k, l in self.phases.wavelength.items():
                 name = self.phases[p].name
                 Ic = self.Icalc[p][k]
-                lam = l[0].getVal("nm")
-
-                shft_c = np.cos(0.5 * np.radians(self.tth[p][k])) * self.shft
-                trns_c = np.sin(np.radians(self.tth[p][k])) * self.trns
-
-                sf_shift = 0.0
-                Xs = np.zeros(Ic.shape)
-                if self.phases[p].sf_alpha is not None:
-                    alpha = getattr(self, f"{p}_sf_alpha")
-                    beta = getattr(self, f"{p}_twin_beta")
-                    sf_shift = (
-                        alpha
-                        * np.tan(np.radians(0.5 * self.tth[p][k]))
-                        * self.sf_hkl_factors[p][k]
-                    )
-                    Xs = np.degrees(
-                        0.9
-                        * (1.5 * alpha + beta)
-                        * (self.sf_lfactor[p][k] * lam / self.phases[p].lparms[0])
-                    )
 
-                tth = self.tth[p][k] + self.zero_error + shft_c + trns_c + sf_shift
+                tth, Xs = self.compute_tth_after_shifts(p, k)
 
                 dsp = self.dsp[p][k]
                 hkls = self.hkls[p][k]
@@ -1364,7 +1580,7 @@ class LeBail(AbstractWPPF):
                 "verbose": 0,
                 "max_nfev": 1000,
                 "method": "trf",
-                "jac": "2-point",
+                "jac": self.least_squares_jac,
             }
             fitter = lmfit.Minimizer(self.calcRwp, self.params)
 
@@ -1491,8 +1707,10 @@ class Rietveld(AbstractWPPF):
         eta_min=-180,
         eta_max=180,
         eta_step=5.0,
+        jacobian="2-point",
     ):
         self.bkgmethod = bkgmethod
+        self.jacobian = jacobian
         self.shape_factor = shape_factor
         self.particle_size = particle_size
         self.phi = phi
@@ -1672,6 +1890,42 @@ class Rietveld(AbstractWPPF):
         # Rietveld uses the wavelength type
         return self.phases[name][wavelength_type]
 
+    def _reflections(self) -> dict:
+        reflections = {}
+        Icomputed = self.compute_intensities()
+        for p in self.phases:
+            for k in self.phases.wavelength:
+                tth, Xs = self.compute_tth_after_shifts(p, k)
+                Ic = Icomputed[p][k]
+                texture_factor = self._texture_factor(p, k)
+                if texture_factor is not None:
+                    n = np.min((tth.shape[0], Ic.shape[0], texture_factor.shape[0]))
+                    tth = tth[:n]
+                    Ic = Ic[:n] * texture_factor[:n]
+                reflections[p, k] = (tth, Xs, Ic, self.dsp[p][k])
+        return reflections
+
+    def _reflection_parameters(self) -> set:
+        names = set()
+        for p in self.phases:
+            names.add(f"{p}_phase_fraction")
+            names.update(f"{p}_{x}" for x in wppfsupport._lpname)
+            for lpi in self.phases[p]:
+                mat = self.phases[p][lpi]
+                if mat.sgnum == 225:
+                    names.update((f"{p}_sf_alpha", f"{p}_twin_beta"))
+
+                atom_label = wppfsupport._getnumber(mat.atom_type)
+                for i, Z in enumerate(mat.atom_type):
+                    pre = f"{p}_{constants.ptableinverse[Z]}{atom_label[i]}"
+                    suffixes = ["x", "y", "z", "occ"]
+                    if mat.aniU:
+                        suffixes += list(wppfsupport._nameU)
+                    else:
+                        suffixes.append("dw")
+                    names.update(f"{pre}_{x}" for x in suffixes)
+        return names
+
     def calcsf(self):
         self.sf = {}
         self.sf_raw = {}
@@ -1744,42 +1998,6 @@ class Rietveld(AbstractWPPF):
                 Ic[p][k] = self.scale * pf * sf * lp  # *extinction*absorption
         return Ic
 
-    def compute_tth_after_shifts(self, p, k):
-        '''another helper function to be used by both
-        Rietveld.computspectrum and Rietveld.computespectrum_2d
-
-        Parameters
-        ----------
-
-        p: str
-            name of the phase
-        k: str
-            wavelength key
-        '''
-        name = self.phases[p][k].name
-        lam = self.phases.wavelength[k][0].getVal("nm")
-        shft_c = np.cos(0.5 * np.radians(self.tth[p][k])) * self.shft
-        trns_c = np.sin(np.radians(self.tth[p][k])) * self.trns
-        if self.phases[p][k].sf_alpha is None:
-            sf_shift = 0.0
-            Xs = np.zeros(self.tth[p][k].shape)
-        else:
-            alpha = getattr(self, f"{p}_sf_alpha")
-            beta = getattr(self, f"{p}_twin_beta")
-            sf_shift = (
-                alpha
-                * np.tan(np.radians(0.5 * self.tth[p][k]))
-                * self.sf_hkl_factors[p][k]
-            )
-            Xs = np.degrees(
-                0.9
-                * (1.5 * alpha + beta)
-                * (self.sf_lfactor[p][k] * lam / self.phases[p][k].lparms[0])
-            )
-        tth = self.tth[p][k] + self.zero_error + shft_c + trns_c + sf_shift
-
-        return tth, Xs
-
     def computespectrum_phase(self, p, k, Ic, texture_factor=None, fullrange=False):
         '''this is a helper function so which is use by both the
         Rietveld.computspectrum and Rietveld.computespectrum_2d
@@ -1880,20 +2098,7 @@ class Rietveld(AbstractWPPF):
         Icomputed = self.compute_intensities()
         for iph, p in enumerate(self.phases):
             for k, l in self.phases.wavelength.items():
-                if self.texture_model[p] is None:
-                    texture_factor = None
-                else:
-                    eta_mask = self.eta_mask
-                    if eta_mask is not None:
-                        eta_mask = eta_mask[p][k]
-
-                    texture_factor = self.texture_model[p].calc_texture_factor(
-                        self.params,
-                        eta_min=self.eta_min,
-                        eta_max=self.eta_max,
-                        eta_step=self.eta_step,
-                        eta_mask=eta_mask,
-                    )
+                texture_factor = self._texture_factor(p, k)
                 y += self.computespectrum_phase(
                     p, k, Icomputed[p][k], texture_factor=texture_factor
                 )
@@ -1911,6 +2116,25 @@ class Rietveld(AbstractWPPF):
         )
         return errvec
 
+    def _texture_factor(self, p, k):
+        '''the azimuthally averaged texture factor of the reflections of
+        phase p and wavelength k, or None if the phase has no texture model
+        '''
+        if self.texture_model[p] is None:
+            return None
+
+        eta_mask = self.eta_mask
+        if eta_mask is not None:
+            eta_mask = eta_mask[p][k]
+
+        return self.texture_model[p].calc_texture_factor(
+            self.params,
+            eta_min=self.eta_min,
+            eta_max=self.eta_max,
+            eta_step=self.eta_step,
+            eta_mask=eta_mask,
+        )
+
     def computespectrum_2D(self):
         '''this function computes the 2D pattern for the
         Rietevld model. if there is no texture, the pattern
@@ -2035,7 +2259,7 @@ class Rietveld(AbstractWPPF):
                 "verbose": 0,
                 "max_nfev": 1000,
                 "method": "trf",
-                "jac": "2-point",
+                "jac": self.least_squares_jac,
             }
 
             fitter = lmfit.Minimizer(self.calcRwp, self.params)
@@ -2402,6 +2626,20 @@ class Rietveld(AbstractWPPF):
         return results[4]
 
 
+def _forward_step(par):
+    """
+    the forward difference step of a parameter, as in the "2-point"
+    jacobian of scipy.optimize.least_squares
+    """
+    x0 = par.value
+    h = np.sqrt(np.finfo(float).eps) * max(1.0, abs(x0))
+    if x0 < 0.0:
+        h = -h
+    if not par.min <= x0 + h <= par.max:
+        h = -h
+    return h
+
+
 def separate_regions(masked_spec_array):
     """
     utility function for separating array into separate
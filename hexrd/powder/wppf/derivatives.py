@@ -1,145 +1,620 @@
 import numpy as np
-from numba import njit
-from hexrd.powder.wppf.peakfunctions import _unit_gaussian, _unit_lorentzian
+from numba import njit, prange, get_num_threads
+from hexrd.powder.wppf import peakfunctions
+from hexrd.powder.wppf.peakfunctions import (
+    _anisotropic_peak_broadening,
+    _check_ascending,
+    _mixing_factor_pv,
+    _fcj_tau_min,
+    _func_h,
+    _func_W,
+    _pvtch_window,
+    _pvfcj_window,
+    _pvfcj_profile,
+    _thread_blocks,
+    _window_taper,
+    gauss_width_fact,
+    lorentz_width_fact,
+)
 
 """
 naming convention for the derivative is as follows:
 _d_<peakshape>_<parameter>
 
 available <peakshape> :
-pvfcl: finger cox jephcoat asymmetric
+pvfcj: finger cox jephcoat asymmetric
 pv_wppf: symmetric pseudo voight
-pvoight_pink_beam: pink beam case
-
-available <parameters>: (only a couple listed 
-since the total number is very large)
-fwhm: full width half maxima
-tth: mean of peak
-.....
 
+the derivatives of a peak profile are w.r.t. the quantities in
+peak_derivative_names: the peak position, the d-spacing (through the
+anisotropic broadening) and the peak shape parameters. the jacobians of
+the spectra chain these with the derivatives of the intensities,
+positions and shape parameters of every peak w.r.t. the refined
+parameters.
 """
 
-
-@njit(cache=True, nogil=True)
-def _d_pvfcj_fwhm():
-    pass
-
-
-@njit(cache=True, nogil=True)
-def _d_pvfcj_tth():
-    pass
-
-
-@njit(cache=True, nogil=True)
-def _d_fwhm_U():
-    pass
-
-
-@njit(cache=True, nogil=True)
-def _d_fwhm_V():
-    pass
-
-
-@njit(cache=True, nogil=True)
-def _d_fwhm_W():
-    pass
-
-
-@njit(cache=True, nogil=True)
-def _d_fwhm_P():
-    pass
-
-
-@njit(cache=True, nogil=True)
-def _d_fwhm_X():
-    pass
-
-
-@njit(cache=True, nogil=True)
-def _d_fwhm_Y():
-    pass
-
-
-@njit(cache=True, nogil=True)
-def _d_fwhm_Xe():
-    pass
-
-
-@njit(cache=True, nogil=True)
-def _d_fwhm_Ye():
-    pass
-
-
-@njit(cache=True, nogil=True)
-def _d_fwhm_Xs():
-    pass
-
-
-@njit(cache=True, nogil=True)
-def _d_fwhm_HL():
-    pass
-
-
-@njit(cache=True, nogil=True)
-def _d_fwhm_SL():
-    pass
-
-
-@njit(cache=True, nogil=True)
-def _d_pvfcj_scale():
-    pass
-
-
-@njit(cache=True, nogil=True)
-def _d_pvfcj_phase_fraction():
-    pass
-
-
-@njit(cache=True, nogil=True)
-def _d_pvfcj_trns():
-    pass
-
-
-@njit(cache=True, nogil=True)
-def _d_pvfcj_shft():
-    pass
-
-
-@njit(cache=True, nogil=True)
-def _d_pvfcj_zero_error():
-    pass
+# the columns of the peak profile derivatives; the jacobian functions
+# take the derivatives of these quantities (and of the intensity, first)
+# w.r.t. the refined parameters
+peak_derivative_names = ("tth", "dsp", "U", "V", "W", "P", "X", "Y")
 
 
 @njit(cache=True, nogil=True)
-def _d_pvfcj_shkls():
-    pass
+def _d_pv_wppf_fwhm(uvw, p, xy, xy_sf, shkl, eta_mixing, tth, dsp, hkl):
+    """
+    @details the mixing factor and fwhm of pvoight_wppf, and their
+    derivatives w.r.t. peak_derivative_names. see _gaussian_fwhm,
+    _lorentzian_fwhm and _mixing_factor_pv
+    """
+    U, V, W = uvw
+    X, Y = xy
+    th = np.radians(0.5 * tth)
+    # d th / d tth
+    dth = np.pi / 360.0
+    tanth = np.tan(th)
+    cth = np.cos(th)
+    sec2 = 1.0 / cth**2
+
+    gamma_ani_sqr = _anisotropic_peak_broadening(shkl, hkl)
+
+    # gaussian fwhm is 1e-2 * sqrt(sigsqr)
+    ag = np.degrees(gamma_ani_sqr * (1.0 - eta_mixing) ** 2) * 1e4
+    ug = U + ag * dsp**4
+    sigsqr = ug * tanth**2 + V * tanth + W + p * sec2
+    d_sigsqr = np.zeros(8)
+    if sigsqr <= 0.0:
+        sigsqr = 1.0e-12
+    else:
+        d_sigsqr[0] = (2.0 * ug * tanth + V + 2.0 * p * tanth) * sec2 * dth
+        d_sigsqr[1] = 4.0 * ag * dsp**3 * tanth**2
+        d_sigsqr[2] = tanth**2
+        d_sigsqr[3] = tanth
+        d_sigsqr[4] = 1.0
+        d_sigsqr[5] = sec2
+    fwhm_g = np.sqrt(sigsqr) * 1e-2
+    d_fwhm_g = d_sigsqr * 0.5e-4 / fwhm_g
+
+    # lorentzian fwhm
+    al = np.degrees(np.sqrt(gamma_ani_sqr) * eta_mixing) * 1e2
+    xl = X + xy_sf
+    yl = Y + al * dsp**2
+    fwhm_l = (xl / cth + yl * tanth) * 1e-2
+    d_fwhm_l = np.zeros(8)
+    d_fwhm_l[0] = (xl * tanth / cth + yl * sec2) * dth * 1e-2
+    d_fwhm_l[1] = 2.0 * al * dsp * tanth * 1e-2
+    d_fwhm_l[6] = 1e-2 / cth
+    d_fwhm_l[7] = tanth * 1e-2
+
+    # thompson, cox and hastings mixing
+    n, fwhm = _mixing_factor_pv(fwhm_g, fwhm_l)
+    g = fwhm_g
+    l_val = fwhm_l
+    d5_g = (
+        5.0 * g**4
+        + 4.0 * 2.69269 * g**3 * l_val
+        + 3.0 * 2.42843 * g**2 * l_val**2
+        + 2.0 * 4.47163 * g * l_val**3
+        + 0.07842 * l_val**4
+    )
+    d5_l = (
+        2.69269 * g**4
+        + 2.0 * 2.42843 * g**3 * l_val
+        + 3.0 * 4.47163 * g**2 * l_val**2
+        + 4.0 * 0.07842 * g * l_val**3
+        + 5.0 * l_val**4
+    )
+    d_fwhm = (d5_g * d_fwhm_g + d5_l * d_fwhm_l) / (5.0 * fwhm**4)
+
+    d_n = np.zeros(8)
+    if n > 0.0 and n < 1.0:
+        r = l_val / fwhm
+        d_r = (d_fwhm_l - r * d_fwhm) / fwhm
+        d_n = (1.36603 - 2.0 * 0.47719 * r + 3.0 * 0.11116 * r**2) * d_r
+
+    return n, fwhm, d_n, d_fwhm
 
 
 @njit(cache=True, nogil=True)
-def _d_pvfcj_a():
-    pass
+def _d_pv_wppf(uvw, p, xy, xy_sf, shkl, eta_mixing, tth, dsp, hkl, tth_list):
+    """
+    @details pvoight_wppf (first column) and its derivatives w.r.t.
+    peak_derivative_names (other columns)
+    """
+    n, fwhm, d_n, d_fwhm = _d_pv_wppf_fwhm(
+        uvw, p, xy, xy_sf, shkl, eta_mixing, tth, dsp, hkl
+    )
+    sigma2 = (fwhm / gauss_width_fact) ** 2
+    gamma = fwhm / lorentz_width_fact
+    Ag = 0.9394372787 / fwhm
+    Al = 1.0 / np.pi
+
+    res = np.empty((tth_list.shape[0], 9))
+    for i in range(tth_list.shape[0]):
+        dx = tth_list[i] - tth
+        dx2 = dx * dx
+        den = dx2 + gamma**2
+        g = Ag * np.exp(-dx2 / (2.0 * sigma2))
+        l_val = Al * gamma / den
+
+        # partial derivatives w.r.t. the center, fwhm and mixing factor
+        pv_x0 = n * l_val * 2.0 * dx / den + (1.0 - n) * g * dx / sigma2
+        pv_fwhm = (
+            n * Al * (dx2 - gamma**2) / den**2 / lorentz_width_fact
+            + (1.0 - n) * g * (dx2 / sigma2 - 1.0) / fwhm
+        )
+        pv_n = l_val - g
+
+        res[i, 0] = n * l_val + (1.0 - n) * g
+        for j in range(8):
+            res[i, j + 1] = pv_fwhm * d_fwhm[j] + pv_n * d_n[j]
+        res[i, 1] += pv_x0
+    return res
 
 
 @njit(cache=True, nogil=True)
-def _d_pvfcj_b():
-    pass
+def _step_peak(uvw, p, xy, tth, dsp, j, h):
+    # the peak quantities with peak_derivative_names[j] stepped by h
+    uvw = uvw.copy()
+    xy = xy.copy()
+    if j == 0:
+        tth = tth + h
+    elif j == 1:
+        dsp = dsp + h
+    elif j < 5:
+        uvw[j - 2] += h
+    elif j == 5:
+        p = p + h
+    else:
+        xy[j - 6] += h
+    return uvw, p, xy, tth, dsp
 
 
 @njit(cache=True, nogil=True)
-def _d_pvfcj_c():
-    pass
+def _peak_window(
+    uvw, p, xy, xy_sf, shkl, eta_mixing, tth, dsp, hkl, tth_list, HoL, SoL, tol, fcj
+):
+    # _pvfcj_window if fcj, else _pvtch_window
+    if fcj:
+        return _pvfcj_window(
+            uvw, p, xy, xy_sf, shkl, eta_mixing, tth, dsp, hkl, tth_list, HoL, SoL, tol
+        )
+    return _pvtch_window(
+        uvw, p, xy, xy_sf, shkl, eta_mixing, tth, dsp, hkl, tth_list, tol
+    )
 
 
 @njit(cache=True, nogil=True)
-def _d_pvfcj_alpha():
-    pass
+def _d_window_taper(
+    lo,
+    hi,
+    uvw,
+    p,
+    xy,
+    xy_sf,
+    shkl,
+    eta_mixing,
+    tth,
+    dsp,
+    hkl,
+    tth_list,
+    HoL,
+    SoL,
+    tol,
+    fcj,
+):
+    """
+    @details the taper of the window of a peak (see _peak_window) over
+    tth_list[lo:hi], and its derivatives w.r.t. peak_derivative_names.
+    those of the ends of the window and of the width of the taper are
+    central differences
+    """
+    _, _, a, b, s = _peak_window(
+        uvw, p, xy, xy_sf, shkl, eta_mixing, tth, dsp, hkl, tth_list, HoL, SoL, tol, fcj
+    )
+    x = tth_list[lo:hi]
+    taper = _window_taper(x, a, b, s)
+    d_taper = np.zeros((x.shape[0], 8))
+    if not np.isfinite(a):
+        # the peak is evaluated everywhere
+        return taper, d_taper
+
+    q = np.array([tth, dsp, uvw[0], uvw[1], uvw[2], p, xy[0], xy[1]])
+    for j in range(8):
+        h = 1e-6 * max(1.0, abs(q[j]))
+        uvw_p, p_p, xy_p, tth_p, dsp_p = _step_peak(uvw, p, xy, tth, dsp, j, h)
+        _, _, a_p, b_p, s_p = _peak_window(
+            uvw_p,
+            p_p,
+            xy_p,
+            xy_sf,
+            shkl,
+            eta_mixing,
+            tth_p,
+            dsp_p,
+            hkl,
+            tth_list,
+            HoL,
+            SoL,
+            tol,
+            fcj,
+        )
+        uvw_m, p_m, xy_m, tth_m, dsp_m = _step_peak(uvw, p, xy, tth, dsp, j, -h)
+        _, _, a_m, b_m, s_m = _peak_window(
+            uvw_m,
+            p_m,
+            xy_m,
+            xy_sf,
+            shkl,
+            eta_mixing,
+            tth_m,
+            dsp_m,
+            hkl,
+            tth_list,
+            HoL,
+            SoL,
+            tol,
+            fcj,
+        )
+        da = (a_p - a_m) / (2.0 * h)
+        db = (b_p - b_m) / (2.0 * h)
+        ds = (s_p - s_m) / (2.0 * h)
+
+        # see _window_taper
+        for i in range(x.shape[0]):
+            if x[i] < a:
+                u = (a - x[i]) / s
+                du = (da - u * ds) / s
+            elif x[i] > b:
+                u = (x[i] - b) / s
+                du = -(db + u * ds) / s
+            else:
+                continue
+            if u < 1.0:
+                d_taper[i, j] = -30.0 * u**2 * (1.0 - u) ** 2 * du
+    return taper, d_taper
 
 
 @njit(cache=True, nogil=True)
-def _d_pvfcj_beta():
-    pass
+def _apply_taper(res, taper, d_taper):
+    # res, a profile (first column) and its derivatives (other columns),
+    # times the taper, by the product rule
+    for i in range(res.shape[0]):
+        for j in range(8):
+            res[i, j + 1] = taper[i] * res[i, j + 1] + d_taper[i, j] * res[i, 0]
+        res[i, 0] *= taper[i]
 
 
 @njit(cache=True, nogil=True)
-def _d_pvfcj_gamma():
-    pass
+def _d_pvfcj(
+    uvw,
+    p,
+    xy,
+    xy_sf,
+    shkl,
+    eta_mixing,
+    tth,
+    dsp,
+    hkl,
+    tth_list,
+    HoL,
+    SoL,
+    xn,
+    wn,
+    taper,
+    d_taper,
+):
+    """
+    @details pvfcj times the taper of its window (first column) and its
+    derivatives w.r.t. peak_derivative_names (other columns), as in
+    _tapered_pvfcj. taper and d_taper are from _d_window_taper. the slit
+    functions also depend on the peak position, so the derivative of the
+    profile w.r.t. tth is a central difference; the others are those of
+    the pseudo voight components. the normalization is applied last
+    """
+    # the same quadrature as _pvfcj_profile
+    tth_r = np.radians(tth)
+    ctth = np.cos(tth_r)
+
+    tau_min = _fcj_tau_min(HoL, SoL, tth_r)
+    arg = ctth * np.sqrt(((HoL - SoL) ** 2 + 1.0))
+    tau_infl = tth_r - np.arccos(arg)
+
+    tau = tau_min * xn
+    cx = np.cos(tau)
+    res = np.zeros((tth_list.shape[0], 9))
+    den = 0.0
+    for i in np.arange(tau.shape[0]):
+        x = tth_r - tau[i]
+        xx = tau[i]
+
+        W = _func_W(HoL, SoL, xx, tau_min, tau_infl, tth_r)
+        h = _func_h(xx, tth_r)
+        fact = wn[i] * (W / h / cx[i])
+        den += fact
+
+        res += fact * _d_pv_wppf(
+            uvw, p, xy, xy_sf, shkl, eta_mixing, np.degrees(x), dsp, hkl, tth_list
+        )
+    res *= np.sin(tth_r) / den / 4.0 / HoL / SoL
+
+    _, fwhm, _, _ = _d_pv_wppf_fwhm(uvw, p, xy, xy_sf, shkl, eta_mixing, tth, dsp, hkl)
+    step = 1e-4 * fwhm
+    hi = _pvfcj_profile(
+        uvw,
+        p,
+        xy,
+        xy_sf,
+        shkl,
+        eta_mixing,
+        tth + step,
+        dsp,
+        hkl,
+        tth_list,
+        HoL,
+        SoL,
+        xn,
+        wn,
+    )
+    lo = _pvfcj_profile(
+        uvw,
+        p,
+        xy,
+        xy_sf,
+        shkl,
+        eta_mixing,
+        tth - step,
+        dsp,
+        hkl,
+        tth_list,
+        HoL,
+        SoL,
+        xn,
+        wn,
+    )
+    res[:, 1] = (hi - lo) / (2.0 * step)
+
+    # through the taper, then the normalization
+    _apply_taper(res, taper, d_taper)
+    a = np.trapz(res[:, 0], tth_list)
+    if a == 0.0:
+        # nothing of the peak is on the grid
+        return res
+    out = np.empty_like(res)
+    out[:, 0] = res[:, 0] / a
+    for j in range(1, 9):
+        out[:, j] = (res[:, j] - out[:, 0] * np.trapz(res[:, j], tth_list)) / a
+    return out
+
+
+def jacobian_pvfcj(
+    uvw,
+    p,
+    xy,
+    xy_sf,
+    shkl,
+    eta_mixing,
+    HL,
+    SL,
+    tth,
+    dsp,
+    hkl,
+    tth_list,
+    Iobs,
+    xn,
+    wn,
+    coef,
+    window_tol=None,
+):
+    """
+    @details the derivatives of computespectrum_pvfcj w.r.t. a set of
+    parameters, as a (tth_list.shape[0], nparams) array. coef is the
+    (nref, 9, nparams) array of the derivatives of the intensity and of
+    peak_derivative_names of every peak w.r.t. the parameters. the peaks
+    are evaluated over the same tapered windows as in
+    computespectrum_pvfcj
+    """
+    if window_tol is None:
+        window_tol = peakfunctions.peak_window_tol
+    _check_ascending(tth_list, window_tol)
+    return _jacobian_pvfcj(
+        uvw,
+        p,
+        xy,
+        xy_sf,
+        shkl,
+        eta_mixing,
+        HL,
+        SL,
+        tth,
+        dsp,
+        hkl,
+        tth_list,
+        Iobs,
+        xn,
+        wn,
+        np.ascontiguousarray(coef, dtype=np.float64),
+        float(window_tol),
+        get_num_threads(),
+    )
+
+
+@njit(cache=True, nogil=True, parallel=True)
+def _jacobian_pvfcj(
+    uvw,
+    p,
+    xy,
+    xy_sf,
+    shkl,
+    eta_mixing,
+    HL,
+    SL,
+    tth,
+    dsp,
+    hkl,
+    tth_list,
+    Iobs,
+    xn,
+    wn,
+    coef,
+    window_tol,
+    nthreads,
+):
+    nref = np.min(np.array([Iobs.shape[0], tth.shape[0], dsp.shape[0], hkl.shape[0]]))
+    nthreads, block = _thread_blocks(nref, nthreads)
+    jac_threads = np.zeros((nthreads, tth_list.shape[0], coef.shape[2]))
+    for it in prange(nthreads):
+        jac = jac_threads[it]
+        for ii in range(it * block, min((it + 1) * block, nref)):
+            t = tth[ii]
+            d = dsp[ii]
+            g = hkl[ii]
+            xs = xy_sf[ii]
+
+            lo, hi, _, _, _ = _pvfcj_window(
+                uvw, p, xy, xs, shkl, eta_mixing, t, d, g, tth_list, HL, SL, window_tol
+            )
+            if hi - lo < 2:
+                continue
+
+            taper, d_taper = _d_window_taper(
+                lo,
+                hi,
+                uvw,
+                p,
+                xy,
+                xs,
+                shkl,
+                eta_mixing,
+                t,
+                d,
+                g,
+                tth_list,
+                HL,
+                SL,
+                window_tol,
+                True,
+            )
+            dpv = _d_pvfcj(
+                uvw,
+                p,
+                xy,
+                xs,
+                shkl,
+                eta_mixing,
+                t,
+                d,
+                g,
+                tth_list[lo:hi],
+                HL,
+                SL,
+                xn,
+                wn,
+                taper,
+                d_taper,
+            )
+            dpv[:, 1:] *= Iobs[ii]
+            jac[lo:hi] += np.dot(dpv, coef[ii])
+    return jac_threads.sum(axis=0)
+
+
+def jacobian_pvtch(
+    uvw,
+    p,
+    xy,
+    xy_sf,
+    shkl,
+    eta_mixing,
+    tth,
+    dsp,
+    hkl,
+    tth_list,
+    Iobs,
+    coef,
+    window_tol=None,
+):
+    """
+    @details the derivatives of computespectrum_pvtch w.r.t. a set of
+    parameters, as a (tth_list.shape[0], nparams) array. coef is the
+    (nref, 9, nparams) array of the derivatives of the intensity and of
+    peak_derivative_names of every peak w.r.t. the parameters. the peaks
+    are evaluated over the same tapered windows as in
+    computespectrum_pvtch
+    """
+    if window_tol is None:
+        window_tol = peakfunctions.peak_window_tol
+    _check_ascending(tth_list, window_tol)
+    return _jacobian_pvtch(
+        uvw,
+        p,
+        xy,
+        xy_sf,
+        shkl,
+        eta_mixing,
+        tth,
+        dsp,
+        hkl,
+        tth_list,
+        Iobs,
+        np.ascontiguousarray(coef, dtype=np.float64),
+        float(window_tol),
+        get_num_threads(),
+    )
+
+
+@njit(cache=True, nogil=True, parallel=True)
+def _jacobian_pvtch(
+    uvw,
+    p,
+    xy,
+    xy_sf,
+    shkl,
+    eta_mixing,
+    tth,
+    dsp,
+    hkl,
+    tth_list,
+    Iobs,
+    coef,
+    window_tol,
+    nthreads,
+):
+    nref = np.min(np.array([Iobs.shape[0], tth.shape[0], dsp.shape[0], hkl.shape[0]]))
+    nthreads, block = _thread_blocks(nref, nthreads)
+    jac_threads = np.zeros((nthreads, tth_list.shape[0], coef.shape[2]))
+    for it in prange(nthreads):
+        jac = jac_threads[it]
+        for ii in range(it * block, min((it + 1) * block, nref)):
+            t = tth[ii]
+            d = dsp[ii]
+            g = hkl[ii]
+            xs = xy_sf[ii]
+
+            lo, hi, _, _, _ = _pvtch_window(
+                uvw, p, xy, xs, shkl, eta_mixing, t, d, g, tth_list, window_tol
+            )
+            if hi == lo:
+                continue
+
+            taper, d_taper = _d_window_taper(
+                lo,
+                hi,
+                uvw,
+                p,
+                xy,
+                xs,
+                shkl,
+                eta_mixing,
+                t,
+                d,
+                g,
+                tth_list,
+                0.0,
+                0.0,
+                window_tol,
+                False,
+            )
+            dpv = _d_pv_wppf(uvw, p, xy, xs, shkl, eta_mixing, t, d, g, tth_list[lo:hi])
+            _apply_taper(dpv, taper, d_taper)
+            dpv[:, 1:] *= Iobs[ii]
+            jac[lo:hi] += np.dot(dpv, coef[ii])
+    return jac_threads.sum(axis=0)
@@ -28,7 +28,7 @@
 import numpy as np
 import copy
 from hexrd.core import constants
-from numba import vectorize, float64, njit, prange
+from numba import vectorize, float64, njit, prange, get_num_threads
 from hexrd.core.fitting.peakfunctions import erfc, exp1exp
 
 # from scipy.special import erfc, exp1
@@ -40,6 +40,15 @@ from hexrd.core.fitting.peakfunctions import erfc, exp1exp
 gauss_width_fact = constants.sigma_to_fwhm
 lorentz_width_fact = 2.0
 
+# the WPPF spectra only evaluate each peak where its profile is above this
+# fraction of its maximum; 0 evaluates every peak everywhere
+peak_window_tol = 1e-4
+
+# beyond that window, the peaks are tapered to zero over this fraction of
+# its half width (and at least two steps of the grid), so that the spectra
+# stay smooth functions of the peak parameters
+peak_window_taper = 0.5
+
 # FIXME: we need this for the time being to be able to parse multipeak fitting
 # results; need to wrap all this up in a class in the future!
 mpeak_nparams_dict = {
@@ -415,6 +424,14 @@ def _func_W(HoL, SoL, tau, tau_min, tau_infl, tth):
     return res
 
 
+@njit(cache=True, nogil=True)
+def _fcj_tau_min(HoL, SoL, tth_r):
+    # the axial divergence shifts the profile by up to tau_min (radians)
+    arg = np.cos(tth_r) * np.sqrt(((HoL + SoL) ** 2 + 1.0))
+    cinv = np.arccos(arg)
+    return tth_r - cinv
+
+
 @njit(cache=True, nogil=True)
 def pvfcj(
     uvw,
@@ -439,14 +456,37 @@ def pvfcj(
     xn, wn are the Gauss-Legendre weights and abscissae
     supplied using the scipy routine
     """
+    res = _pvfcj_profile(
+        uvw, p, xy, xy_sf, shkl, eta_mixing, tth, dsp, hkl, tth_list, HoL, SoL, xn, wn
+    )
+    a = np.trapz(res, tth_list)
+    return res / a
+
+
+@njit(cache=True, nogil=True)
+def _pvfcj_profile(
+    uvw,
+    p,
+    xy,
+    xy_sf,
+    shkl,
+    eta_mixing,
+    tth,
+    dsp,
+    hkl,
+    tth_list,
+    HoL,
+    SoL,
+    xn,
+    wn,
+):
+    # pvfcj before its normalization over tth_list
 
     # angle of minimum
     tth_r = np.radians(tth)
     ctth = np.cos(tth_r)
 
-    arg = ctth * np.sqrt(((HoL + SoL) ** 2 + 1.0))
-    cinv = np.arccos(arg)
-    tau_min = tth_r - cinv
+    tau_min = _fcj_tau_min(HoL, SoL, tth_r)
 
     # two theta of inflection point
     arg = ctth * np.sqrt(((HoL - SoL) ** 2 + 1.0))
@@ -482,9 +522,7 @@ def pvfcj(
         )
         res += pv * fact
 
-    res = np.sin(tth_r) * res / den / 4.0 / HoL / SoL
-    a = np.trapz(res, tth_list)
-    return res / a
+    return np.sin(tth_r) * res / den / 4.0 / HoL / SoL
 
 
 @njit(cache=True, nogil=True)
@@ -590,7 +628,140 @@ def pvoight_pink_beam(
     return n * l_val / al + (1.0 - n) * g / ag
 
 
-@njit(cache=True, nogil=True, parallel=True)
+@njit(cache=True, nogil=True)
+def _pv_window_halfwidth(uvw, p, xy, xy_sf, shkl, eta_mixing, tth, dsp, hkl, tol):
+    """
+    @details half width (in degrees) beyond which the profile of
+    pvoight_wppf is below tol times its maximum. the gaussian and the
+    lorentzian terms are each bounded by half of that.
+    """
+    if tol <= 0.0:
+        return np.inf
+
+    gamma_ani_sqr = _anisotropic_peak_broadening(shkl, hkl)
+    fwhm_g = _gaussian_fwhm(uvw, p, gamma_ani_sqr, eta_mixing, tth, dsp)
+    fwhm_l = _lorentzian_fwhm(xy, xy_sf, gamma_ani_sqr, eta_mixing, tth, dsp)
+    n, fwhm = _mixing_factor_pv(fwhm_g, fwhm_l)
+
+    # maxima of the gaussian and lorentzian terms
+    gamma = fwhm / lorentz_width_fact
+    g0 = (1.0 - n) * 0.9394372787 / fwhm
+    l0 = n / np.pi / gamma
+    cut = 0.5 * tol * (g0 + l0)
+
+    w = 0.0
+    if l0 > cut:
+        # n / pi * gamma / x**2 < cut
+        w = np.sqrt(n / np.pi * gamma / cut)
+    if g0 > cut:
+        sigma = fwhm / gauss_width_fact
+        w = max(w, sigma * np.sqrt(2.0 * np.log(g0 / cut)))
+    return w
+
+
+@njit(cache=True, nogil=True)
+def _tapered_window(tth_list, a, b, w):
+    """
+    @details the slice of tth_list over which a peak, above the window
+    tolerance over [a - w, b + w], is evaluated, and the ends and taper
+    width of its taper (see _window_taper). the slice extends one point
+    beyond the taper on each side, where the tapered profile is zero, so
+    that trapz over the slice is that over the whole grid
+    """
+    n = tth_list.shape[0]
+    if not (np.isfinite(w) and np.isfinite(a) and np.isfinite(b)):
+        return 0, n, -np.inf, np.inf, 1.0
+
+    dx = 0.0
+    if n > 1:
+        dx = (tth_list[-1] - tth_list[0]) / (n - 1)
+    s = max(peak_window_taper * w, 2.0 * dx)
+    lo = max(np.searchsorted(tth_list, a - w - s) - 1, 0)
+    hi = min(np.searchsorted(tth_list, b + w + s, side='right') + 1, n)
+    return lo, hi, a - w, b + w, s
+
+
+@njit(cache=True, nogil=True)
+def _window_taper(tth_list, a, b, s):
+    # one over [a, b], going smoothly (C2) to zero at a - s and b + s
+    t = np.ones(tth_list.shape)
+    for i in range(tth_list.shape[0]):
+        x = tth_list[i]
+        u = 0.0
+        if x < a:
+            u = (a - x) / s
+        elif x > b:
+            u = (x - b) / s
+        if u >= 1.0:
+            t[i] = 0.0
+        elif u > 0.0:
+            t[i] = 1.0 - u**3 * (10.0 - 15.0 * u + 6.0 * u**2)
+    return t
+
+
+@njit(cache=True, nogil=True)
+def _pvtch_window(uvw, p, xy, xy_sf, shkl, eta_mixing, tth, dsp, hkl, tth_list, tol):
+    # the tapered window (see _tapered_window) of a pvoight_wppf peak
+    w = _pv_window_halfwidth(uvw, p, xy, xy_sf, shkl, eta_mixing, tth, dsp, hkl, tol)
+    return _tapered_window(tth_list, tth, tth, w)
+
+
+@njit(cache=True, nogil=True)
+def _pvfcj_window(
+    uvw, p, xy, xy_sf, shkl, eta_mixing, tth, dsp, hkl, tth_list, HoL, SoL, tol
+):
+    # the tapered window (see _tapered_window) of a pvfcj peak. the
+    # profile spans the pseudo voight from tth to tth - tau_min
+    t_min = tth - np.degrees(_fcj_tau_min(HoL, SoL, np.radians(tth)))
+    w = max(
+        _pv_window_halfwidth(uvw, p, xy, xy_sf, shkl, eta_mixing, tth, dsp, hkl, tol),
+        _pv_window_halfwidth(uvw, p, xy, xy_sf, shkl, eta_mixing, t_min, dsp, hkl, tol),
+    )
+    return _tapered_window(tth_list, min(tth, t_min), max(tth, t_min), w)
+
+
+@njit(cache=True, nogil=True)
+def _tapered_pvfcj(
+    uvw,
+    p,
+    xy,
+    xy_sf,
+    shkl,
+    eta_mixing,
+    tth,
+    dsp,
+    hkl,
+    tth_list,
+    HoL,
+    SoL,
+    xn,
+    wn,
+    taper,
+):
+    # pvfcj times the taper of its window, normalized over the window
+    res = taper * _pvfcj_profile(
+        uvw, p, xy, xy_sf, shkl, eta_mixing, tth, dsp, hkl, tth_list, HoL, SoL, xn, wn
+    )
+    area = np.trapz(res, tth_list)
+    if area == 0.0:
+        # nothing of the peak is on the grid
+        return res
+    return res / area
+
+
+def _check_ascending(tth_list, window_tol):
+    # the peak windows are found by bisection
+    if window_tol > 0 and np.any(np.diff(tth_list) < 0):
+        raise ValueError("tth_list must be in ascending order")
+
+
+@njit(cache=True, nogil=True)
+def _thread_blocks(nref, nthreads):
+    # contiguous blocks of reflections, one per thread
+    nthreads = min(nthreads, max(nref, 1))
+    return nthreads, (nref + nthreads - 1) // nthreads
+
+
 def computespectrum_pvfcj(
     uvw,
     p,
@@ -607,6 +778,7 @@ def computespectrum_pvfcj(
     Iobs,
     xn,
     wn,
+    window_tol=None,
 ):
     """
     @author Saransh Singh, Lawrence Livermore National Lab
@@ -614,27 +786,110 @@ def computespectrum_pvfcj(
     @details compute the spectrum given all the input parameters.
     moved outside of the class to allow numba implementation
     this is called for multiple wavelengths and phases to generate
-    the final spectrum
+    the final spectrum. each peak is only evaluated over the window
+    where it is above window_tol (peak_window_tol by default) times
+    its maximum, and tapered to zero beyond it. tth_list must then be
+    in ascending order
     """
+    if window_tol is None:
+        window_tol = peak_window_tol
+    _check_ascending(tth_list, window_tol)
+    return _computespectrum_pvfcj(
+        uvw,
+        p,
+        xy,
+        xy_sf,
+        shkl,
+        eta_mixing,
+        HL,
+        SL,
+        tth,
+        dsp,
+        hkl,
+        tth_list,
+        Iobs,
+        xn,
+        wn,
+        float(window_tol),
+        get_num_threads(),
+    )
 
-    spec = np.zeros(tth_list.shape)
-    nref = np.min(np.array([Iobs.shape[0], tth.shape[0], dsp.shape[0], hkl.shape[0]]))
-    for ii in prange(nref):
-        II = Iobs[ii]
-        t = tth[ii]
-        d = dsp[ii]
-        g = hkl[ii]
-        xs = xy_sf[ii]
-
-        pv = pvfcj(uvw, p, xy, xs, shkl, eta_mixing, t, d, g, tth_list, HL, SL, xn, wn)
 
-        spec += II * pv
-    return spec
+@njit(cache=True, nogil=True, parallel=True)
+def _computespectrum_pvfcj(
+    uvw,
+    p,
+    xy,
+    xy_sf,
+    shkl,
+    eta_mixing,
+    HL,
+    SL,
+    tth,
+    dsp,
+    hkl,
+    tth_list,
+    Iobs,
+    xn,
+    wn,
+    window_tol,
+    nthreads,
+):
+    nref = np.min(np.array([Iobs.shape[0], tth.shape[0], dsp.shape[0], hkl.shape[0]]))
+    nthreads, block = _thread_blocks(nref, nthreads)
+    spec_threads = np.zeros((nthreads, tth_list.shape[0]))
+    for it in prange(nthreads):
+        spec = spec_threads[it]
+        for ii in range(it * block, min((it + 1) * block, nref)):
+            II = Iobs[ii]
+            t = tth[ii]
+            d = dsp[ii]
+            g = hkl[ii]
+            xs = xy_sf[ii]
+
+            lo, hi, a, b, s = _pvfcj_window(
+                uvw, p, xy, xs, shkl, eta_mixing, t, d, g, tth_list, HL, SL, window_tol
+            )
+            if hi - lo < 2:
+                # the window is off the grid
+                continue
+
+            x = tth_list[lo:hi]
+            pv = _tapered_pvfcj(
+                uvw,
+                p,
+                xy,
+                xs,
+                shkl,
+                eta_mixing,
+                t,
+                d,
+                g,
+                x,
+                HL,
+                SL,
+                xn,
+                wn,
+                _window_taper(x, a, b, s),
+            )
+
+            spec[lo:hi] += II * pv
+    return spec_threads.sum(axis=0)
 
 
-@njit(cache=True, nogil=True, parallel=True)
 def computespectrum_pvtch(
-    uvw, p, xy, xy_sf, shkl, eta_mixing, tth, dsp, hkl, tth_list, Iobs
+    uvw,
+    p,
+    xy,
+    xy_sf,
+    shkl,
+    eta_mixing,
+    tth,
+    dsp,
+    hkl,
+    tth_list,
+    Iobs,
+    window_tol=None,
 ):
     """
     @author Saransh Singh, Lawrence Livermore National Lab
@@ -642,22 +897,69 @@ def computespectrum_pvtch(
     @details compute the spectrum given all the input parameters.
     moved outside of the class to allow numba implementation
     this is called for multiple wavelengths and phases to generate
-    the final spectrum
+    the final spectrum. each peak is only evaluated over the window
+    where it is above window_tol (peak_window_tol by default) times
+    its maximum, and tapered to zero beyond it. tth_list must then be
+    in ascending order
     """
+    if window_tol is None:
+        window_tol = peak_window_tol
+    _check_ascending(tth_list, window_tol)
+    return _computespectrum_pvtch(
+        uvw,
+        p,
+        xy,
+        xy_sf,
+        shkl,
+        eta_mixing,
+        tth,
+        dsp,
+        hkl,
+        tth_list,
+        Iobs,
+        float(window_tol),
+        get_num_threads(),
+    )
 
-    spec = np.zeros(tth_list.shape)
-    nref = np.min(np.array([Iobs.shape[0], tth.shape[0], dsp.shape[0], hkl.shape[0]]))
-    for ii in prange(nref):
-        II = Iobs[ii]
-        t = tth[ii]
-        d = dsp[ii]
-        g = hkl[ii]
-        xs = xy_sf[ii]
-
-        pv = pvoight_wppf(uvw, p, xy, xs, shkl, eta_mixing, t, d, g, tth_list)
 
-        spec += II * pv
-    return spec
+@njit(cache=True, nogil=True, parallel=True)
+def _computespectrum_pvtch(
+    uvw,
+    p,
+    xy,
+    xy_sf,
+    shkl,
+    eta_mixing,
+    tth,
+    dsp,
+    hkl,
+    tth_list,
+    Iobs,
+    window_tol,
+    nthreads,
+):
+    nref = np.min(np.array([Iobs.shape[0], tth.shape[0], dsp.shape[0], hkl.shape[0]]))
+    nthreads, block = _thread_blocks(nref, nthreads)
+    spec_threads = np.zeros((nthreads, tth_list.shape[0]))
+    for it in prange(nthreads):
+        spec = spec_threads[it]
+        for ii in range(it * block, min((it + 1) * block, nref)):
+            II = Iobs[ii]
+            t = tth[ii]
+            d = dsp[ii]
+            g = hkl[ii]
+            xs = xy_sf[ii]
+
+            lo, hi, a, b, s = _pvtch_window(
+                uvw, p, xy, xs, shkl, eta_mixing, t, d, g, tth_list, window_tol
+            )
+
+            x = tth_list[lo:hi]
+            pv = pvoight_wppf(uvw, p, xy, xs, shkl, eta_mixing, t, d, g, x)
+            pv *= _window_taper(x, a, b, s)
+
+            spec[lo:hi] += II * pv
+    return spec_threads.sum(axis=0)
 
 
 @njit(cache=True, nogil=True, parallel=True)
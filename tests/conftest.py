@@ -1,6 +1,14 @@
+import importlib.resources
 import os
 from pathlib import Path
+
+import numpy as np
 import pytest
+import yaml
+
+import hexrd.core.resources.instrument_templates
+from hexrd.core.instrument.hedm_instrument import HEDMInstrument
+from hexrd.core.material.material import Material
 
 
 @pytest.fixture
@@ -20,3 +28,40 @@ def test_dir():
 @pytest.fixture
 def test_data_dir(test_dir):
     return test_dir / 'data'
+
+
+@pytest.fixture
+def instr_binning():
+    # the pixel binning of the panels of `instr`; override to change it
+    return 8
+
+
+@pytest.fixture
+def instr(instr_binning):
+    # the dual dexelas template, with coarsened panels to keep tests quick
+    path = importlib.resources.files(
+        hexrd.core.resources.instrument_templates
+    ).joinpath('dual_dexelas.yml')
+    conf = yaml.safe_load(path.read_text())
+    for det in conf['detectors'].values():
+        det['pixels']['rows'] //= instr_binning
+        det['pixels']['columns'] //= instr_binning
+        det['pixels']['size'] = [instr_binning * x for x in det['pixels']['size']]
+    return HEDMInstrument(conf)
+
+
+@pytest.fixture
+def plane_data_tth_max():
+    # the maximum two theta of `plane_data`, in degrees
+    return 15.0
+
+
+@pytest.fixture
+def plane_data(instr, test_data_dir, plane_data_tth_max):
+    # silicon, at the energy of `instr`
+    mat = Material('Si', str(test_data_dir / 'materials' / 'Si.cif'), sgsetting=0)
+    pd = mat.planeData
+    pd.wavelength = instr.beam_energy
+    pd.exclusions = None
+    pd.tThMax = np.radians(plane_data_tth_max)
+    return pd
@@ -186,3 +186,89 @@ def test_pickle(mock_npz):
         ml.return_value.__enter__.return_value = mock_npz
         a = FrameCacheImageSeriesAdapter("t.npz", style="npz")
         assert hasattr(pickle.loads(pickle.dumps(a)), '_load_framelist_lock')
+
+
+def _write_fch5(tmp_path, arr):
+    from hexrd.core import imageseries
+
+    ims = imageseries.open(None, 'array', data=arr)
+    fname = str(tmp_path / 'fc.fch5')
+    imageseries.write(ims, fname, 'frame-cache', style='fch5', threshold=0.5)
+    return fname
+
+
+def test_lazy_fch5(tmp_path):
+    rng = np.random.default_rng(0)
+    arr = rng.integers(0, 3, size=(5, 8, 6)).astype(np.float32)
+    fname = _write_fch5(tmp_path, arr)
+
+    a = FrameCacheImageSeriesAdapter(fname, style="fch5", lazy=True, cache_size=2)
+    assert len(a) == 5
+    for i in [3, 0, 4, 3, -1]:
+        assert np.array_equal(a[i], np.where(arr[i] > 0.5, arr[i], 0))
+
+    # LRU holds at most `cache_size` frames
+    assert len(a._framelist._cache) == 2
+
+    expected = np.where(arr > 0.5, arr, 0)
+    region = ((2, 6), (1, 4))
+    # region of a frame that is not cached, then of one that is
+    assert np.array_equal(a.get_region(1, region), expected[1, 2:6, 1:4])
+    assert np.array_equal(a.get_region(4, region), expected[4, 2:6, 1:4])
+
+    ind1 = np.array([[0, 1], [2, 3]])
+    ind2 = np.array([[0, 1], [2, 3]])
+    assert np.array_equal(a[2, ind1, ind2], expected[2][ind1, ind2])
+
+    with pytest.raises(IndexError):
+        a[5]
+
+    b = pickle.loads(pickle.dumps(a))
+    assert np.array_equal(b[2], expected[2])
+
+
+@pytest.mark.parametrize('lazy', [False, True])
+def test_fch5_v2(tmp_path, lazy):
+    from hexrd.core import imageseries
+    from hexrd.core.imageseries.save import convert_frame_cache
+
+    rng = np.random.default_rng(1)
+    arr = rng.integers(0, 3, size=(6, 8, 7)).astype(np.float32)
+    expected = np.where(arr > 0.5, arr, 0)
+    ims = imageseries.open(None, 'array', data=arr, meta={'k': np.arange(3)})
+
+    # small chunks, so that frames span several chunks
+    fname = str(tmp_path / 'fc_v2.fch5')
+    imageseries.write(
+        ims,
+        fname,
+        'frame-cache',
+        style='fch5',
+        threshold=0.5,
+        version=2,
+        chunk_size=5,
+    )
+
+    v1name = _write_fch5(tmp_path, arr)
+    npzname = str(tmp_path / 'fc.npz')
+    imageseries.write(ims, npzname, 'frame-cache', style='npz', threshold=0.5)
+    converted = []
+    for i, infile in enumerate([v1name, npzname]):
+        outfile = str(tmp_path / f'converted_{i}.fch5')
+        convert_frame_cache(infile, outfile, chunk_size=7, max_workers=2)
+        converted.append(outfile)
+
+    for f in [fname, *converted]:
+        a = FrameCacheImageSeriesAdapter(f, style='fch5', lazy=lazy)
+        assert a._fch5_version == 2
+        for i in range(len(arr)):
+            assert np.array_equal(a[i], expected[i])
+        region = ((1, 5), (2, 6))
+        assert np.array_equal(a.get_region(3, region), expected[3, 1:5, 2:6])
+
+    assert np.array_equal(a.metadata['k'], np.arange(3))
+
+    with pytest.raises(TypeError):
+        imageseries.write(
+            ims, npzname, 'frame-cache', style='npz', threshold=0.5, version=2
+        )
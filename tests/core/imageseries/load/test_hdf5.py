@@ -125,3 +125,39 @@ def test_pickle_roundtrip(tmp_path):
 
     reloaded.close()
     adapter.close()
+
+
+def test_3d_adapter_batch_reads(tmp_path):
+    fname, arr = make_h5_file_3d(str(tmp_path / "h3d_batch.h5"), shape=(12, 4, 3))
+    adapter = HDF5ImageSeriesAdapter(fname, path='entry', chunk_cache_size=2**20)
+    assert adapter.option_values() == {'chunk_cache_size': 2**20}
+
+    for key in [
+        slice(2, 6),
+        slice(None, None, -3),
+        range(1, 4),
+        [5, 2, 5, -1],
+        np.array([0, 11]),
+        [],
+    ]:
+        expected = arr[np.arange(12)[key]]
+        res = adapter[key]
+        assert res.shape == expected.shape
+        np.testing.assert_array_equal(res, expected)
+
+    np.testing.assert_array_equal(adapter[[3, 1], 2], arr[[3, 1], 2])
+    np.testing.assert_array_equal(adapter[np.int64(4)], arr[4])
+    with pytest.raises(IndexError):
+        adapter[[12]]
+
+    adapter.set_option('chunk_cache_size', 2**22)
+    assert adapter.chunk_cache_size == 2**22
+    np.testing.assert_array_equal(adapter[2:5], arr[2:5])
+    with pytest.raises(NotImplementedError):
+        adapter.set_option('bad', 1)
+
+    reloaded = pickle.loads(pickle.dumps(adapter))
+    assert reloaded.chunk_cache_size == 2**22
+    np.testing.assert_array_equal(reloaded[[1, 0]], arr[[1, 0]])
+    reloaded.close()
+    adapter.close()
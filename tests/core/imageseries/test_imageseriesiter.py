@@ -0,0 +1,91 @@
+import gc
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from hexrd.core import imageseries
+from hexrd.core.imageseries.imageseriesiter import (
+    ImageSeriesIterator,
+    PrefetchIterator,
+)
+
+
+@pytest.fixture
+def ims():
+    data = np.arange(6 * 3 * 2, dtype=np.float32).reshape(6, 3, 2)
+    return imageseries.open(None, 'array', data=data)
+
+
+def test_iterator(ims):
+    frames = list(ImageSeriesIterator(ims))
+    assert len(frames) == 6
+    assert np.array_equal(frames[5], ims[5])
+
+
+@pytest.mark.filterwarnings('error::pytest.PytestUnraisableExceptionWarning')
+def test_prefetch(ims):
+    for depth in (1, 3, 10):
+        frames = list(ims.prefetch(depth=depth))
+        assert len(frames) == 6
+        for i, frame in enumerate(frames):
+            assert np.array_equal(frame, ims[i])
+
+    frames = list(PrefetchIterator(ims, frames=[4, 1]))
+    assert np.array_equal(frames[0], ims[4])
+    assert np.array_equal(frames[1], ims[1])
+
+    with pytest.raises(ValueError):
+        PrefetchIterator(ims, depth=0)
+    # the half-built iterator can still be closed
+    gc.collect()
+
+
+def test_prefetch_reads_ahead():
+    requested = []
+    released = threading.Event()
+
+    class Frames:
+        def __len__(self):
+            return 10
+
+        def __getitem__(self, i):
+            requested.append(i)
+            if i > 0:
+                released.wait(5)
+            return i
+
+    it = PrefetchIterator(Frames(), depth=3)
+    assert next(it) == 0
+    # frames 1-3 are requested while the consumer works on frame 0
+    for _ in range(500):
+        if len(requested) == 4:
+            break
+        time.sleep(0.01)
+    assert sorted(requested) == [0, 1, 2, 3]
+    released.set()
+    assert list(it) == list(range(1, 10))
+
+
+def test_prefetch_error_and_close():
+    class Frames:
+        def __len__(self):
+            return 5
+
+        def __getitem__(self, i):
+            if i == 2:
+                raise KeyError(i)
+            return i
+
+    it = PrefetchIterator(Frames(), depth=2)
+    assert next(it) == 0
+    assert next(it) == 1
+    with pytest.raises(KeyError):
+        next(it)
+    with pytest.raises(StopIteration):
+        next(it)
+
+    with PrefetchIterator(Frames(), depth=2) as it:
+        assert next(it) == 0
+    assert list(it) == []
@@ -185,3 +185,51 @@ def test_fancy_getitem_dispatch(mock_series):
     ps = ProcessedImageSeries(mock_series, [])
     res = ps[(0, slice(0, 2))]
     assert res.shape == (2, 4)
+
+
+def test_fused_ops_do_not_modify_source():
+    data_0 = np.arange(6, dtype=np.float32).reshape(2, 3)
+    imser = MockImageSeries(shape=(2, 3), data={0: data_0})
+    oplist = [('flip', 'v'), ('dark', 1.0), ('add', 2.0)]
+    ps = ProcessedImageSeries(imser, oplist)
+
+    expected = np.clip(data_0[:, ::-1] - 1.0, 0, None) + 2.0
+    np.testing.assert_array_equal(ps[0], expected)
+    np.testing.assert_array_equal(data_0, np.arange(6).reshape(2, 3))
+
+
+def test_frame_cache(mock_series):
+    ps = ProcessedImageSeries(
+        mock_series, [('dark', np.full((4, 4), 2.0))], cache_size=2
+    )
+    with patch.object(ps, '_process_frame', wraps=ps._process_frame) as pf:
+        for i in [3, 3, 4, 3, 5, 4]:
+            assert np.all(ps[i] == i - 2)
+        # frames 3, 4, 5 and (evicted) 4 again
+        assert pf.call_count == 4
+
+        # cached frames are copies
+        ps[5][:] = -1
+        assert np.all(ps[5] == 3)
+        assert ps[5, 0, 0] == 3
+
+        # replacing an operation invalidates the cache
+        ps.oplist[0] = ('dark', np.full((4, 4), 1.0))
+        assert np.all(ps[5] == 4)
+
+
+def test_batch_getitem(mock_series):
+    ps = ProcessedImageSeries(mock_series, [('add', 1.0)], max_workers=3)
+    for key, idxs in [
+        (slice(2, 8, 2), [2, 4, 6]),
+        (range(3), [0, 1, 2]),
+        ([9, 0], [9, 0]),
+        (np.array([1, -1]), [1, 9]),
+    ]:
+        res = ps[key]
+        assert res.shape == (len(idxs), 4, 4)
+        for frame, i in zip(res, idxs):
+            assert np.all(frame == i + 1)
+
+    assert ps[np.int64(3)][0, 0] == 4
+    assert ps[5:5].shape == (0, 4, 4)
@@ -259,3 +259,62 @@ def test_write_yaml_deprecation(mock_ims):
 def test_unsupported_style(mock_ims):
     with pytest.raises(TypeError, match="Unknown file style"):
         save.WriteFrameCache(mock_ims, "out", threshold=0, style="bad_style")
+
+
+# --- fch5 round trips ---
+
+
+@pytest.mark.parametrize('lazy', [False, True])
+@pytest.mark.parametrize('chunk', [10, 70])
+def test_write_fch5_chunks(tmp_path, monkeypatch, chunk, lazy):
+    import h5py
+    from hexrd.core import imageseries
+    from hexrd.core.imageseries.load.framecache import (
+        FrameCacheImageSeriesAdapter,
+    )
+
+    # small chunks, smaller and larger than the frames, so that these are
+    # appended over several of them
+    monkeypatch.setattr(save, 'FCH5_WRITE_CHUNK', chunk)
+    rng = np.random.default_rng(0)
+    arr = rng.integers(0, 3, size=(11, 8, 6)).astype(np.float32)
+    expected = np.where(arr > 0.5, arr, 0)
+    nnz = np.count_nonzero(expected)
+    assert nnz > 4 * chunk and nnz % chunk != 0
+
+    ims = imageseries.open(None, 'array', data=arr)
+    fname = str(tmp_path / 'fc.fch5')
+    save.WriteFrameCache(ims, fname, style='fch5', threshold=0.5, max_workers=3).write()
+
+    with h5py.File(fname, 'r') as f:
+        assert f['data'].chunks == (chunk, 1)
+        assert f['data'].shape == (nnz, 1)
+
+    a = FrameCacheImageSeriesAdapter(fname, style='fch5', lazy=lazy)
+    assert len(a) == len(arr)
+    for i in range(len(arr)):
+        assert np.array_equal(a[i], expected[i])
+
+
+def test_write_fch5_empty(tmp_path):
+    from hexrd.core.imageseries.load.framecache import (
+        FrameCacheImageSeriesAdapter,
+    )
+
+    class Empty:
+        shape = (4, 3)
+        dtype = np.dtype(np.float32)
+        metadata = {}
+
+        def __len__(self):
+            return 0
+
+        def __getitem__(self, key):
+            raise IndexError(key)
+
+    fname = str(tmp_path / 'empty.fch5')
+    save.WriteFrameCache(Empty(), fname, style='fch5', threshold=0.5).write()
+
+    a = FrameCacheImageSeriesAdapter(fname, style='fch5')
+    assert len(a) == 0
+    assert tuple(a.shape) == (4, 3)
@@ -0,0 +1,119 @@
+import numpy as np
+import pytest
+
+from hexrd.core.distortion.ge_41rt import GE_41RT
+from hexrd.core.instrument.detector import Detector
+from hexrd.core.instrument import cylindrical_detector, planar_detector
+from hexrd.core.instrument.cylindrical_detector import CylindricalDetector
+from hexrd.core.instrument.planar_detector import PlanarDetector
+
+MODULES = {PlanarDetector: planar_detector, CylindricalDetector: cylindrical_detector}
+
+
+@pytest.fixture(params=[PlanarDetector, CylindricalDetector])
+def panel(request):
+    panel = request.param(
+        rows=64,
+        cols=96,
+        pixel_size=(0.2, 0.2),
+        tvec=np.array([1.0, -2.0, -500.0]),
+        tilt=np.array([0.01, 0.02, 0.03]),
+    )
+    if request.param is PlanarDetector:
+        panel.distortion = GE_41RT([2e-4, 3e-4, 4e-4, 2.0, 2.0, 2.0])
+    return panel
+
+
+def uncached_pixel_angles(panel):
+    kwargs = dict(panel._pixel_angle_kwargs)
+    kwargs['pixel_coords'] = panel.pixel_coords
+    pixel_angles = MODULES[type(panel)]._pixel_angles.__wrapped__
+    return pixel_angles(origin=np.zeros(3), bvec=panel.bvec, **kwargs)
+
+
+def assert_pixel_angles(panel):
+    tth, eta = panel.pixel_angles()
+    expected = uncached_pixel_angles(panel)
+    assert np.array_equal(tth, expected[0])
+    assert np.array_equal(eta, expected[1])
+    return tth
+
+
+def test_geometry_version(panel):
+    versions = {panel.geometry_version}
+    panel.tvec = [0.0, 0.0, -400.0]
+    versions.add(panel.geometry_version)
+    panel.tilt = [0.0, 0.0, 0.0]
+    versions.add(panel.geometry_version)
+    panel.rows = 32
+    versions.add(panel.geometry_version)
+    panel.pixel_size_col = 0.1
+    versions.add(panel.geometry_version)
+    assert len(versions) == 5
+
+    # anything else keeps the version
+    panel.name = 'other'
+    panel.saturation_level = 1000
+    assert panel.geometry_version in versions
+
+
+def test_pixel_angles_cache(panel):
+    pixel_angles = MODULES[type(panel)]._pixel_angles
+    pixel_angles.cache_clear()
+
+    tth, _ = panel.pixel_angles()
+    info = pixel_angles.cache_info()
+    assert info['nbytes'] == 2 * tth.nbytes
+    panel.pixel_angles()
+    assert pixel_angles.cache_info()['hits'] == info['hits'] + 1
+    assert_pixel_angles(panel)
+
+    # set, and modified in place
+    results = [tth]
+    panel.tvec = panel.tvec + [0.5, 0.0, 0.0]
+    results.append(assert_pixel_angles(panel))
+    panel.tvec[2] -= 10
+    results.append(assert_pixel_angles(panel))
+    panel.pixel_size_row = 0.25
+    results.append(assert_pixel_angles(panel))
+    if panel.distortion is not None:
+        panel.distortion.params = 2 * panel.distortion.params
+        results.append(assert_pixel_angles(panel))
+    for a, b in zip(results[:-1], results[1:]):
+        assert not np.array_equal(a, b)
+
+    # the gradients share the same keys
+    tth_grad = MODULES[type(panel)]._pixel_tth_gradient
+    misses = tth_grad.cache_info()['misses']
+    panel.pixel_tth_gradient()
+    panel.pixel_tth_gradient()
+    assert tth_grad.cache_info()['misses'] == misses + 1
+
+
+def test_pixel_angles_cache_geometry_changes(panel):
+    funcs = [
+        MODULES[type(panel)]._pixel_angles,
+        MODULES[type(panel)]._pixel_tth_gradient,
+    ]
+    for f in funcs:
+        f.cache_clear()
+
+    other = type(panel)(rows=8, cols=8)
+    other.pixel_angles()
+    for i in range(10):
+        # set, and modified in place
+        panel.tvec = panel.tvec + [0.1, 0.0, 0.0]
+        panel.tilt[0] += 1e-3
+        panel.pixel_tth_gradient()
+        assert_pixel_angles(panel)
+
+    # only the current geometry of each panel is kept
+    assert funcs[0].cache_info()['currsize'] == 2
+    assert funcs[1].cache_info()['currsize'] == 1
+    hits = funcs[0].cache_info()['hits']
+    other.pixel_angles()
+    assert funcs[0].cache_info()['hits'] == hits + 1
+
+    # the caches bounded by size are left alone
+    Detector.increase_memoization_sizes(funcs, 4)
+    assert funcs[0].cache_info()['maxsize'] is None
@@ -0,0 +1,110 @@
+import numpy as np
+import pytest
+
+from hexrd.core import imageseries
+from hexrd.core.imageseries.omega import OmegaImageSeries
+from hexrd.core.instrument import hedm_instrument
+
+
+@pytest.fixture
+def instr_binning():
+    return 16
+
+
+@pytest.fixture
+def plane_data_tth_max():
+    return 12.0
+
+
+@pytest.fixture
+def imsd(instr):
+    rng = np.random.default_rng(0)
+    nframes = 11
+    omegas = 0.25 * np.vstack([np.arange(nframes), np.arange(1, nframes + 1)]).T
+    imsd = {}
+    for det_key, panel in instr.detectors.items():
+        data = 100 * rng.random((nframes, panel.rows, panel.cols))
+        data[:, :4, :4] = np.nan
+        ims = imageseries.open(None, 'array', data=data, meta={'omega': omegas})
+        imsd[det_key] = OmegaImageSeries(ims)
+    return imsd
+
+
+def reference_polar_maps(instr, plane_data, imsd, threshold):
+    panel = next(iter(instr.detectors.values()))
+    _, _, tth_ranges, _, eta_edges = panel.make_powder_rings(
+        plane_data, merge_hkls=False, delta_eta=0.25, full_output=True
+    )
+    maps = {}
+    for det_key, panel in instr.detectors.items():
+        ptth, peta = panel.pixel_angles()
+        ims = imsd[det_key]
+        ring_maps = np.full((len(tth_ranges), len(ims), len(eta_edges) - 1), np.nan)
+        for i, image in enumerate(ims):
+            image = np.array(image)
+            image[image < threshold] = 0.0
+            for i_r, tthr in enumerate(tth_ranges):
+                in_ring = np.logical_and(ptth >= tthr[0], ptth <= tthr[1])
+                if not np.any(in_ring):
+                    continue
+                result = hedm_instrument.histogram(
+                    peta[in_ring], eta_edges, weights=image[in_ring]
+                )
+                on_detector = np.where(
+                    hedm_instrument.histogram(peta[in_ring], eta_edges)
+                )[0]
+                ring_maps[i_r, i, on_detector] = result[on_detector]
+        maps[det_key] = ring_maps
+    return maps
+
+
+@pytest.mark.parametrize('max_workers', [1, 2])
+def test_extract_polar_maps(instr, plane_data, imsd, max_workers):
+    instr.max_workers = max_workers
+    maps, eta_edges = instr.extract_polar_maps(plane_data, imsd, threshold=20.0)
+    expected = reference_polar_maps(instr, plane_data, imsd, 20.0)
+    for det_key in instr.detectors:
+        assert np.allclose(maps[det_key], expected[det_key], rtol=1e-12, equal_nan=True)
+        assert np.any(np.isnan(maps[det_key]))
+        assert np.any(maps[det_key] > 0)
+
+
+def test_polar_map_operator_is_cached(instr, plane_data, imsd):
+    cache_info = hedm_instrument._polar_map_operator.cache_info
+    instr.extract_polar_maps(plane_data, imsd)
+    misses = cache_info()['misses']
+
+    instr.extract_polar_maps(plane_data, imsd)
+    assert cache_info()['misses'] == misses
+
+    # a new ring width requires a new operator for each panel
+    instr.extract_polar_maps(plane_data, imsd, tth_tol=0.3)
+    assert cache_info()['misses'] == misses + len(instr.detectors)
+
+
+def merge_panel_maps(panel_maps):
+    # the original merge: sum the finite values, NaN where no panel has any
+    maps = np.array(list(panel_maps.values()))
+    merged = np.nansum(maps, axis=0)
+    merged[np.all(np.isnan(maps), axis=0)] = np.nan
+    return merged
+
+
+@pytest.mark.parametrize('max_workers', [1, 3])
+def test_extract_polar_maps_merged(instr, plane_data, imsd, max_workers):
+    instr.max_workers = max_workers
+    panel_maps, _ = instr.extract_polar_maps(plane_data, imsd, threshold=20.0)
+    merged, _ = instr.extract_polar_maps(
+        plane_data, imsd, threshold=20.0, merge_panels=True
+    )
+    assert np.allclose(merged, merge_panel_maps(panel_maps), rtol=1e-12, equal_nan=True)
+
+
+def test_generate_eta_ome_maps(instr, plane_data, imsd):
+    eta_ome = hedm_instrument.GenerateEtaOmeMaps(imsd, instr, plane_data)
+    panel_maps, eta_edges = instr.extract_polar_maps(plane_data, imsd)
+    expected = merge_panel_maps(panel_maps)
+    assert len(eta_ome.dataStore) == len(expected)
+    for data, ref in zip(eta_ome.dataStore, expected):
+        assert np.allclose(data, ref, rtol=1e-12, equal_nan=True)
+    assert np.array_equal(eta_ome.etaEdges, eta_edges)
@@ -0,0 +1,232 @@
+from collections import Counter
+
+import numpy as np
+import pytest
+from scipy import ndimage
+from skimage.measure import regionprops
+
+from hexrd.core import imageseries
+from hexrd.core.imageseries.omega import OmegaImageSeries
+from hexrd.core.instrument import hedm_instrument
+
+PULL_KWARGS = dict(tth_tol=1.0, eta_tol=2.0, ome_tol=3.0, threshold=20)
+
+
+@pytest.fixture
+def grain_params():
+    rng = np.random.default_rng(2)
+    params = np.zeros((4, 12))
+    params[:, :3] = rng.normal(size=(4, 3))
+    params[:, 3:6] = 0.01 * rng.normal(size=(4, 3))
+    params[:, 6:9] = 1
+    return params
+
+
+class CountingSeries(OmegaImageSeries):
+    """OmegaImageSeries that counts the reads of each frame"""
+
+    def __init__(self, ims):
+        super().__init__(ims)
+        self.reads = Counter()
+
+    def __getitem__(self, key):
+        self.reads[key if np.isscalar(key) else key[0]] += 1
+        return super().__getitem__(key)
+
+
+@pytest.fixture
+def imsd(instr, plane_data, grain_params):
+    # noise below the threshold, plus blobs at most of the simulated spots
+    rng = np.random.default_rng(0)
+    nframes = 60
+    omegas = -30 + np.vstack([np.arange(nframes), np.arange(1, nframes + 1)]).T
+    sim = instr.simulate_rotation_series(
+        plane_data,
+        grain_params,
+        ome_ranges=[np.radians([-30, 30])],
+        ome_period=np.radians([-30, 330]),
+    )
+    imsd = {}
+    for det_key, panel in instr.detectors.items():
+        data = 5 * rng.random((nframes, panel.rows, panel.cols))
+        for angs, xys in zip(sim[det_key][2], sim[det_key][3]):
+            frames = np.floor(np.mod(np.degrees(angs[:, 2]) + 30, 360)).astype(int)
+            for (i, j), f in zip(panel.cartToPixel(xys).astype(int), frames):
+                if rng.random() < 0.2 or not 0 < f < nframes - 1:
+                    continue
+                if 0 < i < panel.rows - 1 and 0 < j < panel.cols - 1:
+                    data[f - 1 : f + 2, i - 1 : i + 2, j - 1 : j + 2] += 30
+                    data[f, i, j] += 70 * rng.random()
+        ims = imageseries.open(None, 'array', data=data, meta={'omega': omegas})
+        imsd[det_key] = CountingSeries(ims)
+    return imsd
+
+
+@pytest.fixture
+def expected_pull_spots_results(test_data_dir):
+    # the output of the original pull_spots, see summarize
+    path = test_data_dir / 'expected_pull_spots_results.npy'
+    return np.load(path, allow_pickle=True).item()
+
+
+def summarize(result, return_spot_list):
+    """pull_spots output with the patch arrays of the spots (the patch
+    coordinates, pixel indices and data) reduced to their shapes and sums
+    """
+
+    def fingerprint(x):
+        if isinstance(x, tuple):
+            return tuple(fingerprint(y) for y in x)
+        x = np.asarray(x)
+        return np.array(x.shape), np.nansum(x)
+
+    if not return_spot_list:
+        return result
+    return [
+        (
+            compl,
+            {
+                det_key: [
+                    [
+                        fingerprint(x) if i in (8, 9, 11) else x
+                        for i, x in enumerate(spot)
+                    ]
+                    for spot in spots
+                ]
+                for det_key, spots in output.items()
+            },
+        )
+        for compl, output in result
+    ]
+
+
+def assert_same(a, b, rtol=0):
+    if isinstance(a, (list, tuple)):
+        assert len(a) == len(b)
+        for x, y in zip(a, b):
+            assert_same(x, y, rtol)
+    elif isinstance(a, dict):
+        assert list(a) == list(b)
+        for k in a:
+            assert_same(a[k], b[k], rtol)
+    else:
+        a, b = np.asarray(a), np.asarray(b)
+        assert a.dtype == b.dtype
+        if a.dtype.kind == 'f':
+            np.testing.assert_allclose(a, b, rtol=rtol, atol=0, equal_nan=True)
+        else:
+            assert np.array_equal(a, b)
+
+
+@pytest.mark.parametrize('interp', ['nearest', 'bilinear'])
+@pytest.mark.parametrize('return_spot_list', [False, True])
+def test_pull_spots_multi(
+    instr,
+    plane_data,
+    grain_params,
+    imsd,
+    interp,
+    return_spot_list,
+    expected_pull_spots_results,
+):
+    kwargs = dict(interp=interp, return_spot_list=return_spot_list, **PULL_KWARGS)
+    expected = [
+        instr.pull_spots(plane_data, params, imsd, **kwargs) for params in grain_params
+    ]
+    result = instr.pull_spots_multi(plane_data, grain_params, imsd, **kwargs)
+    assert_same(result, expected)
+
+    # as the original pull_spots, up to the rounding of the centroids
+    assert_same(
+        summarize(result, return_spot_list),
+        expected_pull_spots_results[interp, return_spot_list],
+        rtol=1e-10,
+    )
+
+    # some patches have no signal, and so no peak
+    patch_has_signal = np.hstack([r[0] for r in result])
+    assert 0 < np.sum(patch_has_signal) < len(patch_has_signal)
+    peak_ids = [
+        spot[2 if return_spot_list else 0]
+        for _, output in result
+        for spots in output.values()
+        for spot in spots
+    ]
+    assert min(peak_ids) <= -100
+    assert max(peak_ids) >= 0
+
+
+def test_pull_spots_multi_reads_frames_once(instr, plane_data, grain_params, imsd):
+    instr.pull_spots_multi(plane_data, grain_params, imsd, **PULL_KWARGS)
+    for ims in imsd.values():
+        assert ims.reads
+        assert max(ims.reads.values()) == 1
+
+
+def find_patch_peak(patch_data, patch_data_raw, threshold, label_struct):
+    # the original per-patch labeling
+    labels, num_peaks = ndimage.label(patch_data > threshold, label_struct)
+    if num_peaks == 0:
+        return None
+    coms = np.vstack([x.centroid_weighted for x in regionprops(labels, patch_data)])
+    closest_peak_idx = np.argmin(
+        np.sum((coms - np.array(patch_data.shape) / 2) ** 2, axis=1)
+    )
+    mask = labels == (closest_peak_idx + 1)
+    return (
+        coms[closest_peak_idx],
+        patch_data[mask].sum(),
+        patch_data_raw[mask].max(),
+    )
+
+
+@pytest.mark.parametrize('dtype', [np.float64, np.float32, np.uint16])
+@pytest.mark.parametrize('connect_frames', [True, False])
+def test_find_patch_peaks(dtype, connect_frames):
+    rng = np.random.default_rng(3)
+    patches = []
+    for _ in range(200):
+        shape = rng.integers(2, 16, 3)
+        patch = ndimage.gaussian_filter(1000 * rng.random(shape), 1)
+        patches.append(patch.astype(dtype))
+    raw_patches = [patch.copy() for patch in patches]
+    if dtype != np.uint16:
+        raw_patches[0][:] = np.nan
+
+    if connect_frames:
+        label_struct = ndimage.generate_binary_structure(3, 3)
+        ref_struct = label_struct
+    else:
+        label_struct = ndimage.generate_binary_structure(2, 2)
+        ref_struct = np.zeros((3, 3, 3), dtype=bool)
+        ref_struct[1] = label_struct
+
+    peaks = hedm_instrument._find_patch_peaks(patches, raw_patches, 520, label_struct)
+    assert len(peaks) == len(patches)
+    assert any(peak is None for peak in peaks)
+    for patch, raw, peak in zip(patches, raw_patches, peaks):
+        expected = find_patch_peak(patch, raw, 520, ref_struct)
+        if expected is None:
+            assert peak is None
+            continue
+        com, total, maximum = peak
+        # the regionprops moments are summed with BLAS
+        np.testing.assert_allclose(com, expected[0], rtol=0, atol=1e-12)
+        assert total.dtype == expected[1].dtype
+        assert total == expected[1]
+        assert maximum.dtype == expected[2].dtype
+        np.testing.assert_equal(maximum, expected[2])
+
+
+def test_find_patch_peaks_zero_weight():
+    # with a negative threshold, blobs can have no weight
+    patches = [np.zeros((2, 3, 4)), np.ones((2, 3, 4))]
+    patches[1][0, 0, 0] = -1
+    label_struct = ndimage.generate_binary_structure(3, 3)
+    peaks = hedm_instrument._find_patch_peaks(patches, patches, -2, label_struct)
+    for patch, peak in zip(patches, peaks):
+        with np.errstate(invalid='ignore', divide='ignore'):
+            expected = find_patch_peak(patch, patch, -2, label_struct)
+        np.testing.assert_equal(peak[0], expected[0])
+        assert peak[1] == expected[1]
+        assert peak[2] == expected[2]
@@ -0,0 +1,133 @@
+import numpy as np
+import pytest
+
+from hexrd.core.projections import polar
+from hexrd.core.projections.coordinate_map_cache import CoordinateMapCache
+from hexrd.core.projections.polar import PolarView
+
+
+@pytest.fixture
+def instr_binning():
+    return 16
+
+
+@pytest.fixture
+def img_dict(instr):
+    rng = np.random.default_rng(0)
+    return {k: 100 * rng.random(panel.shape) for k, panel in instr.detectors.items()}
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    cache = CoordinateMapCache()
+    monkeypatch.setattr(polar, 'coordinate_map_cache', cache)
+    return cache
+
+
+def make_polar_view(instr, **kwargs):
+    return PolarView([2.0, 12.0], instr, -180.0, 180.0, (0.1, 1.0), **kwargs)
+
+
+def reference_warp(pv, img_dict):
+    # warp with a freshly generated map
+    mapping, nan_mask = pv._generate_coordinate_map()
+    return pv._warp_image_from_coordinate_map(
+        img_dict, mapping, nan_mask, pad_with_nans=True
+    ).filled(np.nan)
+
+
+def assert_same_warp(pv, img_dict):
+    img = pv.warp_image(img_dict, pad_with_nans=True).filled(np.nan)
+    ref = reference_warp(pv, img_dict)
+    assert np.any(np.isnan(ref))
+    assert np.array_equal(img, ref, equal_nan=True)
+
+
+def test_warp_image_cached(instr, img_dict, cache):
+    pv = make_polar_view(instr)
+    assert_same_warp(pv, img_dict)
+    assert cache.cache_info()['misses'] == 1
+
+    # another polar view of the same geometry reuses the map
+    pv2 = make_polar_view(instr, cache_coordinate_map=True)
+    assert_same_warp(pv2, img_dict)
+    assert cache.cache_info()['misses'] == 1
+    assert cache.cache_info()['hits'] == 1
+
+    # the result can be modified without touching the cache
+    img = pv2.warp_image(img_dict)
+    img[:] = 0
+    img.mask[:] = False
+    assert_same_warp(pv2, img_dict)
+
+
+@pytest.mark.parametrize('cache_coordinate_map', [False, True])
+def test_geometry_changes(instr, img_dict, cache, cache_coordinate_map):
+    pv = make_polar_view(instr, cache_coordinate_map=cache_coordinate_map)
+    keys = {pv.coordinate_map_key()}
+    assert_same_warp(pv, img_dict)
+
+    panel = next(iter(instr.detectors.values()))
+    panel.tvec = panel.tvec + [0.5, 0.0, 0.0]
+    keys.add(pv.coordinate_map_key())
+    assert_same_warp(pv, img_dict)
+
+    panel.panel_buffer = np.array([2.0, 2.0])
+    keys.add(pv.coordinate_map_key())
+    assert_same_warp(pv, img_dict)
+
+    pv.eta_pixel_size = 2.0
+    keys.add(pv.coordinate_map_key())
+    assert_same_warp(pv, img_dict)
+
+    assert len(keys) == 4
+    assert cache.cache_info()['misses'] == 4
+
+
+def test_memory_bound(instr, img_dict, cache):
+    pv = make_polar_view(instr)
+    pv.warp_image(img_dict)
+    nbytes = cache.cache_info()['nbytes']
+    assert nbytes > 0
+
+    # only the most recent map fits
+    cache.max_memory_bytes = nbytes
+    pv.tth_pixel_size = 0.2
+    pv.warp_image(img_dict)
+    assert cache.cache_info()['currsize'] == 1
+    pv.tth_pixel_size = 0.1
+    pv.warp_image(img_dict)
+    assert cache.cache_info()['misses'] == 3
+
+
+def test_disk_store(instr, img_dict, cache, tmp_path, monkeypatch):
+    cache.directory = tmp_path
+    pv = make_polar_view(instr)
+    expected = pv.warp_image(img_dict).filled(np.nan)
+    key = pv.coordinate_map_key()
+    assert [p.name for p in tmp_path.iterdir()] == [f'{key}.npz']
+
+    # a new process loads the map from disk
+    cache = CoordinateMapCache(directory=tmp_path)
+    monkeypatch.setattr(polar, 'coordinate_map_cache', cache)
+    img = pv.warp_image(img_dict).filled(np.nan)
+    assert np.array_equal(img, expected, equal_nan=True)
+    assert cache.cache_info()['disk_hits'] == 1
+    assert cache.cache_info()['misses'] == 0
+
+    # broken files are generated again
+    cache.clear()
+    path = tmp_path / f'{key}.npz'
+    path.write_bytes(path.read_bytes()[:1000])
+    img = pv.warp_image(img_dict).filled(np.nan)
+    assert np.array_equal(img, expected, equal_nan=True)
+    assert cache.cache_info()['misses'] == 1
+
+    # the least recently used files are evicted
+    cache.max_disk_bytes = path.stat().st_size
+    pv.tth_pixel_size = 0.2
+    pv.warp_image(img_dict)
+    assert [p.name for p in tmp_path.iterdir()] == [f'{pv.coordinate_map_key()}.npz']
+
+    cache.clear(disk=True)
+    assert not list(tmp_path.iterdir())
@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+
+from hexrd.core.projections import polar
+from hexrd.core.projections.polar import PolarView, bin_polar_view
+
+
+@pytest.fixture
+def instr_binning():
+    return 16
+
+
+@pytest.fixture
+def stack_dict(instr):
+    rng = np.random.default_rng(0)
+    stacks = {}
+    for det_key, panel in instr.detectors.items():
+        stack = 100 * rng.random((7,) + panel.shape)
+        stack[2, 10:14, 20:30] = np.nan
+        stacks[det_key] = stack
+    return stacks
+
+
+@pytest.fixture
+def pv(instr):
+    return PolarView([2.0, 12.0], instr, -180.0, 180.0, (0.1, 1.0))
+
+
+@pytest.mark.parametrize('max_workers', [1, 2])
+@pytest.mark.parametrize('pad_with_nans', [False, True])
+@pytest.mark.parametrize('do_interpolation', [False, True])
+def test_warp_image_stack(
+    instr, pv, stack_dict, monkeypatch, max_workers, pad_with_nans, do_interpolation
+):
+    instr.max_workers = max_workers
+    monkeypatch.setattr(polar, 'polar_warp_block_size', 3)
+    kwargs = dict(pad_with_nans=pad_with_nans, do_interpolation=do_interpolation)
+    imgs = pv.warp_image(stack_dict, **kwargs)
+    assert imgs.shape == (7,) + pv.shape
+    for i, img in enumerate(imgs):
+        expected = pv.warp_image({k: v[i] for k, v in stack_dict.items()}, **kwargs)
+        assert np.array_equal(img.mask, expected.mask)
+        assert np.array_equal(img.data, expected.data, equal_nan=True)
+    assert np.any(np.isnan(imgs[2].data) & ~imgs[2].mask)
+
+
+def test_warp_operator_is_cached(instr, pv, stack_dict):
+    pv.warp_image(stack_dict)
+    operator = pv._warp_operator
+    pv.warp_image(stack_dict)
+    assert pv._warp_operator is operator
+
+    # rebuilt for a new geometry
+    panel = next(iter(instr.detectors.values()))
+    panel.tvec = panel.tvec + [0.5, 0.0, 0.0]
+    imgs = pv.warp_image(stack_dict)
+    assert pv._warp_operator is not operator
+    expected = pv.warp_image({k: v[0] for k, v in stack_dict.items()})
+    assert np.array_equal(imgs[0].data, expected.data)
+
+
+def test_bin_polar_view_stack(pv, stack_dict):
+    imgs = pv.warp_image(stack_dict, pad_with_nans=True)
+    binned = bin_polar_view(pv, imgs, 30.0, 5.0)
+    assert binned.shape == (7, 11, pv.ntth)
+    for img, lineouts in zip(imgs, binned):
+        expected = bin_polar_view(pv, img, 30.0, 5.0)
+        assert np.array_equal(lineouts, expected, equal_nan=True)
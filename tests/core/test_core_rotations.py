@@ -398,6 +398,31 @@ def test_quatAverageCluster_coverage(rot_90z_quat):
     assert np.allclose(res3, rot_90z_quat)
 
 
+def test_quatAverageClusters():
+    rng = np.random.default_rng(0)
+    qsym = rotations.quatOfLaueGroup('d6h')
+    q = rng.normal(size=(4, 500))
+    q /= np.linalg.norm(q, axis=0)
+    # noise, singletons, pairs and larger clusters
+    cl = rng.integers(-1, 60, 500)
+    cl[:2] = 100
+    cl[2] = 101
+
+    res = rotations.quatAverageClusters(q, cl, qsym)
+    labels = np.unique(cl[cl >= 0])
+    assert res.shape == (4, len(labels))
+
+    orig_exp_map = rotations.quatOfExpMap
+
+    def fixed_exp_map(q):
+        return orig_exp_map(q).reshape(4, 1)
+
+    with patch('hexrd.core.rotations.quatOfExpMap', side_effect=fixed_exp_map):
+        for i, label in enumerate(labels):
+            expected = rotations.quatAverageCluster(q[:, cl == label], qsym)
+            assert np.allclose(res[:, i], expected.flatten())
+
+
 # --- Fiber Utilities ---
 
 
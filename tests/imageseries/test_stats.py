@@ -110,3 +110,40 @@ class TestImageSeriesStats(ImageSeriesTest):
         self.assertAlmostEqual(
             err, 0.0, msg="stats.average failed (3 chunks, no buffer)"
         )
+
+    def test_stats_multi(self):
+        """imageseries.stats: several statistics from one read"""
+        a, is_a = make_array_ims()
+        for nchunks in (1, 2):
+            for names in (['max', 'min', 'mean'], ['median', 'max', 'mean', 90]):
+                imgs = stats.multi(is_a, names, nchunks=nchunks, max_workers=2)
+                self.assertEqual(set(imgs), set(names))
+                self.assertTrue(np.array_equal(imgs['max'], np.max(a, axis=0)))
+                self.assertEqual(imgs['max'].dtype, is_a.dtype)
+                np.testing.assert_allclose(imgs['mean'], np.mean(a, axis=0))
+                if 'min' in imgs:
+                    self.assertTrue(np.array_equal(imgs['min'], a.min(axis=0)))
+                if 90 in imgs:
+                    np.testing.assert_allclose(
+                        imgs['median'], np.median(a, axis=0)
+                    )
+                    np.testing.assert_allclose(
+                        imgs[90], np.percentile(a, 90, axis=0)
+                    )
+
+        with self.assertRaises(ValueError):
+            stats.multi(is_a, ['mode'])
+
+    def test_stats_multi_empty(self):
+        """imageseries.stats: statistics of an empty imageseries"""
+
+        class Empty:
+            shape = (4, 5)
+            dtype = np.dtype(float)
+
+            def __len__(self):
+                return 0
+
+        for names in (['median'], ['max']):
+            with self.assertRaises(ValueError):
+                stats.multi(Empty(), names)
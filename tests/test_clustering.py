@@ -0,0 +1,97 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from hexrd.core import rotations as rot
+from hexrd.core.transforms import xfcapi
+from hexrd.hedm import findorientations
+
+
+@pytest.fixture
+def qsym():
+    return rot.quatOfLaueGroup('oh')
+
+
+@pytest.fixture
+def grains():
+    rng = np.random.default_rng(0)
+    q = rng.normal(size=(4, 12))
+    return q / np.linalg.norm(q, axis=0)
+
+
+@pytest.fixture
+def quats(grains, qsym):
+    # scatter up to 0.25 degrees about each grain, with random symmetric
+    # equivalents and signs
+    rng = np.random.default_rng(1)
+    n = 300
+    ax = rng.normal(size=(3, n))
+    ax /= np.linalg.norm(ax, axis=0)
+    ang = np.radians(0.25 * rng.random(n))
+    dq = np.vstack([np.cos(0.5 * ang), np.sin(0.5 * ang) * ax])
+    q = rot.quatProduct(grains[:, np.arange(n) % grains.shape[1]], dq)
+    q = np.hstack(
+        [
+            rot.quatProduct(qsym[:, [j]], q[:, [i]])
+            for i, j in enumerate(rng.integers(0, qsym.shape[1], n))
+        ]
+    )
+    q *= rng.choice([-1, 1], n)
+    # exact duplicates
+    q[:, :3] = q[:, 3:6]
+    return q
+
+
+def make_cfg(algorithm, radius):
+    clustering = SimpleNamespace(algorithm=algorithm, radius=radius, completeness=0.5)
+    find_orientations = SimpleNamespace(clustering=clustering, use_quaternion_grid=None)
+    return SimpleNamespace(find_orientations=find_orientations, multiprocessing=1)
+
+
+def test_misorientation_graph(quats, qsym):
+    radius = np.radians(0.5)
+    qsym = np.array(qsym.T, order='C').T
+    graph = findorientations._misorientation_graph(quats, qsym, radius)
+
+    n = quats.shape[1]
+    expected = np.array(
+        [
+            [
+                xfcapi.quat_distance(quats[:, i].copy(), quats[:, j].copy(), qsym)
+                for j in range(n)
+            ]
+            for i in range(n)
+        ]
+    )
+    mask = np.zeros((n, n), dtype=bool)
+    coo = graph.tocoo()
+    mask[coo.row, coo.col] = True
+    assert np.array_equal(mask, expected <= radius)
+    assert np.allclose(graph.toarray()[mask], expected[mask], atol=1e-7)
+
+
+@pytest.mark.parametrize('algorithm', ['sph-dbscan', 'fclusterdata'])
+def test_run_cluster(quats, grains, qsym, algorithm):
+    compl = np.ones(quats.shape[1])
+    qbar, cl = findorientations.run_cluster(
+        compl, quats, qsym, make_cfg(algorithm, 1.0), min_samples=2
+    )
+    assert qbar.shape == grains.shape
+    assert len(np.unique(cl)) == grains.shape[1]
+    for q in grains.T:
+        dist = [xfcapi.quat_distance(q.copy(), qb.copy(), qsym) for qb in qbar.T]
+        assert np.min(dist) < np.radians(0.25)
+
+
+def test_run_cluster_merges_duplicates(quats, grains, qsym):
+    # euclidean DBSCAN splits grains into their symmetric equivalents,
+    # which the duplicate check merges back together
+    compl = np.ones(quats.shape[1])
+    qbar, cl = findorientations.run_cluster(
+        compl, quats, qsym, make_cfg('dbscan', 1.0), min_samples=2
+    )
+    assert qbar.shape == grains.shape
+    for q in grains.T:
+        dist = [xfcapi.quat_distance(q.copy(), qb.copy(), qsym) for qb in qbar.T]
+        assert np.min(dist) < np.radians(0.25)
@@ -0,0 +1,128 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from hexrd.core import imageseries
+from hexrd.core.imageseries.omega import OmegaImageSeries
+from hexrd.hedm import fitgrains
+
+
+@pytest.fixture
+def cfg(instr, plane_data, tmp_path):
+    # blobs at the simulated spots of a few grains
+    rng = np.random.default_rng(2)
+    params = np.zeros((5, 12))
+    params[:, :3] = rng.normal(size=(5, 3))
+    params[:, 3:6] = 0.01 * rng.normal(size=(5, 3))
+    params[:, 6:9] = 1
+    nframes = 120
+    omegas = -60 + np.vstack([np.arange(nframes), np.arange(1, nframes + 1)]).T
+    sim = instr.simulate_rotation_series(
+        plane_data,
+        params,
+        ome_ranges=[np.radians([-60, 60])],
+        ome_period=np.radians([-60, 300]),
+    )
+    imsd = {}
+    for det_key, panel in instr.detectors.items():
+        data = np.zeros((nframes, panel.rows, panel.cols))
+        for angs, xys in zip(sim[det_key][2], sim[det_key][3]):
+            frames = np.floor(np.mod(np.degrees(angs[:, 2]) + 60, 360)).astype(int)
+            for (i, j), f in zip(panel.cartToPixel(xys).astype(int), frames):
+                if not 0 < f < nframes - 1:
+                    continue
+                if 0 < i < panel.rows - 1 and 0 < j < panel.cols - 1:
+                    data[f - 1 : f + 2, i - 1 : i + 2, j - 1 : j + 2] += 30
+                    data[f, i, j] += 70
+        ims = imageseries.open(None, 'array', data=data, meta={'omega': omegas})
+        imsd[det_key] = OmegaImageSeries(ims)
+
+    tolerance = SimpleNamespace(tth=[1.0], eta=[2.0], omega=[3.0])
+    return SimpleNamespace(
+        image_series=imsd,
+        instrument=SimpleNamespace(hedm=instr),
+        material=SimpleNamespace(plane_data=plane_data),
+        find_orientations=SimpleNamespace(
+            eta=SimpleNamespace(range=[[-85, 85], [95, 265]])
+        ),
+        fit_grains=SimpleNamespace(
+            threshold=20, tolerance=tolerance, npdiv=2, refit=None
+        ),
+        multiprocessing=1,
+        analysis_dir=tmp_path,
+    )
+
+
+@pytest.fixture
+def grains_table(cfg):
+    rng = np.random.default_rng(2)
+    table = np.zeros((5, 15))
+    table[:, 0] = np.arange(5)
+    table[:, 3:6] = rng.normal(size=(5, 3))
+    table[:, 6:9] = 0.01 * rng.normal(size=(5, 3)) + 0.001
+    table[:, 9:12] = 1
+    # too few reflections to fit this one
+    table[4, 6:9] = 10
+    return table
+
+
+def assert_same_fits(results, expected):
+    assert len(results) == len(expected)
+    for result, ref in zip(results, expected):
+        assert result[0] == ref[0]
+        # the checkpoint keeps 6 decimals of completeness and 7 digits of chisq
+        np.testing.assert_allclose(result[1], ref[1], rtol=0, atol=1e-6)
+        np.testing.assert_allclose(result[2], ref[2], rtol=1e-6)
+        np.testing.assert_array_equal(result[3], ref[3])
+
+
+def test_fit_grains_pool(cfg, grains_table, tmp_path):
+    expected = fitgrains.fit_grains(cfg, grains_table, write_spots_files=False)
+    assert [r[0] for r in expected] == list(range(5))
+    assert np.isinf(expected[4][2])
+    assert np.all(np.isfinite([r[2] for r in expected[:4]]))
+
+    cfg.multiprocessing = 2
+    checkpoint = tmp_path / 'grains-checkpoint.out'
+    results = fitgrains.fit_grains(
+        cfg, grains_table, write_spots_files=False, checkpoint_filename=checkpoint
+    )
+    assert_same_fits(results, expected)
+
+    # every fit is in the checkpoint
+    fits = fitgrains.read_fit_checkpoint(checkpoint)
+    assert_same_fits([fits[i] for i in range(5)], expected)
+
+
+def test_fit_grains_resume(cfg, grains_table, tmp_path, monkeypatch):
+    checkpoint = tmp_path / 'grains-checkpoint.out'
+    expected = fitgrains.fit_grains(
+        cfg, grains_table, write_spots_files=False, checkpoint_filename=checkpoint
+    )
+
+    # interrupt the run after two grains, in the middle of a third
+    lines = checkpoint.read_text().splitlines(keepends=True)
+    checkpoint.write_text(''.join(lines[:3]) + lines[3][:40])
+    fitted = [int(line.split()[0]) for line in lines[1:3]]
+
+    calls = []
+    fit_grain = fitgrains.fit_grain_FF_reduced
+
+    def fit_grain_FF_reduced(grain_id):
+        calls.append(grain_id)
+        return fit_grain(grain_id)
+
+    monkeypatch.setattr(fitgrains, 'fit_grain_FF_reduced', fit_grain_FF_reduced)
+    results = fitgrains.fit_grains(
+        cfg,
+        grains_table,
+        write_spots_files=False,
+        checkpoint_filename=checkpoint,
+        resume=True,
+    )
+    assert sorted(calls + fitted) == list(range(5))
+    assert_same_fits(results, expected)
+
+    fits = fitgrains.read_fit_checkpoint(checkpoint)
+    assert_same_fits([fits[i] for i in range(5)], expected)
@@ -0,0 +1,146 @@
+import numpy as np
+import pytest
+from scipy import optimize
+
+from hexrd.hedm.fitting import grains
+
+
+@pytest.fixture
+def instr_binning():
+    return 1
+
+
+@pytest.fixture(params=[False, True], ids=['', 'energy_correction'])
+def instr(instr, request):
+    if request.param:
+        instr.energy_correction = dict(intercept=0.0, slope=-0.5, axis='y')
+    return instr
+
+
+@pytest.fixture
+def grain_fits(instr, plane_data):
+    # noisy spots of strained grains, and starting points away from them
+    rng = np.random.default_rng(1)
+    ngrains = 6
+    params = np.zeros((ngrains, 12))
+    params[:, :3] = rng.normal(size=(ngrains, 3))
+    params[:, 3:6] = 0.1 * rng.normal(size=(ngrains, 3))
+    params[:, 6:9] = 1 + 1e-3 * rng.normal(size=(ngrains, 3))
+    params[:, 9:] = 1e-3 * rng.normal(size=(ngrains, 3))
+    sim = instr.simulate_rotation_series(
+        plane_data,
+        params,
+        ome_ranges=[np.radians([-180, 180])],
+        ome_period=np.radians([-180, 180]),
+    )
+    reflections = []
+    for i in range(ngrains):
+        reflections_dict = {}
+        for det_key in instr.detectors:
+            hkls, angs, xys = (sim[det_key][j][i] for j in (1, 2, 3))
+            meas_xyo = np.c_[
+                xys + 0.05 * rng.normal(size=xys.shape),
+                angs[:, 2] + 1e-3 * rng.normal(size=len(angs)),
+            ]
+            reflections_dict[det_key] = dict(hkls=hkls.T, meas_xyo=meas_xyo)
+        reflections.append(reflections_dict)
+
+    start = params.copy()
+    start[:, :3] += 1e-3 * rng.normal(size=(ngrains, 3))
+    start[:, 3:6] += 0.05 * rng.normal(size=(ngrains, 3))
+    start[:, 6:] = grains.vInv_ref
+    return start, reflections
+
+
+def obj_func(params, instr, reflections_dict, plane_data):
+    return grains.objFuncFitGrain(
+        params,
+        params,
+        grains.gFlag_ref,
+        instr,
+        reflections_dict,
+        plane_data.latVecOps['B'],
+        plane_data.wavelength,
+        None,
+    )
+
+
+def reference_fit(params, instr, reflections_dict, plane_data):
+    # the least-squares fit with the finite difference Jacobian
+    result = optimize.leastsq(
+        obj_func,
+        params,
+        args=(instr, reflections_dict, plane_data),
+        factor=0.1,
+        xtol=grains.sqrt_epsf,
+        ftol=grains.sqrt_epsf,
+    )
+    return result[0]
+
+
+def cost(params, instr, reflections_dict, plane_data):
+    return np.sum(obj_func(params, instr, reflections_dict, plane_data) ** 2)
+
+
+def test_residuals_and_jacobian(instr, plane_data, grain_fits):
+    start, reflections = grain_fits
+    refls = grains._GrainReflections(
+        instr, reflections, plane_data.latVecOps['B'], plane_data.wavelength
+    )
+    for i, params in enumerate(start[:2]):
+        resid, jac = refls.residuals(params, i)
+        expected = obj_func(params, instr, reflections[i], plane_data)
+        np.testing.assert_allclose(resid.ravel(), expected, rtol=0, atol=1e-10)
+
+        jac = jac.reshape(-1, 12)
+        for k in range(12):
+            step = np.zeros(12)
+            step[k] = 1e-7
+            fd = (
+                obj_func(params + step, instr, reflections[i], plane_data)
+                - obj_func(params - step, instr, reflections[i], plane_data)
+            ) / 2e-7
+            np.testing.assert_allclose(
+                jac[:, k], fd, rtol=0, atol=1e-5 * np.abs(fd).max()
+            )
+
+
+def test_fit_grain(instr, plane_data, grain_fits):
+    start, reflections = grain_fits
+    for params, reflections_dict in zip(start, reflections):
+        expected = reference_fit(params, instr, reflections_dict, plane_data)
+        fit = grains.fitGrain(
+            params.copy(),
+            instr,
+            reflections_dict,
+            plane_data.latVecOps['B'],
+            plane_data.wavelength,
+        )
+        np.testing.assert_allclose(fit, expected, rtol=0, atol=1e-4)
+        # the fits converge at least as far as the reference ones
+        ref_cost = cost(expected, instr, reflections_dict, plane_data)
+        assert cost(fit, instr, reflections_dict, plane_data) < ref_cost * (1 + 1e-6)
+
+
+def test_fit_grains(instr, plane_data, grain_fits):
+    start, reflections = grain_fits
+    args = (instr, reflections, plane_data.latVecOps['B'], plane_data.wavelength)
+    fits = grains.fitGrains(start, *args)
+    assert fits.shape == start.shape
+    for params, fit, reflections_dict in zip(start, fits, reflections):
+        expected = grains.fitGrain(params.copy(), instr, reflections_dict, *args[2:])
+        np.testing.assert_allclose(fit, expected, rtol=0, atol=1e-4)
+        # the fits converge at least as far as the reference ones
+        ref_cost = cost(expected, instr, reflections_dict, plane_data)
+        assert cost(fit, instr, reflections_dict, plane_data) < ref_cost * (1 + 1e-6)
+
+    # only the flagged parameters are refined
+    gFlag = np.ones(12, dtype=bool)
+    gFlag[6:] = False
+    fits = grains.fitGrains(start, *args, gFlag=gFlag)
+    np.testing.assert_array_equal(fits[:, 6:], start[:, 6:])
+    for params, fit, reflections_dict in zip(start, fits, reflections):
+        expected = grains.fitGrain(
+            params.copy(), instr, reflections_dict, *args[2:], gFlag=gFlag
+        )
+        np.testing.assert_allclose(fit, expected, rtol=0, atol=1e-4)
@@ -218,3 +218,97 @@ def test_memoize():
     for i in range(maxsize):
         run(i)
         assert not was_memoized()
+
+
+def test_memoize_maxbytes():
+    calls = []
+
+    @memoize(maxsize=None, maxbytes=100)
+    def zeros(n):
+        calls.append(n)
+        return np.zeros(n, dtype=np.uint8), np.zeros(n, dtype=np.uint8)
+
+    zeros(20)
+    zeros(20)
+    assert calls == [20]
+    assert zeros.cache_info()['nbytes'] == 40
+
+    # the least recently used items are removed to stay under the bound
+    zeros(30)
+    assert zeros.cache_info()['nbytes'] == 100
+    zeros(20)
+    zeros(10)
+    assert calls == [20, 30, 10]
+    assert zeros.cache_info()['nbytes'] == 60
+    zeros(15)
+    assert zeros.cache_info()['currsize'] == 3
+    zeros(30)
+    assert calls == [20, 30, 10, 15, 30]
+    assert zeros.cache_info()['currsize'] == 2
+    assert zeros.cache_info()['nbytes'] == 90
+    zeros(15)
+    assert len(calls) == 5
+
+    # outputs over the bound are not cached
+    zeros(60)
+    zeros(60)
+    assert calls[-2:] == [60, 60]
+    assert zeros.cache_info()['nbytes'] == 90
+
+    zeros.set_cache_maxbytes(60)
+    assert zeros.cache_info()['currsize'] == 1
+    assert zeros.cache_info()['nbytes'] == 30
+
+    zeros.cache_clear()
+    assert zeros.cache_info()['currsize'] == 0
+    assert zeros.cache_info()['nbytes'] == 0
+
+
+def test_memoize_key():
+    calls = []
+
+    def key(data, version=None):
+        return version
+
+    @memoize(maxsize=4, key=key)
+    def total(data, version=None):
+        calls.append(version)
+        return data.sum()
+
+    data = np.arange(10)
+    assert total(data, version=1) == 45
+    # the key replaces the hashing of the arguments
+    data[0] = 10
+    assert total(data, version=1) == 45
+    assert total(data, version=2) == 55
+    assert calls == [1, 2]
+
+    # without a key, the arguments are hashed
+    assert total(data) == 55
+    data[0] = 0
+    assert total(data) == 45
+    assert calls == [1, 2, None, None]
+    assert total.cache_info()['hits'] == 1
+    assert total.cache_info()['misses'] == 4
+
+
+def test_memoize_group():
+    def group(data, owner, version):
+        return (owner, version)
+
+    @memoize(maxsize=None, group=group)
+    def scaled(data, owner, version):
+        return data * version
+
+    data = np.arange(4)
+    scaled(data, 'a', 1)
+    scaled(data + 1, 'a', 1)
+    scaled(data, 'b', 1)
+    assert scaled.cache_info()['currsize'] == 3
+
+    # the other versions of the group are removed
+    scaled(data, 'a', 2)
+    assert scaled.cache_info()['currsize'] == 2
+    assert scaled.cache_info()['nbytes'] == 2 * data.nbytes
+    scaled(data, 'b', 1)
+    assert scaled.cache_info()['hits'] == 1
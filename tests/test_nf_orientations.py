@@ -0,0 +1,277 @@
+import argparse
+
+import h5py
+import numpy as np
+import pytest
+
+from hexrd.core import rotations
+from hexrd.core.material.material import Material
+from hexrd.hedm.grainmap import nfutil
+from skimage.morphology import dilation
+
+
+@pytest.fixture
+def experiment(test_data_dir):
+    # a small near field detector, 6 mm downstream of the sample
+    mat = Material('Si', str(test_data_dir / 'materials' / 'Si.cif'), sgsetting=0)
+    pd = mat.planeData
+    pd.wavelength = 61.332
+    pd.exclusions = None
+    pd.tThMax = np.radians(12)
+
+    ncols = nrows = 160
+    pixel_size = (0.0125, 0.0125)
+    nframes = 90
+    ome_range = [(0.0, 2 * np.pi)]
+    x_col_edges = pixel_size[1] * (np.arange(ncols + 1) - 0.5 * ncols)
+    y_row_edges = pixel_size[0] * (np.arange(nrows + 1) - 0.5 * nrows)
+    ome_edges = np.linspace(*ome_range[0], nframes + 1)
+    tVec_d = np.array([0.0, 0.0, -6.0])
+    tVec_s = np.zeros(3)
+
+    rng = np.random.default_rng(0)
+    exp_maps = rng.normal(size=(5, 3))
+
+    experiment = argparse.Namespace()
+    experiment.n_grains = len(exp_maps)
+    experiment.rMat_c = rotations.rotMatOfExpMap(exp_maps.T)
+    experiment.exp_maps = exp_maps
+    experiment.plane_data = pd
+    experiment.detector_params = np.hstack([np.zeros(3), tVec_d, 0.0, tVec_s])
+    experiment.pixel_size = pixel_size
+    experiment.ome_range = ome_range
+    experiment.ome_period = ome_range[0]
+    experiment.ome_edges = ome_edges
+    experiment.ncols = ncols
+    experiment.nrows = nrows
+    experiment.nframes = nframes
+    experiment.rMat_d = np.eye(3)
+    experiment.tVec_d = tVec_d
+    experiment.chi = 0.0
+    experiment.tVec_s = tVec_s
+    experiment.distortion = None
+    experiment.base = np.array([x_col_edges[0], y_row_edges[0], ome_edges[0]])
+    experiment.inv_deltas = 1.0 / np.array(
+        [pixel_size[1], pixel_size[0], ome_edges[1] - ome_edges[0]]
+    )
+    experiment.clip_vals = np.array([ncols, nrows])
+    experiment.bsp = np.array([0.0, 0.05])
+    experiment.row_dilation = 1
+    experiment.col_dilation = 1
+    return experiment
+
+
+@pytest.fixture
+def test_crds():
+    xs = np.linspace(-0.2, 0.2, 9)
+    Xs, Zs = np.meshgrid(xs, xs)
+    return np.vstack([Xs.ravel(), np.zeros(Xs.size), Zs.ravel()]).T
+
+
+@pytest.fixture
+def grain_crds():
+    # the coords where the grains are
+    return [0, 13, 40, 67, 80]
+
+
+@pytest.fixture
+def image_stack(experiment, test_crds, grain_crds):
+    controller = make_controller()
+    grain_params = np.hstack(
+        [
+            experiment.exp_maps,
+            test_crds[grain_crds],
+            np.tile(nfutil.vInv_ref.ravel(), (experiment.n_grains, 1)),
+        ]
+    )
+    image_stack = nfutil.simulate_diffractions(grain_params, experiment, controller)
+    image_stack = nfutil.dilate_image_stack(image_stack, experiment, controller)
+    # the orientations are tested against an unpacked stack of binary images
+    return np.unpackbits(image_stack, axis=-1).astype(bool)
+
+
+def make_controller(ncpus=1, chunk_size=5):
+    return nfutil.ProcessController(
+        nfutil.forgetful_result_handler(),
+        nfutil.null_progress_observer(),
+        ncpus=ncpus,
+        chunk_size=chunk_size,
+    )
+
+
+@pytest.mark.parametrize('ncpus', [1, 2])
+def test_orientations_tiled(
+    experiment, test_crds, grain_crds, image_stack, tmp_path, ncpus
+):
+    expected = nfutil.test_orientations(
+        image_stack, experiment, test_crds, make_controller()
+    )
+    # the grains are found where they are
+    assert np.all(np.argmax(expected[:, grain_crds], axis=0) == np.arange(5))
+
+    filename = tmp_path / 'confidence.h5'
+    confidence_map, grain_map = nfutil.test_orientations_tiled(
+        image_stack,
+        experiment,
+        test_crds,
+        make_controller(ncpus),
+        filename,
+        tile_size=12,
+    )
+    np.testing.assert_array_equal(confidence_map, np.max(expected, axis=0))
+    np.testing.assert_array_equal(grain_map, np.argmax(expected, axis=0))
+    with h5py.File(filename, 'r') as f:
+        np.testing.assert_array_equal(f['confidence'][()], expected)
+        # the tile size is rounded to whole chunks
+        assert f.attrs['tile_size'] == 15
+        assert np.all(f['tiles_done'][()])
+
+    expected_maps = nfutil.process_raw_confidence(expected, (9, 9), min_thresh=0.5)
+    maps = nfutil.process_confidence_maps(
+        confidence_map, grain_map, (9, 9), min_thresh=0.5
+    )
+    for x, y in zip(maps, expected_maps):
+        np.testing.assert_array_equal(x, y)
+
+
+def test_orientations_tiled_resume(
+    experiment, test_crds, image_stack, tmp_path, monkeypatch
+):
+    filename = tmp_path / 'confidence.h5'
+    args = (image_stack, experiment, test_crds, make_controller(), filename)
+    expected = nfutil.test_orientations_tiled(*args, tile_size=20)
+
+    # forget some tiles, as if the run had been interrupted
+    with h5py.File(filename, 'a') as f:
+        f['tiles_done'][1:3] = False
+        f['confidence'][:, 20:60] = 0
+        f['confidence_map'][20:60] = 0
+        f['grain_map'][20:60] = -1
+        confidence = f['confidence'][()]
+
+    chunks = []
+    grand_loop_inner = nfutil._grand_loop_inner
+
+    def _grand_loop_inner(*args, start, stop):
+        chunks.append((start, stop))
+        return grand_loop_inner(*args, start=start, stop=stop)
+
+    monkeypatch.setattr(nfutil, '_grand_loop_inner', _grand_loop_inner)
+    result = nfutil.test_orientations_tiled(*args, tile_size=20, resume=True)
+    assert sorted(chunks) == [(i, i + 5) for i in range(20, 60, 5)]
+    for x, y in zip(result, expected):
+        np.testing.assert_array_equal(x, y)
+    with h5py.File(filename, 'r') as f:
+        confidence[:, 20:60] = f['confidence'][:, 20:60]
+        np.testing.assert_array_equal(f['confidence'][()], confidence)
+        assert np.all(f['tiles_done'][()])
+
+    # a file for another set of coords can't be resumed
+    with pytest.raises(ValueError):
+        nfutil.test_orientations_tiled(
+            image_stack,
+            experiment,
+            test_crds[:50],
+            make_controller(),
+            filename,
+            tile_size=20,
+            resume=True,
+        )
+
+
+@pytest.mark.parametrize('ncpus', [1, 2])
+@pytest.mark.parametrize('subsample', [1, 3])
+def test_orientations_pruned(
+    experiment, test_crds, grain_crds, image_stack, ncpus, subsample
+):
+    expected = nfutil.test_orientations(
+        image_stack, experiment, test_crds, make_controller()
+    )
+    # with all the grains as candidates, the best grains are the same
+    confidence_map, grain_map = nfutil.test_orientations_pruned(
+        image_stack,
+        experiment,
+        test_crds,
+        make_controller(ncpus),
+        top_k=experiment.n_grains,
+        subsample=subsample,
+    )
+    np.testing.assert_array_equal(confidence_map, np.max(expected, axis=0))
+    np.testing.assert_array_equal(grain_map, np.argmax(expected, axis=0))
+
+    # the grains are still found with few candidates
+    confidence_map, grain_map = nfutil.test_orientations_pruned(
+        image_stack,
+        experiment,
+        test_crds,
+        make_controller(ncpus),
+        top_k=2,
+        subsample=subsample,
+        min_confidence=0.5,
+    )
+    np.testing.assert_array_equal(grain_map[grain_crds], np.arange(5))
+    np.testing.assert_array_equal(confidence_map[grain_crds], 1.0)
+    indexed = np.max(expected, axis=0) >= 0.5
+    assert np.all(grain_map[~indexed] == -1)
+    assert np.all(confidence_map[~indexed] == 0)
+    np.testing.assert_array_equal(
+        confidence_map[indexed], np.max(expected, axis=0)[indexed]
+    )
+
+
+def dilate_reference(image_stack, row_dilation, col_dilation):
+    # the original unpack, dilate and repack of each image
+    footprint = np.ones((2 * row_dilation + 1, 2 * col_dilation + 1), dtype=np.uint8)
+    return np.array(
+        [
+            np.packbits(dilation(np.unpackbits(image, axis=-1), footprint), axis=-1)
+            for image in image_stack
+        ]
+    )
+
+
+@pytest.mark.parametrize('row_dilation, col_dilation', [(0, 0), (1, 2), (3, 9)])
+def test_dilate_image_stack(experiment, row_dilation, col_dilation):
+    rng = np.random.default_rng(4)
+    image_stack = np.packbits(rng.random((7, 37, 45)) > 0.98, axis=-1)
+    experiment.row_dilation = row_dilation
+    experiment.col_dilation = col_dilation
+    dilated = nfutil.dilate_image_stack(image_stack, experiment, make_controller())
+    np.testing.assert_array_equal(
+        dilated, dilate_reference(image_stack, row_dilation, col_dilation)
+    )
+
+
+def test_dilated_image_stack_cache(experiment, tmp_path, monkeypatch):
+    rng = np.random.default_rng(4)
+    image_stack = np.packbits(rng.random((7, 37, 45)) > 0.98, axis=-1)
+    cache_file = str(tmp_path / 'dilated.npy')
+    controller = make_controller()
+
+    dilated = nfutil.get_dilated_image_stack(
+        image_stack, experiment, controller, cache_file
+    )
+    (cached,) = tmp_path.iterdir()
+    assert cached.name.startswith('dilated_')
+
+    # the cached stack is reused for the same input...
+    def fail(*args):
+        raise AssertionError('not cached')
+
+    dilate_image_stack = nfutil.dilate_image_stack
+    monkeypatch.setattr(nfutil, 'dilate_image_stack', fail)
+    np.testing.assert_array_equal(
+        nfutil.get_dilated_image_stack(image_stack, experiment, controller, cache_file),
+        dilated,
+    )
+
+    # ... but not for another dilation, or other images
+    monkeypatch.setattr(nfutil, 'dilate_image_stack', dilate_image_stack)
+    experiment.col_dilation = 2
+    nfutil.get_dilated_image_stack(image_stack, experiment, controller, cache_file)
+    image_stack[0, 0, 0] ^= 1
+    result = nfutil.get_dilated_image_stack(
+        image_stack, experiment, controller, cache_file
+    )
+    np.testing.assert_array_equal(result, dilate_reference(image_stack, 1, 2))
+    assert len(list(tmp_path.iterdir())) == 3
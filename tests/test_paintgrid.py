@@ -0,0 +1,65 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from hexrd.core.material.material import Material
+from hexrd.hedm import indexer
+
+
+@pytest.fixture
+def eta_ome_maps(test_data_dir):
+    mat = Material('Si', str(test_data_dir / 'materials' / 'Si.cif'), sgsetting=0)
+    plane_data = mat.planeData
+    plane_data.exclusions = None
+    plane_data.tThMax = np.radians(20)
+
+    rng = np.random.default_rng(0)
+    hkl_ids = plane_data.getHKLID(plane_data.getHKLs(0, 1, 2).T, master=True)
+    eta_edges = np.radians(np.linspace(-180, 180, 361))
+    ome_edges = np.radians(np.linspace(-180, 180, 721))
+    data = [rng.random((720, 360)) for _ in hkl_ids]
+    # a dead region of the detector
+    data[0][100:200, 50:90] = np.nan
+    return SimpleNamespace(
+        planeData=plane_data,
+        iHKLList=hkl_ids,
+        etaEdges=eta_edges,
+        omeEdges=ome_edges,
+        dataStore=data,
+    )
+
+
+@pytest.fixture
+def quats():
+    rng = np.random.default_rng(1)
+    q = rng.normal(size=(4, 257))
+    return q / np.linalg.norm(q, axis=0)
+
+
+@pytest.mark.parametrize('block_size', [1, 64, 4096])
+def test_batched_matches_pool(eta_ome_maps, quats, block_size):
+    kwargs = dict(
+        threshold=0.98,
+        etaRange=np.radians([(-85, 85), (95, 265)]),
+        omegaRange=np.radians([(-60, 60), (120, 240)]),
+    )
+    expected = indexer.paintGrid(quats, eta_ome_maps, engine='pool', **kwargs)
+    result = indexer.paintGrid(
+        quats, eta_ome_maps, doMultiProc=True, nCPUs=2, blockSize=block_size, **kwargs
+    )
+    assert isinstance(result, list)
+    assert np.array_equal(result, expected)
+    assert 0 < np.mean(result) < 1
+
+
+def test_single_quaternion(eta_ome_maps, quats):
+    expected = indexer.paintGrid(quats[:, 3], eta_ome_maps, engine='pool')
+    result = indexer.paintGrid(quats[:, 3], eta_ome_maps)
+    assert len(result) == 1
+    assert result == expected
+
+
+def test_unknown_engine(eta_ome_maps, quats):
+    with pytest.raises(RuntimeError):
+        indexer.paintGrid(quats, eta_ome_maps, engine='gpu')
@@ -0,0 +1,89 @@
+import multiprocessing
+import pickle
+
+import numpy as np
+import pytest
+
+from hexrd.core import imageseries
+from hexrd.core.utils.shared_memory import SharedPickle
+
+
+@pytest.fixture
+def frame_cache(tmp_path):
+    rng = np.random.default_rng(0)
+    data = rng.random((5, 64, 48))
+    data[data < 0.97] = 0
+    ims = imageseries.open(None, 'array', data=data, meta={})
+    fname = tmp_path / 'frame-cache.npz'
+    imageseries.write(
+        ims,
+        str(fname),
+        'frame-cache',
+        style='npz',
+        threshold=0.5,
+        cache_file=str(fname),
+    )
+    fc = imageseries.open(str(fname), 'frame-cache', style='npz')
+    # trigger the load of all the frames
+    fc[0]
+    return data, fc
+
+
+def frame_data(ims):
+    return [ims._adapter._framelist[i].data for i in range(len(ims))]
+
+
+def buffer_of(arr):
+    while isinstance(arr.base, np.ndarray):
+        arr = arr.base
+    return arr.base
+
+
+def load_frames(shared):
+    # runs in a worker process
+    imsd = shared.load()
+    ims = imsd['ff1']
+    data = frame_data(ims)
+    return (
+        np.array([ims[i] for i in range(len(ims))]),
+        all(buffer_of(x) is buffer_of(data[0]) for x in data),
+        any(x.flags.writeable for x in data),
+    )
+
+
+def test_shared_pickle(frame_cache):
+    data, fc = frame_cache
+    small = np.arange(4)
+    obj = dict(ims=fc, big=np.ones((100, 10)), small=small, small2=small)
+    with SharedPickle(obj) as shared:
+        # the frame data is not pickled
+        state = pickle.dumps(shared)
+        assert len(state) < sum(x.nbytes for x in frame_data(fc))
+
+        loaded = pickle.loads(state).load()
+        assert np.array_equal(list(loaded['ims']), data)
+        assert np.array_equal(loaded['big'], obj['big'])
+        assert not loaded['big'].flags.writeable
+        # all the arrays are views of a single block
+        block = buffer_of(loaded['big'])
+        assert all(buffer_of(x) is block for x in frame_data(loaded['ims']))
+
+        # small arrays are pickled, keeping shared references
+        assert loaded['small'] is loaded['small2']
+        assert loaded['small'].flags.writeable
+
+    with pytest.raises(RuntimeError):
+        pickle.dumps(shared)
+
+
+def test_shared_pickle_spawn(frame_cache):
+    data, fc = frame_cache
+    ctx = multiprocessing.get_context('spawn')
+    with SharedPickle({'ff1': fc}) as shared:
+        with ctx.Pool(2) as pool:
+            results = pool.map(load_frames, [shared] * 2)
+
+    for frames, shared_frames, writeable in results:
+        assert np.array_equal(frames, data)
+        assert shared_frames
+        assert not writeable
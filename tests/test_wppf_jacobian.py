@@ -0,0 +1,95 @@
+import numpy as np
+import pytest
+
+from hexrd.core.material.material import Material
+from hexrd.core.valunits import valWUnit
+from hexrd.powder.wppf import LeBail, Rietveld
+
+
+@pytest.fixture
+def si(test_data_dir):
+    return Material('Si', str(test_data_dir / 'materials' / 'Si.cif'), sgsetting=0)
+
+
+def make_model(cls, si, peakshape):
+    tth = np.linspace(20.0, 80.0, 3001)
+    kwargs = dict(
+        phases=[si],
+        wavelength={'synchrotron': [valWUnit('lp', 'length', 0.15406, 'nm'), 1.0]},
+        bkgmethod={'chebyshev': 2},
+        peakshape=peakshape,
+    )
+    model = cls(expt_spectrum=np.vstack([tth, np.full_like(tth, 100.0)]).T, **kwargs)
+    rng = np.random.default_rng(0)
+    y = model.spectrum_sim.y * (1 + 0.05 * rng.random(tth.size)) + 10.0
+    return cls(expt_spectrum=np.vstack([tth, y]).T, jacobian='analytic', **kwargs)
+
+
+def vary(model, names):
+    model.params_vary_off()
+    params = model.params
+    for name in names:
+        params[name].vary = True
+    params['U'].value = 0.01
+    params['V'].value = 0.001
+    params['W'].value = 0.002
+    params['Si_P'].value = 0.001
+    params['Si_X'].value = 0.05
+    params['Si_Y'].value = 0.1
+    params['zero_error'].value = 0.01
+    return params
+
+
+def assert_jacobian(model, params):
+    jac = model.calcJacobian(params)
+    errvec = model.calcRwp(params)
+    names = [n for n, par in params.items() if par.vary]
+    assert jac.shape == (errvec.shape[0], len(names))
+    for j, name in enumerate(names):
+        par = params[name]
+        x0 = par.value
+        h = 1e-8 * max(1.0, abs(x0))
+        par.value = x0 + h
+        ep = model.calcRwp(params)
+        par.value = x0 - h
+        em = model.calcRwp(params)
+        par.value = x0
+        fd = (ep - em) / (2 * h)
+        err = np.abs(jac[:, j] - fd).max()
+        assert err <= 1e-4 * np.abs(fd).max() + 1e-8, name
+
+    # calcJacobian leaves the model at params
+    np.testing.assert_array_equal(model.calcRwp(params), errvec)
+
+
+@pytest.mark.parametrize('peakshape', ['pvtch', 'pvfcj'])
+def test_lebail_jacobian(si, peakshape):
+    # the tapered peak windows keep the spectrum smooth at small steps
+    model = make_model(LeBail, si, peakshape)
+    names = ['Si_a', 'U', 'V', 'W', 'Si_P', 'Si_X', 'Si_Y', 'zero_error']
+    names += ['shft', 'trns', 'bkg_0', 'bkg_1']
+    if peakshape == 'pvfcj':
+        names += ['HL', 'SL']
+    assert_jacobian(model, vary(model, names))
+
+
+def test_rietveld_jacobian(si):
+    model = make_model(Rietveld, si, 'pvtch')
+    names = ['Si_a', 'U', 'Si_X', 'scale', 'Si_Si1_dw', 'Si_eta_fwhm', 'bkg_0']
+    assert_jacobian(model, vary(model, names))
+
+
+def test_refine_analytic(si):
+    model = make_model(LeBail, si, 'pvtch')
+    params = vary(model, ['Si_a', 'U', 'W', 'Si_X', 'Si_Y', 'bkg_0', 'bkg_1'])
+    model.Refine()
+    analytic = model.Rwp
+
+    model = make_model(LeBail, si, 'pvtch')
+    model.jacobian = '2-point'
+    vary(model, [n for n, par in params.items() if par.vary])
+    model.Refine()
+    assert analytic <= model.Rwp * (1 + 1e-3)
+
+    with pytest.raises(ValueError):
+        model.jacobian = 'central'
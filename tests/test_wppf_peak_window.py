@@ -0,0 +1,127 @@
+import numpy as np
+import pytest
+from scipy.special import roots_legendre
+
+from hexrd.powder.wppf import peakfunctions as pf
+
+
+@pytest.fixture
+def peaks():
+    rng = np.random.default_rng(0)
+    nref = 300
+    tth = np.sort(rng.uniform(3.0, 28.0, nref))
+    dsp = 0.2 / (2 * np.sin(np.radians(0.5 * tth)))
+    return dict(
+        uvw=np.array([81.5, 1.0337, 5.18275]),
+        p=0.0,
+        xy=np.array([0.5665, 1.90994]),
+        xy_sf=np.zeros(nref),
+        shkl=np.zeros(15),
+        eta_mixing=0.5,
+        tth=tth,
+        dsp=dsp,
+        hkl=rng.integers(-5, 6, (nref, 3)).astype(float),
+        tth_list=np.linspace(2.0, 30.0, 20001),
+        Iobs=rng.uniform(10.0, 1000.0, nref),
+    )
+
+
+def pvtch_args(peaks):
+    return tuple(
+        peaks[k]
+        for k in (
+            'uvw',
+            'p',
+            'xy',
+            'xy_sf',
+            'shkl',
+            'eta_mixing',
+            'tth',
+            'dsp',
+            'hkl',
+            'tth_list',
+            'Iobs',
+        )
+    )
+
+
+def pvfcj_args(peaks):
+    xn, wn = roots_legendre(16)
+    args = list(pvtch_args(peaks))
+    # HL and SL go in before tth
+    args[6:6] = [1e-3, 1e-3]
+    return tuple(args) + (xn[8:], wn[8:])
+
+
+def test_pvtch_window(peaks, monkeypatch):
+    args = pvtch_args(peaks)
+    expected = np.zeros_like(peaks['tth_list'])
+    heights = np.zeros_like(peaks['tth'])
+    for i, t in enumerate(peaks['tth']):
+        peak = args[:3] + (peaks['xy_sf'][i],) + args[4:6]
+        peak += (t, peaks['dsp'][i], peaks['hkl'][i])
+        expected += peaks['Iobs'][i] * pf.pvoight_wppf(*peak, peaks['tth_list'])
+        heights[i] = peaks['Iobs'][i] * pf.pvoight_wppf(*peak, np.array([t]))[0]
+
+    full = pf.computespectrum_pvtch(*args, window_tol=0.0)
+    np.testing.assert_allclose(full, expected, rtol=1e-12, atol=0)
+
+    tol = 1e-4
+    spec = pf.computespectrum_pvtch(*args, window_tol=tol)
+    np.testing.assert_array_equal(spec, pf.computespectrum_pvtch(*args))
+    # each peak is off by less than tol times its maximum
+    assert np.max(np.abs(spec - expected)) < tol * heights.sum()
+
+    monkeypatch.setattr(pf, 'peak_window_tol', 0.0)
+    np.testing.assert_array_equal(pf.computespectrum_pvtch(*args), full)
+
+
+def test_pvfcj_window(peaks):
+    args = pvfcj_args(peaks)
+    full = pf.computespectrum_pvfcj(*args, window_tol=0.0)
+    spec = pf.computespectrum_pvfcj(*args)
+    # the windowed peaks are normalized over their window
+    assert np.max(np.abs(spec - full)) < 1e-2 * full.max()
+    # and keep their area
+    np.testing.assert_allclose(spec.sum(), full.sum(), rtol=1e-4)
+
+
+@pytest.mark.parametrize('peakshape', ['pvtch', 'pvfcj'])
+def test_window_smooth(peaks, peakshape):
+    # shift one peak over a few steps of the grid, so that the ends of its
+    # window cross grid points: the spectrum changes smoothly
+    peaks = dict(peaks)
+    for k in ('xy_sf', 'tth', 'dsp', 'hkl', 'Iobs'):
+        peaks[k] = peaks[k][150:151]
+    args, func = pvtch_args, pf.computespectrum_pvtch
+    if peakshape == 'pvfcj':
+        args, func = pvfcj_args, pf.computespectrum_pvfcj
+
+    t0 = peaks['tth'][0]
+    specs = np.array(
+        [
+            func(*args(dict(peaks, tth=np.array([t]))))
+            for t in t0 + np.linspace(0.0, 5e-3, 501)
+        ]
+    )
+    d2 = np.abs(specs[2:] - 2 * specs[1:-1] + specs[:-2])
+    assert d2.max() < 1e-6 * specs.max()
+
+
+def test_pvfcj_coarse_grid(peaks):
+    # peaks narrower than the steps of the grid are kept, normalized
+    peaks = dict(peaks, tth_list=np.linspace(2.0, 30.0, 141))
+    spec = pf.computespectrum_pvfcj(*pvfcj_args(peaks))
+    np.testing.assert_allclose(
+        np.trapz(spec, peaks['tth_list']), peaks['Iobs'].sum(), rtol=1e-9
+    )
+
+
+def test_window_descending(peaks):
+    peaks = dict(peaks, tth_list=peaks['tth_list'][::-1].copy())
+    with pytest.raises(ValueError):
+        pf.computespectrum_pvtch(*pvtch_args(peaks))
+    with pytest.raises(ValueError):
+        pf.computespectrum_pvfcj(*pvfcj_args(peaks))
+    # without windows, any order goes
+    pf.computespectrum_pvtch(*pvtch_args(peaks), window_tol=0.0)